@@ -1,6 +1,8 @@
 from flask import Flask
 from flask_cors import CORS
 from models import db
+from json_provider import FastJSONProvider
+import tracing
 import os
 from dotenv import load_dotenv
 
@@ -8,6 +10,7 @@ load_dotenv()
 
 def create_app():
     app = Flask(__name__)
+    app.json = FastJSONProvider(app)
     
     # Configure CORS - Allow all origins for simplicity
     CORS(app, resources={r"/api/*": {"origins": "*"}})
@@ -25,6 +28,7 @@ def create_app():
     
     # Initialize extensions
     db.init_app(app)
+    tracing.init_app(app)
     
     # Create tables
     with app.app_context():
@@ -33,9 +37,11 @@ def create_app():
     # Import and register blueprints
     from auth_api import auth_bp, doc_bp
     from processing_api import processing_bp
+    from upload_api import upload_bp
     
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(doc_bp, url_prefix='/api')
+    app.register_blueprint(upload_bp, url_prefix='/api')
     app.register_blueprint(processing_bp, url_prefix='/api/processing')
     
     # Test routes
@@ -0,0 +1,396 @@
+# async_pipeline.py - asyncio variant of the S3 document pipeline
+#
+# One event loop keeps many documents and LLM requests in flight at once.
+# Prompts, parsing and result assembly are shared with model.py; only the
+# I/O is asynchronous. Inference uses huggingface_hub.AsyncInferenceClient
+# (needs aiohttp) and S3 uses aioboto3 when installed; otherwise each call
+# runs in a worker thread so the loop is never blocked, with at most
+# ASYNC_LLM_THREADS inference calls in flight.
+#
+# Backlog ingestion uses it through model.drain_upload_backlog(use_async=True)
+# (INGEST_USE_ASYNC, or "use_async" on /auto-process), which keeps the
+# ledger, archiving and persistence of the synchronous path.
+import os
+import time
+import asyncio
+import tempfile
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import model
+from model import (Department, DocumentProcessingResult, DuplicateLookup, ProgressCallback,
+                   report_progress)
+from fingerprint import fingerprint_text
+from model_router import token_counts
+from tracing import span
+
+try:
+    import aiohttp  # required by AsyncInferenceClient at call time
+    from huggingface_hub import AsyncInferenceClient
+except ImportError:
+    AsyncInferenceClient = None
+
+try:
+    import aioboto3
+except ImportError:
+    aioboto3 = None
+
+ASYNC_LLM_CONCURRENCY = int(os.getenv('ASYNC_LLM_CONCURRENCY', 200))
+# Inference concurrency when calls run in threads (no aiohttp): one thread per call
+ASYNC_LLM_THREADS = int(os.getenv('ASYNC_LLM_THREADS', 16))
+ASYNC_S3_CONCURRENCY = int(os.getenv('ASYNC_S3_CONCURRENCY', 32))
+ASYNC_DOCUMENT_CONCURRENCY = int(os.getenv('ASYNC_DOCUMENT_CONCURRENCY', 100))
+ASYNC_DOCUMENT_TIMEOUT_SECONDS = float(os.getenv('ASYNC_DOCUMENT_TIMEOUT_SECONDS', 300))
+ASYNC_S3_BACKEND = os.getenv('ASYNC_S3_BACKEND', 'auto')  # auto, aioboto3 or thread
+
+# Shared async inference client; None falls back to model.client in a thread pool
+async_client = AsyncInferenceClient(api_key=model.hf_token) if AsyncInferenceClient else None
+
+class AsyncPipeline:
+    """Clients and concurrency limits shared by the documents of one event loop.
+
+    Use as an async context manager; it opens the aioboto3 client (if any)
+    on entry and closes it and the fallback thread pool on exit.
+    """
+
+    def __init__(self, llm_concurrency: int = ASYNC_LLM_CONCURRENCY,
+                 s3_concurrency: int = ASYNC_S3_CONCURRENCY,
+                 s3_backend: str = ASYNC_S3_BACKEND):
+        if s3_backend == 'auto':
+            s3_backend = 'aioboto3' if aioboto3 else 'thread'
+        if s3_backend == 'aioboto3' and not aioboto3:
+            raise ValueError('ASYNC_S3_BACKEND=aioboto3 but aioboto3 is not installed')
+        if s3_backend not in ('aioboto3', 'thread'):
+            raise ValueError(f'Unknown async S3 backend: {s3_backend}')
+        self.s3_backend = s3_backend
+        if async_client is None:
+            # Blocking inference calls hold a thread each; keep that pool small
+            llm_concurrency = min(llm_concurrency, ASYNC_LLM_THREADS)
+        self.llm_limit = asyncio.Semaphore(llm_concurrency)
+        self.s3_limit = asyncio.Semaphore(s3_concurrency)
+        self._executor = None if async_client else ThreadPoolExecutor(llm_concurrency, thread_name_prefix='llm')
+        self._s3 = None
+        self._s3_context = None
+        self.llm_in_flight = 0
+        self.peak_llm_in_flight = 0
+
+    async def __aenter__(self):
+        if self.s3_backend == 'aioboto3':
+            session = aioboto3.Session(
+                aws_access_key_id=model.AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=model.AWS_SECRET_ACCESS_KEY,
+                region_name=model.AWS_REGION
+            )
+            self._s3_context = session.client('s3')
+            self._s3 = await self._s3_context.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._s3_context is not None:
+            await self._s3_context.__aexit__(exc_type, exc, tb)
+            self._s3 = self._s3_context = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    async def _in_llm_thread(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+        return await loop.run_in_executor(self._executor, call)
+
+    async def call_llm(self, prompt: str, system_message: str = None, max_tokens: Optional[int] = None,
+                       stage: Optional[str] = None) -> Tuple[str, Optional[str]]:
+        """Async counterpart of model.call_llm; same routing and fallback, returns (response, model)
+        or ("", None) when every model fails"""
+        messages = []
+        if system_message:
+            messages.append({"role": "system", "content": system_message})
+        messages.append({"role": "user", "content": prompt})
+        route = model.model_router.route(stage)
+
+        async with self.llm_limit:
+            self.llm_in_flight += 1
+            self.peak_llm_in_flight = max(self.peak_llm_in_flight, self.llm_in_flight)
+            try:
+                for model_name in model.model_router.candidates(stage):
+                    with span('llm.chat_completion', 'CLIENT', **{
+                        'llm.model': model_name,
+                        'llm.stage': stage or 'default',
+                        'llm.max_tokens': max_tokens or route.max_tokens,
+                        'llm.prompt_chars': len(prompt),
+                        'llm.async': True
+                    }) as llm_span:
+                        started = time.perf_counter()
+                        try:
+                            options = dict(model=model_name, messages=messages,
+                                           max_tokens=max_tokens or route.max_tokens,
+                                           temperature=route.temperature)
+                            if async_client is not None:
+                                completion = await async_client.chat.completions.create(**options)
+                            else:
+                                completion = await self._in_llm_thread(model.client.chat.completions.create, **options)
+                            response = completion.choices[0].message.content or ''
+                        except Exception as e:
+                            model.model_router.record(model_name, stage, time.perf_counter() - started, False)
+                            print(f"Error calling LLM {model_name}: {e}")
+                            llm_span.record_exception(e)
+                            continue
+
+                        model.model_router.record(model_name, stage, time.perf_counter() - started, True,
+                                                  *token_counts(completion, len(prompt), response))
+                        llm_span.set_attribute('llm.response_chars', len(response))
+                        return response.strip(), model_name
+                return "", None
+            finally:
+                self.llm_in_flight -= 1
+
+    async def download(self, s3_key: str, local_path: str):
+        async with self.s3_limit:
+            with span('stage.download_from_s3'):
+                if self._s3 is not None:
+                    await self._s3.download_file(model.AWS_S3_BUCKET, s3_key, local_path)
+                else:
+                    await asyncio.to_thread(model.s3_client.download_file, model.AWS_S3_BUCKET, s3_key, local_path)
+        print(f"✅ Downloaded from S3: {s3_key}")
+
+    async def upload(self, local_path: str, department: str, document_type: str) -> Dict[str, str]:
+        upload = model.processed_upload_args(local_path, department, document_type)
+        async with self.s3_limit:
+            with span('stage.upload_to_s3'):
+                if self._s3 is not None:
+                    await self._s3.upload_file(local_path, model.AWS_S3_BUCKET, upload['Key'],
+                                               ExtraArgs=upload['ExtraArgs'])
+                else:
+                    await asyncio.to_thread(model.s3_client.upload_file, local_path, model.AWS_S3_BUCKET,
+                                            upload['Key'], ExtraArgs=upload['ExtraArgs'])
+        print(f"✅ Uploaded to S3: {upload['Key']}")
+        return {'key': upload['Key'], 'url': model.s3_object_url(upload['Key'])}
+
+    async def copy(self, s3_key: str, department: str, document_type: str) -> Dict[str, str]:
+        async with self.s3_limit:
+            return await asyncio.to_thread(model.copy_to_processed, s3_key, department, document_type)
+
+    async def store_processed_copy(self, s3_key: str, local_path: Optional[str],
+                                   department: str, document_type: str) -> Dict[str, str]:
+        if local_path:
+            return await self.upload(local_path, department, document_type)
+        return await self.copy(s3_key, department, document_type)
+
+    async def load_text(self, s3_key: str, etag: Optional[str]):
+        """Async counterpart of model.load_document_text; returns (local_path, text)"""
+        try:
+            raw_text = await asyncio.to_thread(model.text_store.get, etag)
+        except Exception as e:
+            print(f"⚠️  Text store read failed for {s3_key}: {e}")
+            raw_text = None
+        if raw_text is not None:
+            return None, raw_text
+
+        fd, local_path = tempfile.mkstemp(suffix=os.path.splitext(s3_key)[1])
+        os.close(fd)
+        try:
+            await self.download(s3_key, local_path)
+            raw_text = await asyncio.to_thread(model.extract_text_from_file, local_path)
+        except BaseException:
+            _remove(local_path)
+            raise
+        try:
+            await asyncio.to_thread(model.text_store.put, etag, raw_text)
+        except Exception as e:
+            print(f"⚠️  Text store write failed for {s3_key}: {e}")
+        return local_path, raw_text
+
+    async def llm_stage(self, name: str, request: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+        with span(f'stage.{name}'):
+            return await self.call_llm(**request)
+
+def _remove(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"⚠️  Could not remove {path}: {e}")
+
+async def _process_document(s3_key: str, pipeline: AsyncPipeline,
+                            duplicate_lookup: Optional[DuplicateLookup],
+                            progress: Optional[ProgressCallback],
+                            etag: Optional[str]) -> DocumentProcessingResult:
+    print(f"🚀 Processing S3 document: {s3_key}")
+    local_path = None
+
+    with span('process_s3_document', s3_key=s3_key, **{'pipeline.async': True}) as doc_span:
+        try:
+            if etag is None and model.text_store.enabled:
+                etag = await asyncio.to_thread(model.get_object_etag, s3_key)
+
+            local_path, raw_text = await pipeline.load_text(s3_key, etag)
+            report_progress(progress, 'downloaded', s3_key)
+            report_progress(progress, 'extracted', s3_key, characters=len(raw_text))
+
+            with span('stage.fingerprint_text'):
+                fingerprint = fingerprint_text(raw_text)
+            if duplicate_lookup:
+                with span('stage.duplicate_lookup') as lookup_span:
+                    duplicate = await asyncio.to_thread(duplicate_lookup, fingerprint)
+                    lookup_span.set_attribute('duplicate.found', bool(duplicate))
+                if duplicate:
+                    doc_span.set_attribute('document.duplicate_of', duplicate['id'])
+                    result = await asyncio.to_thread(model.reuse_duplicate_analysis, s3_key, local_path,
+                                                     raw_text, fingerprint, duplicate, progress)
+                    if etag:
+                        result.metadata['etag'] = etag
+                    return result
+
+            stage_models = {}
+            response, stage_models['classify_document'] = await pipeline.llm_stage(
+                'classify_document', model.classification_request(raw_text))
+            doc_type = model.parse_document_type(response)
+            department = model.determine_department(doc_type, raw_text)
+            report_progress(progress, 'classified', s3_key, document_type=doc_type.value, department=department.value)
+
+            # The remaining LLM stages only depend on the text and type, so they run concurrently
+            requests = {
+                'create_summary': model.summary_request(raw_text, doc_type),
+                'extract_key_points': model.key_points_request(raw_text),
+                'extract_action_items': model.action_items_request(raw_text),
+                'extract_deadline': model.deadline_request(raw_text)
+            }
+            answers = await asyncio.gather(*(pipeline.llm_stage(name, request)
+                                             for name, request in requests.items()))
+            responses = {}
+            for name, (response, model_name) in zip(requests, answers):
+                responses[name], stage_models[name] = response, model_name
+            report_progress(progress, 'summarized', s3_key, department=department.value)
+
+            priority = model.determine_priority(raw_text)
+            doc_span.set_attribute('document.department', department.value)
+            doc_span.set_attribute('document.type', doc_type.value)
+
+            s3_result = await pipeline.store_processed_copy(s3_key, local_path, department.value, doc_type.value)
+            print(f"✅ Document processing complete: {s3_key}")
+
+            result = model.build_processing_result(
+                s3_key, local_path, raw_text, fingerprint, doc_type, department,
+                model.parse_summary(responses['create_summary'], raw_text),
+                model.parse_items(responses['extract_key_points']),
+                model.parse_items(responses['extract_action_items']),
+                model.parse_deadline(responses['extract_deadline']), priority, s3_result, stage_models
+            )
+            if etag:
+                result.metadata['etag'] = etag
+            return result
+        except Exception as e:
+            print(f"❌ Error processing S3 document: {e}")
+            report_progress(progress, 'failed', s3_key, error=str(e))
+            raise
+        finally:
+            if local_path:
+                _remove(local_path)
+
+async def process_s3_document_async(s3_key: str,
+                                    duplicate_lookup: Optional[DuplicateLookup] = None,
+                                    progress: Optional[ProgressCallback] = None,
+                                    timeout: Optional[float] = ASYNC_DOCUMENT_TIMEOUT_SECONDS,
+                                    pipeline: Optional[AsyncPipeline] = None,
+                                    etag: Optional[str] = None) -> DocumentProcessingResult:
+    """Process a document from S3 without blocking the event loop
+
+    Same hooks and result as model.process_s3_document. The whole document
+    must finish within timeout seconds; on expiry its in-flight requests are
+    cancelled, its temporary file is removed and asyncio.TimeoutError is raised.
+    """
+    if pipeline is None:
+        async with AsyncPipeline() as pipeline:
+            return await process_s3_document_async(s3_key, duplicate_lookup, progress, timeout, pipeline, etag)
+
+    try:
+        return await asyncio.wait_for(_process_document(s3_key, pipeline, duplicate_lookup, progress, etag), timeout)
+    except asyncio.TimeoutError:
+        print(f"⏱️  Timed out after {timeout}s: {s3_key}")
+        report_progress(progress, 'failed', s3_key, error=f'timed out after {timeout}s')
+        raise
+
+async def batch_process_s3_documents_async(s3_keys: List[str],
+                                           duplicate_lookup: Optional[DuplicateLookup] = None,
+                                           progress: Optional[ProgressCallback] = None,
+                                           concurrency: int = ASYNC_DOCUMENT_CONCURRENCY,
+                                           document_timeout: Optional[float] = ASYNC_DOCUMENT_TIMEOUT_SECONDS,
+                                           batch_timeout: Optional[float] = None,
+                                           pipeline: Optional[AsyncPipeline] = None,
+                                           etags: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Process up to concurrency documents at a time and organize them by department
+
+    Each document has its own deadline (document_timeout). When batch_timeout
+    expires the unfinished documents are cancelled and listed under
+    'cancelled'; they stay in uploads/ for the next run. If the caller is
+    cancelled, every document task is cancelled and awaited before the
+    CancelledError propagates, so no work outlives the batch. etags maps
+    keys to known ETags so the text store can be consulted without a HEAD.
+    """
+    if pipeline is None:
+        async with AsyncPipeline() as pipeline:
+            return await batch_process_s3_documents_async(s3_keys, duplicate_lookup, progress, concurrency,
+                                                          document_timeout, batch_timeout, pipeline, etags)
+
+    started = time.monotonic()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run_one(s3_key: str) -> DocumentProcessingResult:
+        async with slots:
+            return await process_s3_document_async(s3_key, duplicate_lookup, progress, document_timeout, pipeline,
+                                                   (etags or {}).get(s3_key))
+
+    tasks = {asyncio.ensure_future(run_one(s3_key)): s3_key for s3_key in s3_keys}
+    pending = set()
+    if tasks:
+        try:
+            _, pending = await asyncio.wait(tasks, timeout=batch_timeout)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    results_by_department: Dict[Department, List[DocumentProcessingResult]] = {dept: [] for dept in Department}
+    failed: List[Dict[str, str]] = []
+    timed_out: List[str] = []
+    cancelled: List[str] = []
+    for task, s3_key in tasks.items():
+        if task in pending or task.cancelled():
+            cancelled.append(s3_key)
+            report_progress(progress, 'failed', s3_key, error='batch deadline exceeded')
+            continue
+        error = task.exception()
+        if error is None:
+            result = task.result()
+            results_by_department[result.department].append(result)
+        elif isinstance(error, asyncio.TimeoutError):
+            timed_out.append(s3_key)
+        else:
+            print(f"Failed to process {s3_key}: {error}")
+            failed.append({'s3_key': s3_key, 'error': str(error)})
+
+    processed = sum(len(results) for results in results_by_department.values())
+    print(f"📥 Async batch: {processed} processed, {len(failed)} failed, "
+          f"{len(timed_out)} timed out, {len(cancelled)} cancelled")
+    return {
+        'results_by_department': results_by_department,
+        'total_processed': processed,
+        'failed': failed,
+        'timed_out': timed_out,
+        'cancelled': cancelled,
+        'peak_llm_in_flight': pipeline.peak_llm_in_flight,
+        'elapsed_seconds': round(time.monotonic() - started, 3)
+    }
+
+def run_async_batch(s3_keys: List[str],
+                    duplicate_lookup: Optional[DuplicateLookup] = None,
+                    progress: Optional[ProgressCallback] = None,
+                    **options) -> Dict[str, Any]:
+    """Run batch_process_s3_documents_async from synchronous code (a worker thread or script)"""
+    return asyncio.run(batch_process_s3_documents_async(s3_keys, duplicate_lookup, progress, **options))
@@ -7,8 +7,21 @@ import uuid
 import boto3
 from botocore.exceptions import NoCredentialsError, ClientError
 from dotenv import load_dotenv
-import jwt
 import datetime
+import base64
+import hashlib
+from auth_middleware import (
+    auth_required,
+    authenticate_credentials,
+    generate_token,
+    remember_user,
+    user_state_cache
+)
+from url_cache import presigned_url_cache, PRESIGNED_URL_EXPIRES, PRESIGNED_URL_MIN_REMAINING
+from versioning import conditional_get, documents_version, time_bucket
+from json_provider import stream_json_array
+from itertools import islice
+from tracing import instrument_boto3_client
 
 load_dotenv()
 
@@ -24,135 +37,165 @@ DEPARTMENTS = ['engineering', 'operations', 'procurement', 'hr', 'safety', 'comp
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Rows fetched and serialized per step when streaming list responses
+STREAM_BATCH_SIZE = 500
+
+def batched(iterable, size):
+    """Yield lists of up to size items from an iterable"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
 # AWS S3 Configuration
 AWS_S3_BUCKET = os.getenv('AWS_S3_BUCKET')
 AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
 
+_s3_client = None
+
 def get_s3_client():
-    return boto3.client(
-        's3',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        region_name=AWS_REGION
+    """Return the shared S3 client (boto3 clients are thread-safe)"""
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = instrument_boto3_client(boto3.client(
+            's3',
+            aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+            region_name=AWS_REGION
+        ))
+    return _s3_client
+
+def s3_key_from_url(file_path):
+    """Extract the S3 key from a stored https S3 URL"""
+    return file_path.split(f'https://{AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/')[-1]
+
+def sign_get_url(s3_key, expires_in=PRESIGNED_URL_EXPIRES):
+    return get_s3_client().generate_presigned_url(
+        'get_object',
+        Params={
+            'Bucket': AWS_S3_BUCKET,
+            'Key': s3_key
+        },
+        ExpiresIn=expires_in
     )
 
-# JWT Configuration
-JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'infradoc-ai-secret-jwt-key-2024')
-
-def generate_token(user_id, username, role, department):
-    """Generate JWT token"""
-    payload = {
-        'user_id': user_id,
-        'username': username,
-        'role': role,
-        'department': department,
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
-    }
-    return jwt.encode(payload, JWT_SECRET_KEY, algorithm='HS256')
-
-def verify_token(token):
-    """Verify JWT token"""
-    try:
-        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=['HS256'])
-        return payload
-    except jwt.ExpiredSignatureError:
-        return None
-    except jwt.InvalidTokenError:
-        return None
+def presigned_get_url(s3_key, scope, expires_in=PRESIGNED_URL_EXPIRES):
+    """Presigned download URL for a key, served from cache while still fresh"""
+    return presigned_url_cache.get_or_sign(s3_key, 'get_object', scope, sign_get_url, expires_in)
 
-def authenticate_user(username, password, required_role=None):
-    """Authenticate user and check optional role requirement"""
-    user = User.query.filter_by(username=username).first()
-    
-    if not user:
-        print(f"❌ User not found: {username}")
-        return None
-    
-    if not user.check_password(password):
-        print(f"❌ Password incorrect for user: {username}")
-        return None
-    
-    if not user.is_active:
-        print(f"❌ User inactive: {username}")
-        return None
-    
-    if required_role and user.role != required_role:
-        print(f"❌ Role mismatch. Required: {required_role}, User has: {user.role}")
-        return None
-    
-    return user
+def presigned_get_urls(s3_keys, scope):
+    """Presigned download URLs for a page of keys, signing only cache misses"""
+    return presigned_url_cache.get_or_sign_many(s3_keys, 'get_object', scope, sign_get_url)
+
+# Streaming upload settings (S3 multipart parts must be at least 5MB)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
 
-def get_user_from_request():
-    """Extract user credentials from request - supports multiple methods"""
+def read_chunk(fileobj, size):
+    """Read up to size bytes, looping over short reads until EOF"""
+    buffer = bytearray()
+    while len(buffer) < size:
+        data = fileobj.read(size - len(buffer))
+        if not data:
+            break
+        buffer.extend(data)
+    return bytes(buffer)
+
+def stream_to_s3(s3_client, fileobj, key, content_type, metadata, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Stream a file object to S3 chunk by chunk, hashing it on the way.
     
-    # Method 1: Try JWT token in Authorization header
-    auth_header = request.headers.get('Authorization')
-    if auth_header and auth_header.startswith('Bearer '):
-        token = auth_header.split(' ')[1]
-        payload = verify_token(token)
-        if payload:
-            user = User.query.get(payload['user_id'])
-            if user:
-                return user.username, None  # Return username, no password needed
+    Only one chunk is held in memory at a time. Returns (size, sha256 hex digest).
+    """
+    digest = hashlib.sha256()
+    chunk = read_chunk(fileobj, chunk_size)
+    digest.update(chunk)
     
-    # Method 2: Try JSON body
-    data = request.get_json(silent=True)
-    if data:
-        username = data.get('username')
-        password = data.get('password')
-        if username and password:
-            print(f"📝 Got credentials from JSON: {username}")
-            return username, password
+    # Files smaller than one chunk fit in a single PUT
+    if len(chunk) < chunk_size:
+        s3_client.put_object(
+            Bucket=AWS_S3_BUCKET,
+            Key=key,
+            Body=chunk,
+            ContentType=content_type,
+            Metadata=metadata
+        )
+        return len(chunk), digest.hexdigest()
     
-    # Method 3: Try form data
-    username = request.form.get('username')
-    password = request.form.get('password')
-    if username and password:
-        print(f"📝 Got credentials from form: {username}")
-        return username, password
+    upload = s3_client.create_multipart_upload(
+        Bucket=AWS_S3_BUCKET,
+        Key=key,
+        ContentType=content_type,
+        Metadata=metadata
+    )
+    upload_id = upload['UploadId']
+    parts = []
+    size = 0
     
-    # Method 4: Try query parameters
-    username = request.args.get('username')
-    password = request.args.get('password')
-    if username and password:
-        print(f"📝 Got credentials from query: {username}")
-        return username, password
+    try:
+        while chunk:
+            size += len(chunk)
+            part_number = len(parts) + 1
+            response = s3_client.upload_part(
+                Bucket=AWS_S3_BUCKET,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=chunk
+            )
+            parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+            chunk = read_chunk(fileobj, chunk_size)
+            digest.update(chunk)
+        
+        s3_client.complete_multipart_upload(
+            Bucket=AWS_S3_BUCKET,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+    except Exception:
+        s3_client.abort_multipart_upload(Bucket=AWS_S3_BUCKET, Key=key, UploadId=upload_id)
+        raise
     
-    print("❌ No credentials found in request")
-    return None, None
-
-def auth_required(required_role=None):
-    """Decorator for authentication"""
-    def decorator(f):
-        def wrapper(*args, **kwargs):
-            print(f"🔐 Auth required for endpoint: {request.path}")
-            username, password = get_user_from_request()
-            
-            if not username:
-                print("❌ Missing username")
-                return jsonify({'error': 'Authentication required'}), 401
-            
-            # If we have a JWT token (password is None), we need to get the user differently
-            if password is None:
-                # Get user from database
-                user = User.query.filter_by(username=username).first()
-                if not user:
-                    print(f"❌ User not found: {username}")
-                    return jsonify({'error': 'Invalid credentials'}), 401
-            else:
-                # Use password authentication
-                user = authenticate_user(username, password, required_role)
-                if not user:
-                    print(f"❌ Authentication failed for user: {username}")
-                    return jsonify({'error': 'Invalid credentials or insufficient permissions'}), 401
-            
-            print(f"✅ User authenticated: {username}")
-            # Attach user to request context
-            request.user = user
-            return f(*args, **kwargs)
-        wrapper.__name__ = f.__name__
-        return wrapper
-    return decorator
+    return size, digest.hexdigest()
+
+def checksum_to_sha256(checksum):
+    """Content hash for an S3 ChecksumSHA256 value.
+
+    Whole-object checksums become hex digests comparable with stream_to_s3's;
+    multipart composites ("<base64>-<parts>") only match uploads with identical
+    parts and are kept as they are.
+    """
+    if not checksum:
+        return None
+    if '-' in checksum:
+        return checksum
+    return base64.b64decode(checksum).hex()
+
+def find_duplicate_document(department, content_sha256):
+    """Find an active document with identical content in a department"""
+    if not content_sha256:
+        return None
+    return Document.query.filter_by(
+        department=department,
+        content_sha256=content_sha256,
+        status='active'
+    ).first()
+
+def reuse_identical_object(s3_client, department, content_sha256, key):
+    """(s3_url, s3_key, existing document) for a newly stored object.
+
+    When an active document of the department has identical content (by the
+    server-computed hash), the new object is deleted and the existing one is
+    referenced instead; the caller still records a document of their own.
+    """
+    existing = find_duplicate_document(department, content_sha256)
+    if not existing:
+        return f"https://{AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{key}", key, None
+    s3_client.delete_object(Bucket=AWS_S3_BUCKET, Key=key)
+    presigned_url_cache.invalidate(key)
+    print(f"♻️  Identical content already stored for document {existing.id}, reusing its object")
+    return existing.file_path, s3_key_from_url(existing.file_path), existing
 
 @auth_bp.route('/register', methods=['POST'])
 def register():
@@ -219,6 +262,7 @@ def login():
         # Update last login
         user.last_login = datetime.datetime.utcnow()
         db.session.commit()
+        remember_user(user)
         
         # Generate JWT token
         token = generate_token(user.id, user.username, user.role, user.department)
@@ -241,7 +285,7 @@ def logout():
 @auth_required()
 def get_current_user_info():
     try:
-        user = request.user
+        user = User.query.get_or_404(request.user.id)
         return jsonify(user.to_dict())
         
     except Exception as e:
@@ -331,7 +375,7 @@ def upload_document_s3():
             print("❌ Missing credentials in form data")
             return jsonify({'error': 'Authentication required'}), 401
         
-        user = authenticate_user(username, password)
+        user = authenticate_credentials(username, password)
         if not user:
             print("❌ Authentication failed in upload-s3")
             return jsonify({'error': 'Invalid credentials'}), 401
@@ -374,34 +418,28 @@ def upload_document_s3():
         s3_client = get_s3_client()
         
         try:
-            # Get file content for size calculation
-            file_content = file.read()
-            file_size = len(file_content)
-            file.seek(0)  # Reset file pointer for upload
-            
-            print(f"📊 File size: {file_size} bytes")
-            
-            # Upload file to S3
-            s3_client.upload_fileobj(
-                file,
-                AWS_S3_BUCKET,
+            # Stream the file to S3, computing size and SHA-256 on the way
+            file_size, content_sha256 = stream_to_s3(
+                s3_client,
+                file.stream,
                 unique_filename,
-                ExtraArgs={
-                    'ContentType': file.content_type,
-                    'Metadata': {
-                        'uploaded-by': user.username,
-                        'department': department,
-                        'category': category,
-                        'original-filename': filename,
-                        'processed': 'false'
-                    }
+                file.content_type,
+                {
+                    'uploaded-by': user.username,
+                    'department': department,
+                    'category': category,
+                    'original-filename': filename,
+                    'processed': 'false'
                 }
             )
             
-            print(f"✅ File uploaded to S3: {unique_filename}")
+            print(f"📊 File size: {file_size} bytes, sha256: {content_sha256}")
             
-            # Generate S3 URL
-            s3_url = f"https://{AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{unique_filename}"
+            # Identical content shares the stored object; the caller still gets their own document
+            s3_url, unique_filename, existing = reuse_identical_object(
+                s3_client, department, content_sha256, unique_filename)
+            if not existing:
+                print(f"✅ File uploaded to S3: {unique_filename}")
             
             # Create document record in database
             document = Document(
@@ -415,7 +453,8 @@ def upload_document_s3():
                 category=category,
                 tags=tags,
                 uploaded_by=user.id,
-                status='active'
+                status='active',
+                content_sha256=content_sha256
             )
             
             db.session.add(document)
@@ -427,7 +466,8 @@ def upload_document_s3():
                 'message': 'File uploaded to S3 successfully',
                 'document': document.to_dict(),
                 's3_url': s3_url,
-                's3_key': unique_filename
+                's3_key': unique_filename,
+                'duplicate': bool(existing)
             }), 201
             
         except NoCredentialsError:
@@ -444,8 +484,23 @@ def upload_document_s3():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+def documents_list_version():
+    """Version parts of the /documents response for the current caller"""
+    user = request.user
+    department = request.args.get('department')
+    if user.role != 'admin' and user.department != 'admin':
+        department = user.department
+    elif department not in DEPARTMENTS:
+        department = None
+    parts = [documents_version(department)]
+    # Embedded presigned URLs must be refreshed before they go stale
+    if request.args.get('include_urls', '').lower() in ('1', 'true'):
+        parts.append(time_bucket(PRESIGNED_URL_MIN_REMAINING))
+    return parts
+
 @doc_bp.route('/documents', methods=['GET'])
 @auth_required()
+@conditional_get(documents_list_version)
 def get_documents():
     try:
         user = request.user
@@ -471,9 +526,28 @@ def get_documents():
                 (Document.tags.contains(search))
             )
         
-        documents = query.order_by(Document.created_at.desc()).all()
+        documents = query.order_by(Document.created_at.desc()).yield_per(STREAM_BATCH_SIZE)
+        include_urls = request.args.get('include_urls', '').lower() in ('1', 'true')
+        scope = user.department
+        
+        def rows():
+            for batch in batched(documents, STREAM_BATCH_SIZE):
+                results = [doc.to_dict() for doc in batch]
+                
+                # Sign download URLs for the whole batch in one pass
+                if include_urls:
+                    s3_keys = {
+                        doc.id: s3_key_from_url(doc.file_path)
+                        for doc in batch if doc.file_path.startswith('https://')
+                    }
+                    urls = presigned_get_urls(s3_keys.values(), scope)
+                    for result in results:
+                        s3_key = s3_keys.get(result['id'])
+                        result['download_url'] = urls[s3_key] if s3_key else None
+                
+                yield from results
         
-        return jsonify([doc.to_dict() for doc in documents])
+        return stream_json_array(rows())
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -513,17 +587,8 @@ def download_document(doc_id):
         
         # Check if file is in S3 or local
         if document.file_path.startswith('https://'):
-            # File is in S3 - generate presigned URL
-            s3_key = document.file_path.split(f'https://{AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/')[-1]
-            s3_client = get_s3_client()
-            presigned_url = s3_client.generate_presigned_url(
-                'get_object',
-                Params={
-                    'Bucket': AWS_S3_BUCKET,
-                    'Key': s3_key
-                },
-                ExpiresIn=3600  # URL expires in 1 hour
-            )
+            # File is in S3 - reuse a cached presigned URL while it is still fresh
+            presigned_url = presigned_get_url(s3_key_from_url(document.file_path), user.department)
             
             # Increment download count
             document.downloads += 1
@@ -559,19 +624,8 @@ def get_presigned_url(doc_id):
         if not document.file_path.startswith('https://'):
             return jsonify({'error': 'File is not stored in S3'}), 400
         
-        # Extract filename from S3 URL
-        s3_key = document.file_path.split(f'https://{AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/')[-1]
-        
-        # Generate presigned URL
-        s3_client = get_s3_client()
-        presigned_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={
-                'Bucket': AWS_S3_BUCKET,
-                'Key': s3_key
-            },
-            ExpiresIn=3600  # URL expires in 1 hour
-        )
+        # Reuse a cached presigned URL while it is still fresh
+        presigned_url = presigned_get_url(s3_key_from_url(document.file_path), user.department)
         
         return jsonify({
             'presigned_url': presigned_url,
@@ -609,6 +663,9 @@ def update_user(user_id):
         
         db.session.commit()
         
+        # Cached auth state must not outlive a role/department/active change
+        user_state_cache.invalidate(target_user.id)
+        
         return jsonify({
             'message': 'User updated successfully',
             'user': target_user.to_dict()
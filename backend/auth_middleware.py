@@ -0,0 +1,220 @@
+# auth_middleware.py - Shared request authentication with an in-memory user-state cache
+import os
+import hmac
+import time
+import hashlib
+import datetime
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from flask import request, jsonify
+import jwt
+from models import db, User
+
+# JWT Configuration
+JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'infradoc-ai-secret-jwt-key-2024')
+
+# How long a verified credential is trusted without checking the password hash again
+AUTH_CACHE_TTL = int(os.getenv('AUTH_CACHE_TTL', 300))
+# How long a cached role/department/active state is trusted without a DB read. The
+# cache is per process and invalidate() only reaches the worker that ran it, so this
+# bounds how long other workers honour a revoked role or deactivated account.
+AUTH_STATE_TTL = int(os.getenv('AUTH_STATE_TTL', 30))
+
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    """Request principal built from signed claims and cached user state"""
+    id: int
+    username: str
+    role: str
+    department: str
+    is_active: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> 'AuthenticatedUser':
+        return cls(
+            id=user.id,
+            username=user.username,
+            role=user.role,
+            department=user.department,
+            is_active=bool(user.is_active)
+        )
+
+class UserStateCache:
+    """Per-process cache of user role/department/active state and verified credentials"""
+
+    def __init__(self, ttl: int = AUTH_CACHE_TTL, state_ttl: int = AUTH_STATE_TTL):
+        self.ttl = ttl
+        self.state_ttl = state_ttl
+        self._states: Dict[int, Tuple[AuthenticatedUser, float]] = {}
+        self._credentials: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[AuthenticatedUser]:
+        entry = self._states.get(user_id)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+        return None
+
+    def put(self, state: AuthenticatedUser):
+        with self._lock:
+            self._states[state.id] = (state, time.monotonic() + self.state_ttl)
+
+    def get_credential(self, digest: str) -> Optional[int]:
+        entry = self._credentials.get(digest)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+        return None
+
+    def put_credential(self, digest: str, user_id: int):
+        with self._lock:
+            self._credentials[digest] = (user_id, time.monotonic() + self.ttl)
+
+    def invalidate(self, user_id: int):
+        """Forget a user's state and verified credentials (role/active/department changed).
+
+        Only this process is affected; other workers reload within state_ttl.
+        """
+        with self._lock:
+            self._states.pop(user_id, None)
+            for digest in [d for d, (uid, _) in self._credentials.items() if uid == user_id]:
+                del self._credentials[digest]
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+            self._credentials.clear()
+
+user_state_cache = UserStateCache()
+
+def generate_token(user_id, username, role, department):
+    """Generate JWT token"""
+    payload = {
+        'user_id': user_id,
+        'username': username,
+        'role': role,
+        'department': department,
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
+    }
+    return jwt.encode(payload, JWT_SECRET_KEY, algorithm='HS256')
+
+def verify_token(token):
+    """Verify JWT token"""
+    try:
+        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=['HS256'])
+        return payload
+    except jwt.ExpiredSignatureError:
+        return None
+    except jwt.InvalidTokenError:
+        return None
+
+def remember_user(user: User) -> AuthenticatedUser:
+    """Cache the current state of a user loaded from the database"""
+    state = AuthenticatedUser.from_user(user)
+    user_state_cache.put(state)
+    return state
+
+def load_user_state(user_id) -> Optional[AuthenticatedUser]:
+    """User state from cache, falling back to one DB read on a cold cache"""
+    state = user_state_cache.get(user_id)
+    if state:
+        return state
+    user = User.query.get(user_id)
+    if not user:
+        return None
+    return remember_user(user)
+
+def credential_digest(username, password):
+    """Keyed digest of a username/password pair, so plaintext is never cached"""
+    message = f"{username}\0{password}".encode('utf-8')
+    return hmac.new(JWT_SECRET_KEY.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+def authenticate_credentials(username, password) -> Optional[AuthenticatedUser]:
+    """Check a username/password pair, skipping the password hash once verified"""
+    digest = credential_digest(username, password)
+    user_id = user_state_cache.get_credential(digest)
+    if user_id is not None:
+        state = load_user_state(user_id)
+    else:
+        user = User.query.filter_by(username=username).first()
+        if not user or not user.check_password(password):
+            print(f"❌ Invalid credentials for user: {username}")
+            return None
+        state = remember_user(user)
+        user_state_cache.put_credential(digest, user.id)
+
+    if not state or not state.is_active:
+        print(f"❌ User inactive: {username}")
+        return None
+    return state
+
+def get_credentials_from_request():
+    """Username/password from JSON body, form data or query parameters"""
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and data.get('username') and data.get('password'):
+        return data['username'], data['password']
+
+    for source in (request.form, request.args):
+        username = source.get('username')
+        password = source.get('password')
+        if username and password:
+            return username, password
+
+    return None, None
+
+def authenticate_token(token) -> Optional[AuthenticatedUser]:
+    """User state for a valid JWT of an active user"""
+    payload = verify_token(token)
+    if not payload:
+        return None
+    state = load_user_state(payload['user_id'])
+    if state and state.is_active:
+        return state
+    return None
+
+def authenticate_request() -> Optional[AuthenticatedUser]:
+    """Authenticate the current request from a bearer token or credentials"""
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        state = authenticate_token(auth_header.split(' ', 1)[1])
+        if state:
+            return state
+
+    username, password = get_credentials_from_request()
+    if username and password:
+        return authenticate_credentials(username, password)
+
+    return None
+
+def authenticate_stream_request() -> Optional[AuthenticatedUser]:
+    """authenticate_request, plus an access_token query parameter.
+
+    Only for Server-Sent Events streams: EventSource cannot set an
+    Authorization header. Query strings end up in access logs and browser
+    history, so no other endpoint accepts a JWT this way.
+    """
+    state = authenticate_request()
+    if state:
+        return state
+
+    access_token = request.args.get('access_token')
+    if access_token:
+        return authenticate_token(access_token)
+    return None
+
+def auth_required(required_role=None, authenticate=authenticate_request):
+    """Decorator for authentication, shared by every blueprint"""
+    def decorator(f):
+        def wrapper(*args, **kwargs):
+            user = authenticate()
+            if not user:
+                return jsonify({'error': 'Authentication required'}), 401
+
+            if required_role and user.role != required_role:
+                return jsonify({'error': 'Admin access required'}), 403
+
+            request.user = user
+            return f(*args, **kwargs)
+        wrapper.__name__ = f.__name__
+        return wrapper
+    return decorator
@@ -0,0 +1,86 @@
+# benchmarks/auth_overhead.py - Measures authentication overhead and DB work per request
+#
+# Usage (from backend/): python benchmarks/auth_overhead.py [--requests 2000]
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Isolated in-memory database and dummy credentials, set before the app is imported
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ.setdefault('HF_TOKEN', 'benchmark-token')
+os.environ.setdefault('AWS_S3_BUCKET', 'benchmark-bucket')
+
+from sqlalchemy import event
+from app import create_app
+from models import db, User
+from auth_middleware import user_state_cache
+
+class QueryCounter:
+    """Counts SQL statements executed on an engine"""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+def timed_requests(client, n, **kwargs):
+    started = time.perf_counter()
+    for _ in range(n):
+        response = client.post('/api/auth/logout', **kwargs)
+        assert response.status_code == 200, response.get_json()
+    return (time.perf_counter() - started) / n
+
+def main():
+    parser = argparse.ArgumentParser(description='Auth overhead microbenchmark')
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = create_app()
+    client = app.test_client()
+
+    with app.app_context():
+        user = User(username='bench', email='bench@infradoc.com', department='safety', role='user')
+        user.set_password('bench-password')
+        db.session.add(user)
+        db.session.commit()
+        counter = QueryCounter(db.engine)
+
+    token = client.post('/api/auth/login', json={
+        'username': 'bench', 'password': 'bench-password'
+    }).get_json()['token']
+    bearer = {'headers': {'Authorization': f'Bearer {token}'}}
+    form = {'data': {'username': 'bench', 'password': 'bench-password'}}
+
+    # Unauthenticated baseline
+    started = time.perf_counter()
+    for _ in range(args.requests):
+        client.get('/api/health')
+    baseline = (time.perf_counter() - started) / args.requests
+
+    results = {}
+    for name, kwargs in (('jwt', bearer), ('password', form)):
+        user_state_cache.clear()
+        timed_requests(client, 1, **kwargs)  # warm the cache
+        counter.count = 0
+        per_request = timed_requests(client, args.requests, **kwargs)
+        results[name] = (per_request, counter.count)
+
+    print(f"Baseline (no auth):  {baseline * 1e6:8.1f} µs/request")
+    failed = False
+    for name, (per_request, queries) in results.items():
+        print(f"{name:<20} {per_request * 1e6:8.1f} µs/request "
+              f"(+{(per_request - baseline) * 1e6:.1f} µs auth), {queries} SQL statements")
+        failed = failed or queries > 0
+
+    if failed:
+        print("❌ Authenticated requests performed database work")
+        sys.exit(1)
+    print("✅ Authenticated requests performed no database work")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# benchmarks/json_serialization.py - CPU time and peak memory of list serialization
+#
+# Compares the old jsonify([to_dict()]) path with streamed to_json() rows.
+# Usage (from backend/): python benchmarks/json_serialization.py [--rows 10000]
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ.setdefault('HF_TOKEN', 'benchmark-token')
+
+from flask import jsonify
+from app import create_app
+from models import db, ProcessedDocument
+from json_provider import stream_json_array
+
+def seed(rows):
+    key_points = json.dumps([f"Key point {i} about inspection findings and follow-up" for i in range(8)])
+    action_items = json.dumps([f"Action {i}: schedule repair crew and notify supervisor" for i in range(5)])
+    metadata = json.dumps({'text_length': 24000, 'priority': 'high', 'key_points_count': 8, 'action_items_count': 5})
+    db.session.bulk_insert_mappings(ProcessedDocument, [{
+        'original_filename': f"report_{i}.pdf",
+        'processed_filename': f"safety_report_{i}.pdf",
+        'file_path': f"https://bucket.s3.us-east-1.amazonaws.com/processed/safety/report_{i}.pdf",
+        'document_type': 'safety_report',
+        'department': 'safety',
+        'summary': 'Routine inspection of the north substation found corrosion on two transformer housings. ' * 3,
+        'key_points': key_points,
+        'action_items': action_items,
+        'priority': 'high',
+        'doc_metadata': metadata,
+        'status': 'processed'
+    } for i in range(rows)])
+    db.session.commit()
+
+def measure(name, build):
+    tracemalloc.start()
+    started = time.process_time()
+    size = build()
+    elapsed = time.process_time() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<28} {elapsed * 1000:8.1f} ms CPU  {peak / 1024 / 1024:8.2f} MB peak  {size / 1024:8.0f} KB")
+    return elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser(description='List serialization benchmark')
+    parser.add_argument('--rows', type=int, default=10000)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        seed(args.rows)
+
+        with app.test_request_context():
+            def old_path():
+                documents = ProcessedDocument.query.all()
+                return len(jsonify([doc.to_dict() for doc in documents]).get_data())
+
+            def streamed_path():
+                documents = ProcessedDocument.query.yield_per(500)
+                response = stream_json_array(doc.to_json() for doc in documents)
+                return sum(len(chunk) for chunk in response.response)
+
+            old = measure('jsonify(to_dict list)', old_path)
+            new = measure('streamed to_json rows', streamed_path)
+
+    print(f"CPU: {old[0] / max(new[0], 1e-9):.1f}x faster, peak memory: {old[1] / max(new[1], 1):.1f}x lower")
+
+if __name__ == '__main__':
+    main()
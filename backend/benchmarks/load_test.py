@@ -0,0 +1,298 @@
+# benchmarks/load_test.py - HTTP load test of one backend node with a seeded dataset
+#
+# Usage (from backend/):
+#   python benchmarks/load_test.py [--users-per-dept 20] [--docs-per-dept 500]
+#                                  [--concurrency 16] [--duration 30] [--mix dashboard]
+#
+# Seeds a throwaway SQLite database through the models layer, serves create_app()
+# on a local threaded WSGI server with S3 replaced by moto, replays a weighted mix
+# of dashboard and upload requests from concurrent clients and reports RPS and
+# latency percentiles per route.
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+import http.client
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Throwaway database and dummy credentials, set before the app is imported
+DB_DIR = tempfile.mkdtemp(prefix='loadtest-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(DB_DIR, 'loadtest.db')}"
+os.environ.setdefault('HF_TOKEN', 'benchmark-token')
+os.environ['AWS_S3_BUCKET'] = 'benchmark-bucket'
+os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+os.environ['AWS_REGION'] = 'us-east-1'
+
+from moto import mock_aws
+
+PASSWORD = 'loadtest-password'
+DEPARTMENTS = ['engineering', 'operations', 'procurement', 'hr', 'safety', 'compliance', 'finance']
+
+# Route weights per scenario; names are used as report keys
+MIXES = {
+    'dashboard': {'login': 2, 'documents': 30, 'department_documents': 40, 'summary': 5, 'upload_s3': 3},
+    'uploads': {'login': 5, 'documents': 20, 'department_documents': 20, 'summary': 5, 'upload_s3': 50},
+    'read_only': {'documents': 50, 'department_documents': 45, 'summary': 5},
+}
+
+def seed_database(app, users_per_dept, docs_per_dept):
+    """Users, documents and processed documents per department; returns user dicts"""
+    from models import db, User, Document, ProcessedDocument
+
+    rng = random.Random(3)
+    users = []
+    with app.app_context():
+        admin = User(username='loadtest_admin', email='admin@loadtest.local', role='admin', department='admin')
+        admin.set_password(PASSWORD)
+        password_hash = admin.password_hash
+        db.session.add(admin)
+        users.append({'username': admin.username, 'role': 'admin', 'department': 'admin'})
+
+        for department in DEPARTMENTS:
+            for i in range(users_per_dept):
+                username = f"{department}_user{i}"
+                # Reuse one hash: seeding thousands of scrypt hashes would dominate setup time
+                db.session.add(User(username=username, email=f"{username}@loadtest.local",
+                                    password_hash=password_hash, role='user', department=department))
+                users.append({'username': username, 'role': 'user', 'department': department})
+        db.session.commit()
+
+        uploader_ids = dict(db.session.query(User.department, User.id).all())
+        now = datetime.utcnow()
+        for department in DEPARTMENTS:
+            documents, processed = [], []
+            for i in range(docs_per_dept):
+                created = now - timedelta(minutes=rng.randint(0, 60 * 24 * 90))
+                key = f"uploads/{department}/seed_{i:06d}.pdf"
+                documents.append({
+                    'title': f"{department.title()} report {i}",
+                    'description': 'Seeded for load testing',
+                    'filename': f"seed_{i:06d}.pdf",
+                    'file_path': key,
+                    'file_size': rng.randint(10_000, 5_000_000),
+                    'file_type': 'pdf',
+                    'department': department,
+                    'category': 'report',
+                    'uploaded_by': uploader_ids.get(department),
+                    'content_sha256': uuid.uuid4().hex * 2,
+                    'created_at': created,
+                    'updated_at': created
+                })
+                if i % 2 == 0:
+                    processed.append({
+                        'original_filename': f"seed_{i:06d}.pdf",
+                        'processed_filename': f"{department}_seed_{i:06d}.pdf",
+                        'file_path': f"https://benchmark-bucket.s3.amazonaws.com/processed/{department}/seed_{i:06d}.pdf",
+                        'document_type': 'engineering_report',
+                        'department': department,
+                        'summary': 'Seeded summary sentence. ' * 8,
+                        'key_points': json.dumps(['Point one', 'Point two']),
+                        'action_items': json.dumps(['Review by 2025-06-01']),
+                        'priority': rng.choice(['high', 'medium', 'low']),
+                        'doc_metadata': json.dumps({'seed': True}),
+                        'processed_by': uploader_ids.get(department),
+                        'status': 'processed',
+                        'processed_date': created,
+                        'updated_at': created
+                    })
+            db.session.bulk_insert_mappings(Document, documents)
+            db.session.bulk_insert_mappings(ProcessedDocument, processed)
+            db.session.commit()
+    return users
+
+def seed_s3(s3, bucket, objects_per_dept):
+    for department in DEPARTMENTS:
+        for i in range(objects_per_dept):
+            s3.put_object(Bucket=bucket, Key=f"uploads/{department}/live_{i:05d}.txt",
+                          Body=f"{department} live object {i}".encode(),
+                          Metadata={'department': department, 'document_type': 'unknown'})
+
+def multipart_body(fields, filename, content):
+    boundary = uuid.uuid4().hex
+    lines = []
+    for name, value in fields.items():
+        lines.append(f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode())
+    lines.append((f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+                  "Content-Type: text/plain\r\n\r\n").encode() + content + b"\r\n")
+    lines.append(f"--{boundary}--\r\n".encode())
+    return b''.join(lines), f"multipart/form-data; boundary={boundary}"
+
+class LoadClient:
+    """One simulated user issuing requests against the server"""
+
+    def __init__(self, host, port, user, use_etags):
+        self.host, self.port = host, port
+        self.user = user
+        self.token = None
+        self.use_etags = use_etags
+        self.etags = {}
+
+    def request(self, method, path, body=None, headers=None):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            data = response.read()
+            return response.status, response.getheader('ETag'), data
+        finally:
+            connection.close()
+
+    def login(self):
+        status, _, data = self.request(
+            'POST', '/api/auth/login',
+            json.dumps({'username': self.user['username'], 'password': PASSWORD}),
+            {'Content-Type': 'application/json'}
+        )
+        if status == 200:
+            self.token = json.loads(data)['token']
+        return status
+
+    def get(self, path):
+        headers = {'Authorization': f"Bearer {self.token}"}
+        if self.use_etags and path in self.etags:
+            headers['If-None-Match'] = self.etags[path]
+        status, etag, _ = self.request('GET', path, headers=headers)
+        if etag:
+            self.etags[path] = etag
+        return status
+
+    def run(self, route):
+        department = self.user['department']
+        if route == 'login':
+            return self.login()
+        if route == 'documents':
+            return self.get('/api/documents')
+        if route == 'department_documents':
+            if department == 'admin':
+                department = random.choice(DEPARTMENTS)
+            return self.get(f"/api/processing/department-documents/{department}")
+        if route == 'summary':
+            return self.get('/api/processing/documents/summary')
+        if route == 'upload_s3':
+            body, content_type = multipart_body(
+                {'username': self.user['username'], 'password': PASSWORD,
+                 'title': 'Load test upload', 'category': 'report'},
+                f"load_{uuid.uuid4().hex[:8]}.txt",
+                f"load test upload {uuid.uuid4().hex}\n".encode() * 64
+            )
+            status, _, _ = self.request('POST', '/api/upload-s3', body, {'Content-Type': content_type})
+            return status
+        raise ValueError(route)
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))]
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP load test against create_app()')
+    parser.add_argument('--users-per-dept', type=int, default=20)
+    parser.add_argument('--docs-per-dept', type=int, default=500)
+    parser.add_argument('--s3-objects-per-dept', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of load')
+    parser.add_argument('--mix', choices=sorted(MIXES), default='dashboard')
+    parser.add_argument('--etags', action='store_true', help='send If-None-Match like a polling dashboard')
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    with mock_aws():
+        import boto3
+        from werkzeug.serving import make_server
+        import model
+        import auth_api
+        from app import create_app
+
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=os.environ['AWS_S3_BUCKET'])
+        model.s3_client = s3
+        auth_api._s3_client = s3
+
+        app = create_app()
+        started = time.perf_counter()
+        users = seed_database(app, args.users_per_dept, args.docs_per_dept)
+        seed_s3(s3, os.environ['AWS_S3_BUCKET'], args.s3_objects_per_dept)
+        print(f"Seeded {len(users)} users, {args.docs_per_dept * len(DEPARTMENTS)} documents "
+              f"in {time.perf_counter() - started:.1f}s")
+
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address[:2]
+
+        mix = MIXES[args.mix]
+        routes, weights = list(mix), list(mix.values())
+        latencies = defaultdict(list)
+        statuses = defaultdict(lambda: defaultdict(int))
+        lock = threading.Lock()
+        deadline = time.perf_counter() + args.duration
+
+        def worker(index):
+            rng = random.Random(index)
+            client = LoadClient(host, port, users[index % len(users)], args.etags)
+            client.login()
+            # documents/summary is admin-only, so it is issued with an admin session
+            admin_client = LoadClient(host, port, users[0], args.etags)
+            admin_client.login()
+            while time.perf_counter() < deadline:
+                route = rng.choices(routes, weights)[0]
+                began = time.perf_counter()
+                try:
+                    status = (admin_client if route == 'summary' else client).run(route)
+                except Exception as e:
+                    status = type(e).__name__
+                elapsed = time.perf_counter() - began
+                with lock:
+                    latencies[route].append(elapsed)
+                    statuses[route][status] += 1
+
+        load_started = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - load_started
+        server.shutdown()
+
+    report = {
+        'config': vars(args),
+        'seconds': round(wall, 3),
+        'total_requests': sum(len(v) for v in latencies.values()),
+        'routes': {}
+    }
+    report['rps'] = round(report['total_requests'] / wall, 2)
+    print(f"\n{args.mix} mix, concurrency {args.concurrency}: "
+          f"{report['total_requests']} requests, {report['rps']} req/s")
+    print(f"{'route':<22}{'count':>7}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}  statuses")
+    for route in routes:
+        values = latencies.get(route)
+        if not values:
+            continue
+        stats = {
+            'count': len(values),
+            'rps': round(len(values) / wall, 2),
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+            'max_ms': round(max(values) * 1000, 2),
+            'statuses': {str(k): v for k, v in statuses[route].items()}
+        }
+        report['routes'][route] = stats
+        print(f"{route:<22}{stats['count']:>7}{stats['rps']:>9}{stats['p50_ms']:>10}{stats['p95_ms']:>10}"
+              f"{stats['p99_ms']:>10}{stats['max_ms']:>10}  {stats['statuses']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
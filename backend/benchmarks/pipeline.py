@@ -0,0 +1,328 @@
+# benchmarks/pipeline.py - Offline end-to-end benchmark of the S3 document pipeline
+#
+# Usage (from backend/):
+#   python benchmarks/pipeline.py [--docs 60] [--llm-latency-ms 50] [--output results.json]
+#   python benchmarks/pipeline.py --compare benchmarks/results/baseline.json
+#
+# Runs process_s3_document, batch_process_s3_documents, the asyncio batch runner
+# and auto_fetch_and_process against moto-backed S3 and a deterministic fake
+# InferenceClient. Reports docs/sec,
+# per-stage p50/p95/p99 and peak RSS, writes the results as JSON and, with
+# --compare, exits 1 when a scenario regressed beyond --threshold percent.
+import io
+import asyncio
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import resource
+import platform
+import contextlib
+from datetime import datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Dummy credentials, set before model.py creates its clients
+os.environ.setdefault('HF_TOKEN', 'benchmark-token')
+os.environ['AWS_S3_BUCKET'] = 'benchmark-bucket'
+os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+os.environ['AWS_REGION'] = 'us-east-1'
+os.environ['ASYNC_S3_BACKEND'] = 'thread'  # moto patches botocore, not aiobotocore
+
+from moto import mock_aws
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+STAGES = [
+    'download_from_s3', 'extract_text_from_file', 'fingerprint_text', 'classify_document',
+    'determine_department', 'create_summary', 'extract_key_points', 'extract_action_items',
+    'extract_deadline', 'determine_priority', 'upload_to_s3', 'call_llm'
+]
+
+TOPICS = {
+    'safety': "Inspection found a hazard near the north pump station. Crews must wear harnesses.",
+    'invoice': "Invoice 4471 for 120 tonnes of rebar is payable within 30 days of receipt.",
+    'hr': "The onboarding policy for site engineers changes next quarter for all regions.",
+    'compliance': "The audit requires updated emission records to be filed with the regulator.",
+    'engineering': "Load tests on the east viaduct bearings exceeded design tolerance by 4 percent.",
+}
+
+class FakeInferenceClient:
+    """Stands in for huggingface_hub.InferenceClient with deterministic answers.
+
+    latency_ms is slept per call (with +/- jitter_pct, seeded) so stage
+    timings include a realistic, reproducible model delay.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, jitter_pct: float = 20.0, seed: int = 7):
+        self.latency_ms = latency_ms
+        self.jitter_pct = jitter_pct
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _answer(self, prompt: str) -> str:
+        digest = int(hashlib.sha1(prompt.encode('utf-8')).hexdigest(), 16)
+        lowered = prompt.lower()
+        if prompt.startswith('Classify'):
+            for keyword, doc_type in (('hazard', 'safety_report'), ('invoice', 'invoice'),
+                                      ('onboarding', 'hr_document'), ('audit', 'compliance_document'),
+                                      ('load tests', 'engineering_report')):
+                if keyword in lowered:
+                    return doc_type
+            return 'administrative'
+        if 'deadline' in lowered:
+            return f"2025-{digest % 12 + 1:02d}-{digest % 28 + 1:02d}" if digest % 3 else 'NONE'
+        if 'action items' in lowered:
+            return '\n'.join(f"- Follow up on item {digest % 97 + i}" for i in range(digest % 4))
+        if 'key points' in lowered:
+            return '\n'.join(f"- Key point {i}: finding {digest % 89 + i}" for i in range(3 + digest % 3))
+        return "This document describes site work and the follow-up the department must take."
+
+    def _create(self, model, messages, max_tokens=1000, temperature=0.3, **kwargs):
+        self.calls += 1
+        if self.latency_ms:
+            jitter = 1 + self.random.uniform(-self.jitter_pct, self.jitter_pct) / 100
+            time.sleep(self.latency_ms * jitter / 1000)
+        content = self._answer(messages[-1]['content'])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+class FakeAsyncInferenceClient(FakeInferenceClient):
+    """Async counterpart that awaits the model delay instead of blocking"""
+
+    async def _create(self, model, messages, max_tokens=1000, temperature=0.3, **kwargs):
+        self.calls += 1
+        if self.latency_ms:
+            jitter = 1 + self.random.uniform(-self.jitter_pct, self.jitter_pct) / 100
+            await asyncio.sleep(self.latency_ms * jitter / 1000)
+        content = self._answer(messages[-1]['content'])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+def make_corpus(count: int, seed: int = 11):
+    """Synthetic uploads of mixed formats and sizes: (key, body bytes)"""
+    rng = random.Random(seed)
+    departments = ['engineering', 'safety', 'finance', 'hr', 'compliance']
+    sizes = [2_000, 20_000, 200_000]
+    corpus = []
+    for i in range(count):
+        topic, sentence = rng.choice(list(TOPICS.items()))
+        size = rng.choice(sizes)
+        extension = rng.choice(['txt', 'md', 'csv', 'json'])
+        filler = f"{sentence} Reference {i}. " * (size // (len(sentence) + 16) + 1)
+        if extension == 'csv':
+            body = 'line,text\n' + '\n'.join(f"{n},{filler[n * 80:(n + 1) * 80]}" for n in range(size // 80))
+        elif extension == 'json':
+            body = json.dumps({'title': topic, 'body': filler[:size]})
+        elif extension == 'md':
+            body = f"# {topic.title()} notice\n\n{filler[:size]}"
+        else:
+            body = filler[:size]
+        key = f"uploads/{rng.choice(departments)}/{i:05d}_{topic}.{extension}"
+        corpus.append((key, body.encode('utf-8')))
+    return corpus
+
+class StageTimer:
+    """Wraps module-level pipeline functions to record their durations"""
+
+    def __init__(self, module, names):
+        self.module = module
+        self.samples = {name: [] for name in names}
+        self.originals = {}
+        for name in names:
+            original = getattr(module, name)
+            self.originals[name] = original
+            setattr(module, name, self._wrap(name, original))
+
+    def _wrap(self, name, original):
+        samples = self.samples[name]
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - started)
+        return timed
+
+    def reset(self):
+        for samples in self.samples.values():
+            samples.clear()
+
+    def restore(self):
+        for name, original in self.originals.items():
+            setattr(self.module, name, original)
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+def stage_report(samples):
+    report = {}
+    for name, values in samples.items():
+        if values:
+            report[name] = {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 50) * 1000, 3),
+                'p95_ms': round(percentile(values, 95) * 1000, 3),
+                'p99_ms': round(percentile(values, 99) * 1000, 3),
+                'total_ms': round(sum(values) * 1000, 3)
+            }
+    return report
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return round(peak / (1024 * 1024) if platform.system() == 'Darwin' else peak / 1024, 1)
+
+def seed_uploads(s3, bucket, corpus):
+    for key, body in corpus:
+        s3.put_object(Bucket=bucket, Key=key, Body=body)
+
+def run_scenario(name, fn, documents, timer, verbose):
+    timer.reset()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    started = time.perf_counter()
+    with output:
+        processed = fn()
+    elapsed = time.perf_counter() - started
+    return {
+        'scenario': name,
+        'documents': documents,
+        'processed': processed,
+        'seconds': round(elapsed, 4),
+        'docs_per_sec': round(processed / elapsed, 3) if elapsed else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': stage_report(timer.samples)
+    }
+
+def compare(results, baseline_path, threshold):
+    """Regressions of docs/sec and stage p95 against a previous results file"""
+    with open(baseline_path) as f:
+        baseline = {s['scenario']: s for s in json.load(f)['scenarios']}
+    regressions = []
+    for scenario in results['scenarios']:
+        before = baseline.get(scenario['scenario'])
+        if not before:
+            continue
+        if before.get('docs_per_sec') and scenario['docs_per_sec'] is not None:
+            change = (scenario['docs_per_sec'] - before['docs_per_sec']) / before['docs_per_sec'] * 100
+            if change < -threshold:
+                regressions.append(f"{scenario['scenario']}: docs/sec {change:.1f}%")
+        for stage, stats in scenario['stages'].items():
+            old = before.get('stages', {}).get(stage)
+            if old and old['p95_ms'] > 0:
+                change = (stats['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100
+                if change > threshold:
+                    regressions.append(f"{scenario['scenario']}/{stage}: p95 +{change:.1f}%")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline pipeline benchmark')
+    parser.add_argument('--docs', type=int, default=60)
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0)
+    parser.add_argument('--llm-jitter-pct', type=float, default=20.0)
+    parser.add_argument('--batch-size', type=int, default=10, help='auto_fetch_and_process batch size')
+    parser.add_argument('--async-concurrency', type=int, default=100, help='documents in flight in the async runner')
+    parser.add_argument('--output', help='results JSON path (default benchmarks/results/pipeline-<time>.json)')
+    parser.add_argument('--compare', help='previous results JSON to flag regressions against')
+    parser.add_argument('--threshold', type=float, default=10.0, help='regression threshold in percent')
+    parser.add_argument('--verbose', action='store_true', help='show pipeline output')
+    args = parser.parse_args()
+
+    with mock_aws():
+        import boto3
+        import model
+        import async_pipeline
+
+        bucket = os.environ['AWS_S3_BUCKET']
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=bucket)
+        model.s3_client = s3
+
+        fake_client = FakeInferenceClient(args.llm_latency_ms, args.llm_jitter_pct)
+        model.client = fake_client
+        fake_async_client = FakeAsyncInferenceClient(args.llm_latency_ms, args.llm_jitter_pct)
+        async_pipeline.async_client = fake_async_client
+        timer = StageTimer(model, STAGES)
+        corpus = make_corpus(args.docs)
+        keys = [key for key, _ in corpus]
+
+        scenarios = []
+        try:
+            seed_uploads(s3, bucket, corpus)
+            scenarios.append(run_scenario(
+                'process_s3_document',
+                lambda: sum(1 for key in keys if model.process_s3_document(key)),
+                len(keys), timer, args.verbose
+            ))
+            scenarios.append(run_scenario(
+                'batch_process_s3_documents',
+                lambda: sum(len(docs) for docs in model.batch_process_s3_documents(keys).values()),
+                len(keys), timer, args.verbose
+            ))
+            scenarios.append(run_scenario(
+                'batch_process_s3_documents_async',
+                lambda: async_pipeline.run_async_batch(
+                    keys, concurrency=args.async_concurrency
+                )['total_processed'],
+                len(keys), timer, args.verbose
+            ))
+            scenarios.append(run_scenario(
+                'auto_fetch_and_process',
+                lambda: model.auto_fetch_and_process(
+                    batch_size=args.batch_size, time_budget=3600
+                ).get('total_processed', 0),
+                len(keys), timer, args.verbose
+            ))
+        finally:
+            timer.restore()
+
+    results = {
+        'benchmark': 'pipeline',
+        'created_at': datetime.utcnow().isoformat() + 'Z',
+        'config': {
+            'docs': args.docs,
+            'llm_latency_ms': args.llm_latency_ms,
+            'llm_jitter_pct': args.llm_jitter_pct,
+            'batch_size': args.batch_size,
+            'async_concurrency': args.async_concurrency,
+            'python': platform.python_version()
+        },
+        'llm_calls': fake_client.calls + fake_async_client.calls,
+        'llm_models': model.model_router.stats()['models'],
+        'scenarios': scenarios
+    }
+
+    output_path = args.output or os.path.join(
+        RESULTS_DIR, f"pipeline-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    for scenario in scenarios:
+        print(f"{scenario['scenario']:<28} {scenario['processed']:>4}/{scenario['documents']} docs  "
+              f"{scenario['docs_per_sec']:>8} docs/sec  peak RSS {scenario['peak_rss_mb']} MB")
+        for stage, stats in scenario['stages'].items():
+            print(f"    {stage:<24} p50 {stats['p50_ms']:>9.3f} ms  p95 {stats['p95_ms']:>9.3f} ms  "
+                  f"p99 {stats['p99_ms']:>9.3f} ms")
+    print(f"Results written to {output_path}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print("❌ Regressions:")
+            for regression in regressions:
+                print(f"   {regression}")
+            sys.exit(1)
+        print(f"✅ No regressions beyond {args.threshold}%")
+
+if __name__ == '__main__':
+    main()
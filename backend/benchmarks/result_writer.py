@@ -0,0 +1,110 @@
+# benchmarks/result_writer.py - Write throughput of pipeline results into the database
+#
+# Usage (from backend/):
+#   python benchmarks/result_writer.py [--rows 5000] [--batch-sizes 100,500,2000]
+#                                      [--baseline-rows 1000] [--database-url sqlite:///...]
+#
+# Builds synthetic DocumentProcessingResult objects and saves them with
+# result_writer.bulk_save_results at each batch size (inserts, then the same
+# versions again as upserts), and with the per-document save_processing_result
+# as a baseline. Reports rows/sec; defaults to a throwaway SQLite database.
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Dummy credentials, set before model.py creates its clients
+os.environ.setdefault('HF_TOKEN', 'benchmark-token')
+os.environ.setdefault('AWS_S3_BUCKET', 'benchmark-bucket')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+os.environ.setdefault('AWS_REGION', 'us-east-1')
+
+def make_results(count, seed):
+    from model import DocumentProcessingResult, DocumentType, Department
+
+    rng = random.Random(seed)
+    departments = [Department.ENGINEERING, Department.SAFETY, Department.FINANCE, Department.HR]
+    results = []
+    for i in range(count):
+        department = rng.choice(departments)
+        filename = f"report_{seed}_{i:06d}.pdf"
+        results.append(DocumentProcessingResult(
+            file_path=f"/tmp/{filename}",
+            original_filename=filename,
+            processed_filename=f"{department.value}_{uuid.uuid4().hex[:8]}_{filename}",
+            document_type=DocumentType.ENGINEERING_REPORT,
+            department=department,
+            summary='Benchmark summary sentence. ' * 10,
+            key_points=[f"Key point {n} of document {i}" for n in range(4)],
+            action_items=[f"Inspect section {n} by 2025-0{n + 1}-15" for n in range(3)],
+            deadline='2025-06-30',
+            priority=rng.choice(['high', 'medium', 'low']),
+            metadata={'s3_key': f"uploads/{department.value}/{filename}", 'etag': uuid.uuid4().hex},
+            raw_text='Benchmark text ' * 60,
+            processed_date=datetime.now().isoformat(),
+            s3_key=f"processed/{department.value}/{filename}",
+            s3_url=f"https://benchmark-bucket.s3.amazonaws.com/processed/{department.value}/{filename}",
+            simhash=f"{rng.getrandbits(64):016x}"
+        ))
+    return results
+
+def timed(label, rows, fn):
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    rate = round(rows / elapsed, 1) if elapsed else None
+    print(f"{label:<32} {rows:>7} rows  {elapsed:>8.3f} s  {rate:>10} rows/s")
+    return {'label': label, 'rows': rows, 'seconds': round(elapsed, 4), 'rows_per_sec': rate}
+
+def main():
+    parser = argparse.ArgumentParser(description='Pipeline result write throughput')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--batch-sizes', default='100,500,2000')
+    parser.add_argument('--baseline-rows', type=int, default=1000, help='rows saved one by one (0 to skip)')
+    parser.add_argument('--database-url', help='defaults to a throwaway SQLite file')
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url or \
+        f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='writebench-'), 'bench.db')}"
+
+    from app import create_app
+    from models import db, User
+    from result_writer import bulk_save_results
+    from processing_api import save_processing_result
+
+    app = create_app()
+    runs = []
+    with app.app_context():
+        user = User(username=f"bench_{uuid.uuid4().hex[:6]}", email=f"{uuid.uuid4().hex[:6]}@bench.local",
+                    role='admin', department='admin', password_hash='-')
+        db.session.add(user)
+        db.session.commit()
+
+        if args.baseline_rows:
+            results = make_results(args.baseline_rows, seed=0)
+            runs.append(timed('save_processing_result (per row)', len(results),
+                              lambda: [save_processing_result(result, user.id) for result in results]))
+
+        for seed, batch_size in enumerate(int(size) for size in args.batch_sizes.split(',')):
+            results = make_results(args.rows, seed=seed + 1)
+            runs.append(timed(f"bulk insert, batch {batch_size}", len(results),
+                              lambda: bulk_save_results(results, user.id, batch_size)))
+            runs.append(timed(f"bulk upsert, batch {batch_size}", len(results),
+                              lambda: bulk_save_results(results, user.id, batch_size)))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': vars(args), 'runs': runs}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
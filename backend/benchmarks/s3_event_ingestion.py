@@ -0,0 +1,91 @@
+# benchmarks/s3_event_ingestion.py - Push ingestion against moto-backed S3 and SQS
+#
+# Usage (from backend/): python benchmarks/s3_event_ingestion.py [--uploads 200] [--rewrites 3]
+#
+# Requires moto. Uploads objects under uploads/ (and some elsewhere), rewrites a
+# few keys in a burst, then drains the notification queue through
+# S3EventConsumer. Exits 1 unless every upload key ended at its newest version,
+# no version reached the handler twice and every notification was deleted.
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import boto3
+from moto import mock_aws
+from s3_events import S3EventConsumer, S3EventQueue, poll_sqs
+
+BUCKET = 'benchmark-bucket'
+REGION = 'us-east-1'
+
+def configure_notifications(s3, sqs):
+    queue_url = sqs.create_queue(QueueName='upload-events')['QueueUrl']
+    queue_arn = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['QueueArn'])['Attributes']['QueueArn']
+    s3.put_bucket_notification_configuration(
+        Bucket=BUCKET,
+        NotificationConfiguration={'QueueConfigurations': [{
+            'QueueArn': queue_arn,
+            'Events': ['s3:ObjectCreated:*'],
+            'Filter': {'Key': {'FilterRules': [{'Name': 'prefix', 'Value': 'uploads/'}]}}
+        }]}
+    )
+    return queue_url
+
+def main():
+    parser = argparse.ArgumentParser(description='S3 event push-ingestion check')
+    parser.add_argument('--uploads', type=int, default=200)
+    parser.add_argument('--rewrites', type=int, default=3, help='extra writes to the first 10 keys')
+    args = parser.parse_args()
+
+    with mock_aws():
+        s3 = boto3.client('s3', region_name=REGION)
+        sqs = boto3.client('sqs', region_name=REGION)
+        s3.create_bucket(Bucket=BUCKET)
+        queue_url = configure_notifications(s3, sqs)
+
+        expected = {}
+        for i in range(args.uploads):
+            key = f"uploads/engineering/{i:05d}_report {i}.txt"
+            response = s3.put_object(Bucket=BUCKET, Key=key, Body=f"report {i}".encode())
+            expected[key] = response['ETag'].strip('"')
+        for rewrite in range(args.rewrites):
+            for i in range(min(10, args.uploads)):
+                key = f"uploads/engineering/{i:05d}_report {i}.txt"
+                response = s3.put_object(Bucket=BUCKET, Key=key, Body=f"report {i} v{rewrite}".encode())
+                expected[key] = response['ETag'].strip('"')
+        s3.put_object(Bucket=BUCKET, Key='archive/ignored.txt', Body=b'ignored')
+
+        handled = []
+        consumer = S3EventConsumer(handled.extend, S3EventQueue(coalesce_seconds=0), autostart=False)
+        totals = {}
+        started = time.perf_counter()
+        while True:
+            counts = poll_sqs(sqs, queue_url, consumer, wait_seconds=0)
+            if not counts['messages']:
+                break
+            for name, value in counts.items():
+                totals[name] = totals.get(name, 0) + value
+        consumer.process_pending()
+        elapsed = time.perf_counter() - started
+
+    # Each poll is handled before its messages are deleted, so a rewrite that
+    # arrives in a later poll is handled as a new version of the key
+    got = {event.s3_key: event.etag for event in handled}
+    versions = [(event.s3_key, event.etag) for event in handled]
+    print(f"notifications: {totals.get('messages', 0)}, events: {totals.get('events', 0)}, "
+          f"coalesced: {totals.get('coalesced', 0)}, duplicates: {totals.get('duplicates', 0)}, "
+          f"deleted: {totals.get('deleted', 0)}")
+    print(f"handled {len(handled)} versions of {len(got)} keys in {elapsed * 1000:.1f} ms")
+
+    if got != expected or len(set(versions)) != len(versions):
+        print("❌ Handled versions do not end at the newest upload versions or repeat one")
+        sys.exit(1)
+    if totals.get('deleted', 0) != totals.get('messages', 0):
+        print("❌ Not every handled notification was deleted")
+        sys.exit(1)
+    print("✅ Each upload version was handled once and keys ended at their newest version")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+# calendar_index.py - Deadline calendar of processed documents and per-department iCalendar feeds
+import json
+import hashlib
+import secrets
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import func
+from models import db, ProcessedDocument, DocumentCalendarEvent, CalendarFeedToken
+from model import CalendarEvent
+from document_items import parse_due_date, as_text, sync_rows
+from versioning import table_version
+
+CALENDAR_MAX_RANGE_DAYS = 366
+CALENDAR_MAX_EVENTS = 5000
+ICAL_PRODID = '-//InfraDoc//Deadline Calendar//EN'
+ICAL_PRIORITY = {'high': 1, 'medium': 5, 'low': 9}
+FEED_TOKEN_PREFIX = 'ical_'
+FEED_TOKEN_TOUCH_SECONDS = 3600  # last_used_at is written at most this often
+
+def _sourced_events(document, action_items: Iterable) -> List[Tuple[str, CalendarEvent]]:
+    events = []
+    name = document.original_filename or f"Document {document.id}"
+    deadline = parse_due_date(document.deadline)
+    if deadline:
+        events.append(('deadline', CalendarEvent(
+            title=f"Deadline: {name}",
+            description=(document.summary or '')[:1000],
+            date=deadline.isoformat(),
+            department=document.department,
+            priority=document.priority or 'medium',
+            action_required=True
+        )))
+    for item in action_items or []:
+        text = as_text(item).strip()
+        due = parse_due_date(text)
+        if due:
+            events.append(('action_item', CalendarEvent(
+                title=text[:300],
+                description=f"Action item from {name}",
+                date=due.isoformat(),
+                department=document.department,
+                priority=document.priority or 'medium',
+                action_required=True
+            )))
+    return events
+
+def calendar_events_for(document, action_items: Iterable) -> List[CalendarEvent]:
+    """Normalized events of one document: its deadline and each dated action item"""
+    return [event for _, event in _sourced_events(document, action_items)]
+
+CALENDAR_EVENT_FIELDS = ('department', 'title', 'description', 'event_date', 'priority', 'action_required')
+
+def _event_rows(entries: List[Tuple[Any, Iterable]]) -> Dict[int, List[Dict[str, Any]]]:
+    rows = {}
+    for document, action_items in entries:
+        document_rows = rows.setdefault(document.id, [])
+        for source, event in _sourced_events(document, action_items):
+            document_rows.append({
+                'document_id': document.id,
+                'department': event.department,
+                'title': event.title,
+                'description': event.description,
+                'event_date': date.fromisoformat(event.date),
+                'priority': event.priority,
+                'action_required': event.action_required,
+                'source': source
+            })
+    return rows
+
+def save_calendar_events(entries: List[Tuple[Any, Iterable]]):
+    """Bulk-insert events for (document, action_items) entries (documents need ids; caller commits)"""
+    rows = [row for document_rows in _event_rows(entries).values() for row in document_rows]
+    if rows:
+        db.session.bulk_insert_mappings(DocumentCalendarEvent, rows)
+
+def sync_calendar_events(entries: List[Tuple[Any, Iterable]]):
+    """Re-analysis counterpart of save_calendar_events: matched events keep their id (and iCal UID)"""
+    sync_rows(DocumentCalendarEvent, _event_rows(entries), CALENDAR_EVENT_FIELDS,
+              text_field='title', group_field='source')
+
+def delete_calendar_events(document_ids: List[int]):
+    if document_ids:
+        DocumentCalendarEvent.query.filter(
+            DocumentCalendarEvent.document_id.in_(document_ids)
+        ).delete(synchronize_session=False)
+
+def events_in_range(department: Optional[str], start: date, end: date,
+                    limit: int = CALENDAR_MAX_EVENTS) -> List[DocumentCalendarEvent]:
+    """Events dated start..end inclusive, served by the (department, event_date) index"""
+    query = DocumentCalendarEvent.query.filter(
+        DocumentCalendarEvent.event_date >= start,
+        DocumentCalendarEvent.event_date <= end
+    )
+    if department:
+        query = query.filter(DocumentCalendarEvent.department == department)
+    return query.order_by(DocumentCalendarEvent.event_date, DocumentCalendarEvent.id).limit(limit).all()
+
+def calendar_version(department: Optional[str] = None) -> str:
+    """Event count plus newest updated_at; ids alone miss rows SQLite re-created under reused rowids"""
+    return table_version(DocumentCalendarEvent, department)
+
+def _escape(text: str) -> str:
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,') \
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+
+def _fold(line: str) -> str:
+    """Fold content lines longer than 75 octets (RFC 5545 3.1)"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts, current = [], ''
+    for char in line:
+        limit = 75 if not parts else 74
+        if len((current + char).encode('utf-8')) > limit:
+            parts.append(current)
+            current = char
+        else:
+            current += char
+    parts.append(current)
+    return '\r\n '.join(parts) + '\r\n'
+
+def vevent(event: DocumentCalendarEvent) -> str:
+    stamp = (event.created_at or datetime.utcnow()).strftime('%Y%m%dT%H%M%SZ')
+    lines = [
+        'BEGIN:VEVENT',
+        f"UID:calendar-event-{event.id}@infradoc",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART;VALUE=DATE:{event.event_date.strftime('%Y%m%d')}",
+        f"DTEND;VALUE=DATE:{(event.event_date + timedelta(days=1)).strftime('%Y%m%d')}",
+        f"SUMMARY:{_escape(event.title)}",
+        f"DESCRIPTION:{_escape(event.description)}",
+        f"PRIORITY:{ICAL_PRIORITY.get(event.priority, 5)}",
+        f"CATEGORIES:{_escape(event.department)}",
+        'END:VEVENT'
+    ]
+    return ''.join(_fold(line) for line in lines)
+
+class ICalFeedCache:
+    """Per-department iCalendar bodies, extended with new events instead of rebuilt.
+
+    The cached body is reused while the department's event count, highest
+    id and newest updated_at are unchanged. When only new rows were added
+    (the cached id range is untouched) their VEVENTs are appended; any
+    other change (deleted, updated or replaced events) rebuilds the feed.
+    """
+
+    def __init__(self):
+        self._feeds: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _state(self, department: str, up_to_id: Optional[int] = None) -> Tuple[int, int, Optional[datetime]]:
+        query = db.session.query(
+            func.count(DocumentCalendarEvent.id),
+            func.max(DocumentCalendarEvent.id),
+            func.max(DocumentCalendarEvent.updated_at)
+        ).filter(DocumentCalendarEvent.department == department)
+        if up_to_id is not None:
+            query = query.filter(DocumentCalendarEvent.id <= up_to_id)
+        count, max_id, last_updated = query.one()
+        return count, max_id or 0, last_updated
+
+    def _query(self, department: str, after_id: int = 0):
+        return DocumentCalendarEvent.query.filter(
+            DocumentCalendarEvent.department == department,
+            DocumentCalendarEvent.id > after_id
+        ).order_by(DocumentCalendarEvent.id)
+
+    def feed(self, department: str) -> Tuple[str, str]:
+        """(iCalendar body, version) of a department"""
+        state = self._state(department)
+        count, max_id, last_updated = state
+        with self._lock:
+            cached = self._feeds.get(department)
+            if cached and cached['state'] == state:
+                return cached['body'], cached['version']
+
+            events = None
+            if cached and max_id > cached['max_id'] and \
+                    self._state(department, cached['max_id']) == cached['state']:
+                # The cached rows are untouched and only newer ones were added
+                new_events = [vevent(event) for event in self._query(department, cached['max_id'])]
+                if cached['count'] + len(new_events) == count:
+                    events = cached['events'] + new_events
+            if events is None:
+                events = [vevent(event) for event in self._query(department)]
+
+            body = ''.join([
+                'BEGIN:VCALENDAR\r\n',
+                'VERSION:2.0\r\n',
+                f"PRODID:{ICAL_PRODID}\r\n",
+                'CALSCALE:GREGORIAN\r\n',
+                _fold(f"X-WR-CALNAME:{_escape(department.title())} deadlines"),
+                *events,
+                'END:VCALENDAR\r\n'
+            ])
+            stamp = last_updated.strftime('%Y%m%d%H%M%S%f') if last_updated else '0'
+            version = f"{department}-{count}-{max_id}-{stamp}"
+            self._feeds[department] = {'state': state, 'count': count, 'max_id': max_id, 'events': events,
+                                       'body': body, 'version': version}
+            return body, version
+
+ical_feed_cache = ICalFeedCache()
+
+def _feed_token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def issue_feed_token(user_id: int, department: str, label: Optional[str] = None) -> Tuple[CalendarFeedToken, str]:
+    """Create a feed token; the plaintext is returned once and only its hash is stored"""
+    token = FEED_TOKEN_PREFIX + secrets.token_urlsafe(32)
+    entry = CalendarFeedToken(user_id=user_id, department=department,
+                              token_hash=_feed_token_hash(token), label=label)
+    db.session.add(entry)
+    db.session.commit()
+    return entry, token
+
+def revoke_feed_token(entry: CalendarFeedToken):
+    if entry.revoked_at is None:
+        entry.revoked_at = datetime.utcnow()
+        db.session.commit()
+
+def feed_token_entry(token: Optional[str], department: str) -> Optional[CalendarFeedToken]:
+    """Active token entry granting the feed of department, or None"""
+    if not token or not token.startswith(FEED_TOKEN_PREFIX):
+        return None
+    entry = CalendarFeedToken.query.filter_by(token_hash=_feed_token_hash(token)).first()
+    if not entry or entry.revoked_at is not None or entry.department != department:
+        return None
+    now = datetime.utcnow()
+    if not entry.last_used_at or (now - entry.last_used_at).total_seconds() > FEED_TOKEN_TOUCH_SECONDS:
+        entry.last_used_at = now
+        db.session.commit()
+    return entry
+
+def backfill_calendar_events(batch_size: int = 500) -> int:
+    """Create calendar events for processed documents that have none yet"""
+    documents = ProcessedDocument.query.filter(
+        ~ProcessedDocument.id.in_(db.session.query(DocumentCalendarEvent.document_id))
+    ).order_by(ProcessedDocument.id).all()
+
+    for start in range(0, len(documents), batch_size):
+        entries = []
+        for document in documents[start:start + batch_size]:
+            try:
+                action_items = json.loads(document.action_items) if document.action_items else []
+            except ValueError:
+                action_items = []
+            entries.append((document, action_items))
+        save_calendar_events(entries)
+        db.session.commit()
+
+    return len(documents)
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        count = backfill_calendar_events()
+        print(f"✅ Backfilled calendar events for {count} processed documents")
@@ -0,0 +1,203 @@
+# document_items.py - Normalized action items and key points of processed documents
+import re
+import json
+from difflib import SequenceMatcher
+from datetime import datetime, date
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from models import db, ProcessedDocument, DocumentActionItem, DocumentKeyPoint
+
+ACTION_ITEM_STATUSES = ['open', 'in_progress', 'done', 'cancelled']
+
+# A re-analyzed item this similar to an existing one replaces it in place
+ITEM_MATCH_SIMILARITY = 0.75
+ACTION_ITEM_FIELDS = ('department', 'text', 'due_date', 'position')
+KEY_POINT_FIELDS = ('department', 'text', 'position')
+
+DATE_PATTERNS = [
+    (re.compile(r'\b(\d{4}-\d{2}-\d{2})\b'), ['%Y-%m-%d']),
+    (re.compile(r'\b(\d{1,2}/\d{1,2}/\d{4})\b'), ['%m/%d/%Y', '%d/%m/%Y']),
+    (re.compile(r'\b(\d{1,2} [A-Za-z]{3,9},? \d{4})\b'), ['%d %B %Y', '%d %b %Y', '%d %B, %Y', '%d %b, %Y']),
+    (re.compile(r'\b([A-Za-z]{3,9} \d{1,2},? \d{4})\b'), ['%B %d, %Y', '%b %d, %Y', '%B %d %Y', '%b %d %Y']),
+]
+
+def parse_due_date(text: Optional[str]) -> Optional[date]:
+    """Find the first recognizable calendar date in free-form text"""
+    if not text:
+        return None
+    for pattern, formats in DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            for fmt in formats:
+                try:
+                    return datetime.strptime(match.group(1), fmt).date()
+                except ValueError:
+                    continue
+    return None
+
+def as_text(item) -> str:
+    """Text of an analyzed item, whether a plain string or a dict from the model"""
+    if isinstance(item, dict):
+        return str(item.get('text') or item.get('description') or item.get('title') or '')
+    return str(item)
+
+def _item_rows(entries: List[tuple]) -> Tuple[Dict[int, List[Dict]], Dict[int, List[Dict]]]:
+    """Action item and key point rows per document id for (document, key_points, action_items) entries"""
+    action_rows, key_point_rows = {}, {}
+    for document, key_points, action_items in entries:
+        document_due = parse_due_date(document.deadline)
+        actions = action_rows.setdefault(document.id, [])
+        for position, item in enumerate(action_items or []):
+            text = as_text(item).strip()
+            if not text:
+                continue
+            actions.append({
+                'document_id': document.id,
+                'department': document.department,
+                'text': text,
+                'status': 'open',
+                'due_date': parse_due_date(text) or document_due,
+                'position': position
+            })
+        points = key_point_rows.setdefault(document.id, [])
+        for position, item in enumerate(key_points or []):
+            text = as_text(item).strip()
+            if not text:
+                continue
+            points.append({
+                'document_id': document.id,
+                'department': document.department,
+                'text': text,
+                'position': position
+            })
+    return action_rows, key_point_rows
+
+def save_document_items(document: ProcessedDocument, key_points: Iterable, action_items: Iterable):
+    """Bulk-insert the normalized rows for one processed document (caller commits)"""
+    save_items_for_documents([(document, list(key_points), list(action_items))])
+
+def save_items_for_documents(entries: List[tuple]):
+    """Bulk-insert normalized rows for (document, key_points, action_items) entries.
+
+    Documents must already have ids (flush first). Rows are written with one
+    executemany per table.
+    """
+    action_rows, key_point_rows = _item_rows(entries)
+    action_rows = [row for rows in action_rows.values() for row in rows]
+    key_point_rows = [row for rows in key_point_rows.values() for row in rows]
+    if action_rows:
+        db.session.bulk_insert_mappings(DocumentActionItem, action_rows)
+    if key_point_rows:
+        db.session.bulk_insert_mappings(DocumentKeyPoint, key_point_rows)
+
+def normalize_item_text(text: Optional[str]) -> str:
+    return ' '.join((text or '').lower().split())
+
+def _field(row, name: str):
+    return row[name] if isinstance(row, dict) else getattr(row, name)
+
+def match_rows(existing: List, wanted: List[Dict], text_field: str,
+               group_field: Optional[str] = None) -> Tuple[List[Tuple[Any, Dict]], List]:
+    """Pair each wanted row with the existing row it replaces (or None).
+
+    Rows with the same normalized text (and group) match first; the rest
+    match the most similar unmatched row of their group, if at least
+    ITEM_MATCH_SIMILARITY alike. Returns the pairs and the existing rows
+    nothing matched.
+    """
+    def group(row):
+        return _field(row, group_field) if group_field else None
+
+    unmatched = list(existing)
+    pairs: List[List] = [[None, row] for row in wanted]
+    for pair in pairs:
+        text = normalize_item_text(_field(pair[1], text_field))
+        for row in unmatched:
+            if group(row) == group(pair[1]) and normalize_item_text(_field(row, text_field)) == text:
+                pair[0] = row
+                unmatched.remove(row)
+                break
+    for pair in pairs:
+        if pair[0] is not None:
+            continue
+        text = normalize_item_text(_field(pair[1], text_field))
+        best, best_ratio = None, ITEM_MATCH_SIMILARITY
+        for row in unmatched:
+            if group(row) != group(pair[1]):
+                continue
+            ratio = SequenceMatcher(None, normalize_item_text(_field(row, text_field)), text).ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = row, ratio
+        if best is not None:
+            pair[0] = best
+            unmatched.remove(best)
+    return [(row, wanted_row) for row, wanted_row in pairs], unmatched
+
+def sync_rows(model, wanted_by_document: Dict[int, List[Dict]], fields: Iterable[str],
+              text_field: str = 'text', group_field: Optional[str] = None) -> Dict[str, int]:
+    """Make the rows of each document match wanted, touching only rows that changed.
+
+    Matched rows keep their id and every column not in fields (such as an
+    action item's status); changed ones are updated in place, new ones
+    inserted and rows no longer produced deleted. Caller commits.
+    """
+    fields = tuple(fields)
+    existing: Dict[int, List] = {}
+    if wanted_by_document:
+        for row in model.query.filter(model.document_id.in_(list(wanted_by_document))).order_by(model.id):
+            existing.setdefault(row.document_id, []).append(row)
+
+    now = datetime.utcnow()
+    inserts, updates, stale_ids = [], [], []
+    for document_id, wanted in wanted_by_document.items():
+        pairs, stale = match_rows(existing.get(document_id, []), wanted, text_field, group_field)
+        stale_ids.extend(row.id for row in stale)
+        for row, wanted_row in pairs:
+            if row is None:
+                inserts.append(wanted_row)
+            elif any(getattr(row, name) != wanted_row[name] for name in fields):
+                update = {name: wanted_row[name] for name in fields}
+                update['id'] = row.id
+                if hasattr(model, 'updated_at'):
+                    update['updated_at'] = now
+                updates.append(update)
+
+    if stale_ids:
+        model.query.filter(model.id.in_(stale_ids)).delete(synchronize_session=False)
+    if updates:
+        db.session.bulk_update_mappings(model, updates)
+    if inserts:
+        db.session.bulk_insert_mappings(model, inserts)
+    return {'inserted': len(inserts), 'updated': len(updates), 'deleted': len(stale_ids)}
+
+def sync_items_for_documents(entries: List[tuple]):
+    """Re-analysis counterpart of save_items_for_documents that keeps matched rows and their status"""
+    action_rows, key_point_rows = _item_rows(entries)
+    sync_rows(DocumentActionItem, action_rows, ACTION_ITEM_FIELDS)
+    sync_rows(DocumentKeyPoint, key_point_rows, KEY_POINT_FIELDS)
+
+def backfill_document_items(batch_size: int = 500) -> int:
+    """Create normalized rows for processed documents that have none yet"""
+    documents = ProcessedDocument.query.filter(
+        ~ProcessedDocument.id.in_(db.session.query(DocumentActionItem.document_id)),
+        ~ProcessedDocument.id.in_(db.session.query(DocumentKeyPoint.document_id))
+    ).order_by(ProcessedDocument.id).all()
+    
+    for start in range(0, len(documents), batch_size):
+        entries = []
+        for document in documents[start:start + batch_size]:
+            try:
+                key_points = json.loads(document.key_points) if document.key_points else []
+                action_items = json.loads(document.action_items) if document.action_items else []
+            except ValueError:
+                continue
+            entries.append((document, key_points, action_items))
+        save_items_for_documents(entries)
+        db.session.commit()
+    
+    return len(documents)
+
+if __name__ == '__main__':
+    from app import app
+    
+    with app.app_context():
+        count = backfill_document_items()
+        print(f"✅ Backfilled items for {count} processed documents")
@@ -0,0 +1,148 @@
+# fingerprint.py - SimHash/MinHash fingerprints and LSH index for near-duplicate detection
+import os
+import re
+import random
+import hashlib
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Tuple, Any
+
+# MinHash / LSH configuration (bands * rows must equal the number of permutations)
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+SHINGLE_SIZE = 5
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', '0.85'))
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_rng = random.Random(1337)
+_PERMUTATIONS = [
+    (_rng.randint(1, _MERSENNE_PRIME - 1), _rng.randint(0, _MERSENNE_PRIME - 1))
+    for _ in range(NUM_PERMUTATIONS)
+]
+
+@dataclass
+class TextFingerprint:
+    simhash: str  # 64-bit hex
+    minhash: str  # NUM_PERMUTATIONS 32-bit values, hex packed
+
+    @property
+    def signature(self) -> List[int]:
+        return unpack_minhash(self.minhash)
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def normalize_text(text: str) -> List[str]:
+    """Lowercase word tokens, ignoring punctuation and layout"""
+    return re.findall(r'[a-z0-9]+', (text or '').lower())
+
+def compute_simhash(words: List[str]) -> int:
+    """64-bit SimHash over word frequencies"""
+    weights = [0] * 64
+    for word, count in Counter(words).items():
+        h = _hash64(word)
+        for bit in range(64):
+            weights[bit] += count if h >> bit & 1 else -count
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+def compute_minhash(words: List[str]) -> List[int]:
+    """MinHash signature over word shingles"""
+    if len(words) < SHINGLE_SIZE:
+        shingles = {' '.join(words)} if words else set()
+    else:
+        shingles = {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    if not shingles:
+        return [_MAX_HASH] * NUM_PERMUTATIONS
+    hashes = [_hash64(s) for s in shingles]
+    return [
+        min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+        for a, b in _PERMUTATIONS
+    ]
+
+def pack_minhash(signature: List[int]) -> str:
+    return ''.join(f"{value:08x}" for value in signature)
+
+def unpack_minhash(packed: str) -> List[int]:
+    return [int(packed[i:i + 8], 16) for i in range(0, len(packed), 8)]
+
+def fingerprint_text(text: str) -> TextFingerprint:
+    """Compute the stored fingerprint of extracted document text"""
+    words = normalize_text(text)
+    return TextFingerprint(
+        simhash=f"{compute_simhash(words):016x}",
+        minhash=pack_minhash(compute_minhash(words))
+    )
+
+def estimate_similarity(sig_a: List[int], sig_b: List[int]) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures"""
+    if not sig_a or len(sig_a) != len(sig_b):
+        return 0.0
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+def simhash_distance(hash_a: str, hash_b: str) -> int:
+    """Hamming distance between two hex SimHashes"""
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
+
+class NearDuplicateIndex:
+    """Banded LSH index over MinHash signatures"""
+
+    def __init__(self, bands: int = LSH_BANDS, rows: int = LSH_ROWS):
+        self.bands = bands
+        self.rows = rows
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], set] = {}
+        self._entries: Dict[Any, TextFingerprint] = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def _band_keys(self, signature: List[int]):
+        for band in range(self.bands):
+            yield band, tuple(signature[band * self.rows:(band + 1) * self.rows])
+
+    def add(self, doc_id, fingerprint: TextFingerprint):
+        signature = fingerprint.signature
+        if len(signature) != self.bands * self.rows:
+            return
+        with self._lock:
+            self._entries[doc_id] = fingerprint
+            for key in self._band_keys(signature):
+                self._buckets.setdefault(key, set()).add(doc_id)
+
+    def remove(self, doc_id):
+        with self._lock:
+            fingerprint = self._entries.pop(doc_id, None)
+            if not fingerprint:
+                return
+            for key in self._band_keys(fingerprint.signature):
+                bucket = self._buckets.get(key)
+                if bucket:
+                    bucket.discard(doc_id)
+                    if not bucket:
+                        del self._buckets[key]
+
+    def query(self, fingerprint: TextFingerprint,
+              threshold: float = NEAR_DUPLICATE_THRESHOLD) -> Optional[Dict[str, Any]]:
+        """Return the most similar indexed document above the threshold, if any"""
+        signature = fingerprint.signature
+        if len(signature) != self.bands * self.rows:
+            return None
+        with self._lock:
+            candidates = set()
+            for key in self._band_keys(signature):
+                candidates |= self._buckets.get(key, set())
+            best = None
+            for doc_id in candidates:
+                other = self._entries[doc_id]
+                similarity = estimate_similarity(signature, other.signature)
+                if similarity >= threshold and (best is None or similarity > best['similarity']):
+                    best = {
+                        'document_id': doc_id,
+                        'similarity': similarity,
+                        'simhash_distance': simhash_distance(fingerprint.simhash, other.simhash)
+                    }
+            return best
+
+    def __len__(self):
+        return len(self._entries)
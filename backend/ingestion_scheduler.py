@@ -0,0 +1,162 @@
+# ingestion_scheduler.py - Priority- and size-aware ordering of queued uploads
+#
+# Each upload gets a cheap pre-score from its key and listing entry only
+# (nothing is downloaded): a priority class from key-name urgency hints and
+# the department prefix, then its object size, so the smallest job of the
+# most urgent class runs first. To keep large or low-priority uploads from
+# waiting forever behind a stream of urgent ones, every
+# INGEST_FAIRNESS_EVERY-th dispatch goes to the oldest upload instead once it
+# has waited longer than INGEST_STARVATION_SECONDS.
+import os
+import re
+import time
+import heapq
+import itertools
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# Dispatch order of the classes, most urgent first
+PRIORITY_CLASSES = ('urgent', 'priority', 'normal', 'bulk')
+PRIORITY_DEPARTMENTS = tuple(
+    name.strip() for name in os.getenv('INGEST_PRIORITY_DEPARTMENTS', 'safety,compliance').split(',') if name.strip()
+)
+URGENT_KEY_HINTS = {'urgent', 'emergency', 'incident', 'accident', 'injury', 'hazard', 'critical',
+                    'asap', 'violation', 'overdue', 'recall', 'spill', 'evacuation'}
+BULK_KEY_HINTS = {'fyi', 'archive', 'archived', 'draft', 'backup', 'copy', 'manual', 'handbook'}
+INGEST_BULK_BYTES = int(os.getenv('INGEST_BULK_BYTES', 20 * 1024 * 1024))
+INGEST_STARVATION_SECONDS = float(os.getenv('INGEST_STARVATION_SECONDS', 900))
+INGEST_FAIRNESS_EVERY = int(os.getenv('INGEST_FAIRNESS_EVERY', 4))
+INGEST_SCHEDULE_WINDOW = int(os.getenv('INGEST_SCHEDULE_WINDOW', 2000))
+
+def upload_department(s3_key: str) -> Optional[str]:
+    """Department prefix of an uploads/<department>/<file> key"""
+    parts = s3_key.split('/')
+    return parts[1] if len(parts) > 2 and parts[0] == 'uploads' else None
+
+def key_tokens(s3_key: str) -> set:
+    """Lowercase words of the file name, without the uuid prefix added on upload"""
+    filename = os.path.basename(s3_key).lower()
+    filename = re.sub(r'^[0-9a-f]{32}_', '', filename)
+    return set(re.split(r'[^a-z0-9]+', os.path.splitext(filename)[0])) - {''}
+
+def priority_class(s3_key: str, size: int = 0) -> str:
+    tokens = key_tokens(s3_key)
+    if tokens & URGENT_KEY_HINTS:
+        return 'urgent'
+    if upload_department(s3_key) in PRIORITY_DEPARTMENTS:
+        return 'priority'
+    if tokens & BULK_KEY_HINTS or size >= INGEST_BULK_BYTES:
+        return 'bulk'
+    return 'normal'
+
+def _timestamp(value: Any) -> Optional[float]:
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return float(value) if value is not None else None
+
+@dataclass
+class QueuedUpload:
+    s3_key: str
+    etag: str
+    size: int
+    priority_class: str
+    queued_at: float
+    sequence: int
+
+class IngestionScheduler:
+    """Queue of uploads dispatched by (priority class, size) with an oldest-first fairness slot.
+
+    queued_at is when the upload started waiting; pass the object's
+    LastModified so the wait (and starvation protection) carries across
+    runs that leave it behind. Not thread-safe: one ingestion loop owns it.
+    """
+
+    def __init__(self, starvation_seconds: float = INGEST_STARVATION_SECONDS,
+                 fairness_every: int = INGEST_FAIRNESS_EVERY, clock=time.time):
+        self.starvation_seconds = starvation_seconds
+        self.fairness_every = max(int(fairness_every), 1)
+        self.clock = clock
+        self._by_priority: List = []
+        self._by_age: List = []
+        self._queued: Dict[int, QueuedUpload] = {}
+        self._sequence = itertools.count()
+        self._waits: Dict[str, List[float]] = {name: [] for name in PRIORITY_CLASSES}
+        self.dispatched = 0
+        self.promoted = 0
+
+    def __len__(self) -> int:
+        return len(self._queued)
+
+    def push(self, s3_key: str, etag: str = '', size: int = 0, queued_at: Any = None) -> QueuedUpload:
+        queued_at = _timestamp(queued_at)
+        item = QueuedUpload(
+            s3_key=s3_key,
+            etag=etag or '',
+            size=int(size or 0),
+            priority_class=priority_class(s3_key, size or 0),
+            queued_at=min(queued_at, self.clock()) if queued_at is not None else self.clock(),
+            sequence=next(self._sequence)
+        )
+        self._queued[item.sequence] = item
+        heapq.heappush(self._by_priority, (PRIORITY_CLASSES.index(item.priority_class), item.size,
+                                           item.queued_at, item.sequence))
+        heapq.heappush(self._by_age, (item.queued_at, item.sequence))
+        return item
+
+    def _peek(self, heap: List) -> Optional[QueuedUpload]:
+        # Entries dispatched through the other heap are dropped lazily
+        while heap and heap[0][-1] not in self._queued:
+            heapq.heappop(heap)
+        return self._queued[heap[0][-1]] if heap else None
+
+    def pop(self) -> Optional[QueuedUpload]:
+        now = self.clock()
+        item = None
+        if (self.dispatched + 1) % self.fairness_every == 0:
+            oldest = self._peek(self._by_age)
+            if oldest and now - oldest.queued_at >= self.starvation_seconds:
+                item = oldest
+        if item is None:
+            item = self._peek(self._by_priority)
+            if item is None:
+                return None
+        elif item is not self._peek(self._by_priority):
+            self.promoted += 1
+
+        del self._queued[item.sequence]
+        self.dispatched += 1
+        self._waits[item.priority_class].append(max(now - item.queued_at, 0.0))
+        return item
+
+    def pop_batch(self, limit: int) -> List[QueuedUpload]:
+        batch = []
+        while len(batch) < limit:
+            item = self.pop()
+            if item is None:
+                break
+            batch.append(item)
+        return batch
+
+    def waiting(self) -> Dict[str, int]:
+        counts = {name: 0 for name in PRIORITY_CLASSES}
+        for item in self._queued.values():
+            counts[item.priority_class] += 1
+        return counts
+
+    def wait_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Queue wait at dispatch per priority class, in seconds"""
+        stats = {}
+        for name, waits in self._waits.items():
+            if not waits:
+                stats[name] = {'dispatched': 0}
+                continue
+            ordered = sorted(waits)
+            stats[name] = {
+                'dispatched': len(ordered),
+                'mean_seconds': round(sum(ordered) / len(ordered), 3),
+                'p50_seconds': round(ordered[len(ordered) // 2], 3),
+                'p95_seconds': round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)], 3),
+                'max_seconds': round(ordered[-1], 3)
+            }
+        return stats
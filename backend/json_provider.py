@@ -0,0 +1,124 @@
+# json_provider.py - Fast JSON serialization and streamed JSON array responses
+import json
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+from flask import Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional dependency, stdlib json is used instead
+    orjson = None
+
+# Streamed responses are flushed in chunks of roughly this many characters
+STREAM_BUFFER_SIZE = 64 * 1024
+
+class RawJSON(str):
+    """Text that is already valid JSON and is emitted without re-encoding"""
+
+def _default(obj):
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, 'value'):  # Enum
+        return obj.value
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dumps(obj: Any) -> str:
+    """Compact JSON encoding, using orjson when it is installed"""
+    if isinstance(obj, RawJSON):
+        return obj
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(obj, default=_default, separators=(',', ':'), ensure_ascii=False)
+
+def _is_json(text: str) -> bool:
+    try:
+        if orjson is not None:
+            orjson.loads(text)
+        else:
+            json.loads(text)
+    except ValueError:
+        return False
+    return True
+
+def raw_json(text: Optional[str], default: str) -> RawJSON:
+    """Stored JSON column text as a raw fragment, or the default when empty or malformed.
+
+    The text is validated (not re-encoded), so one bad row cannot corrupt a
+    whole response.
+    """
+    if text and text.lstrip()[:1] in ('[', '{') and _is_json(text):
+        return RawJSON(text)
+    return RawJSON(default)
+
+def dumps_with_raw(obj: Dict[str, Any], raw: Dict[str, str]) -> RawJSON:
+    """Encode a dict and splice in pre-serialized JSON values without parsing them"""
+    text = dumps(obj)
+    if not raw:
+        return RawJSON(text)
+    extra = ','.join(f"{dumps(key)}:{value}" for key, value in raw.items())
+    return RawJSON(text[:-1] + (',' if obj else '') + extra + '}')
+
+def _json_array_chunks(rows: Iterable[Any], serialize: Callable[[Any], str]) -> Iterator[str]:
+    buffer = ['[']
+    size = 1
+    first = True
+    for row in rows:
+        text = row if isinstance(row, RawJSON) else serialize(row)
+        if not first:
+            buffer.append(',')
+            size += 1
+        buffer.append(text)
+        size += len(text)
+        first = False
+        if size >= STREAM_BUFFER_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    buffer.append(']')
+    yield ''.join(buffer)
+
+def stream_json_array(rows: Iterable[Any], serialize: Callable[[Any], str] = dumps) -> Response:
+    """Stream rows as a chunked JSON array instead of building the whole list.
+
+    The first chunk is built before the response starts, so errors in the
+    query or the first rows raise here and the caller can answer with an
+    error status. A later error aborts the transfer without its final chunk
+    instead of ending it like a complete (but short) array.
+    """
+    chunks = _json_array_chunks(rows, serialize)
+    first_chunk = next(chunks)
+
+    def generate():
+        yield first_chunk
+        try:
+            yield from chunks
+        except Exception as e:
+            print(f"❌ JSON stream aborted mid-response: {e}")
+            raise
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, falling back to the default provider"""
+
+    sort_keys = False
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        # orjson output is always compact; only indentation is configurable
+        options = dict(kwargs)
+        options.pop('separators', None)
+        option = orjson.OPT_NON_STR_KEYS
+        if options.pop('indent', None):
+            option |= orjson.OPT_INDENT_2
+        if options:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
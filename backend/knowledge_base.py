@@ -0,0 +1,246 @@
+# knowledge_base.py - Retrieval-backed question answering over processed documents
+import re
+import json
+import math
+import hashlib
+import threading
+from collections import OrderedDict, Counter
+from typing import List, Dict, Any, Optional, Tuple
+from models import ProcessedDocument
+from model import call_llm
+from versioning import processed_documents_version
+
+# Context / cache limits
+MAX_CONTEXT_TOKENS = 1500
+MAX_PASSAGES = 12
+ANSWER_MAX_TOKENS = 500
+ANSWER_CACHE_SIZE = 512
+DUPLICATE_PASSAGE_THRESHOLD = 0.6
+
+STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'have',
+    'how', 'in', 'is', 'it', 'its', 'of', 'on', 'or', 'that', 'the', 'this', 'to',
+    'was', 'were', 'what', 'when', 'where', 'which', 'who', 'why', 'will', 'with',
+    'do', 'does', 'did', 'can', 'we', 'our', 'any', 'all', 'there', 'their', 'about'
+}
+
+ANSWER_SYSTEM_MESSAGE = (
+    "You answer questions for an infrastructure organisation using only the "
+    "document excerpts provided. Cite documents by their [n] number. If the "
+    "excerpts do not contain the answer, say so briefly."
+)
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so trivially different phrasings share a cache entry"""
+    text = re.sub(r'[^a-z0-9\s]', ' ', question.lower())
+    return ' '.join(text.split())
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase search terms, dropping stop words"""
+    return [t for t in re.findall(r'[a-z0-9]+', text.lower()) if len(t) > 1 and t not in STOP_WORDS]
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = tokenize(text)
+    if len(words) < size:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def _split_passages(text: str, max_chars: int = 400) -> List[str]:
+    """Split a summary into sentence-aligned passages of bounded size"""
+    sentences = re.split(r'(?<=[.!?])\s+', text.strip())
+    passages, current = [], ''
+    for sentence in sentences:
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            passages.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        passages.append(current)
+    return passages
+
+class PassageIndex:
+    """In-memory inverted index over summaries and key points of one department"""
+
+    def __init__(self, version: str):
+        self.version = version
+        self.passages: List[Dict[str, Any]] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.avg_length = 0.0
+
+    def add(self, doc: ProcessedDocument, text: str, kind: str):
+        terms = tokenize(text)
+        if not terms:
+            return
+        passage_id = len(self.passages)
+        self.passages.append({
+            'document_id': doc.id,
+            'filename': doc.original_filename,
+            'document_type': doc.document_type,
+            'kind': kind,
+            'text': text,
+            'length': len(terms)
+        })
+        for term, freq in Counter(terms).items():
+            self.postings.setdefault(term, []).append((passage_id, freq))
+
+    def finalize(self):
+        if self.passages:
+            self.avg_length = sum(p['length'] for p in self.passages) / len(self.passages)
+
+    def search(self, question: str, limit: int) -> List[Dict[str, Any]]:
+        """Rank passages with BM25 over the question terms"""
+        k1, b = 1.5, 0.75
+        total = len(self.passages)
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(question)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for passage_id, freq in postings:
+                length = self.passages[passage_id]['length']
+                norm = freq * (k1 + 1) / (freq + k1 * (1 - b + b * length / self.avg_length))
+                scores[passage_id] = scores.get(passage_id, 0.0) + idf * norm
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [dict(self.passages[pid], score=round(score, 4)) for pid, score in ranked]
+
+def build_passage_index(department: Optional[str], version: str) -> PassageIndex:
+    """Build the passage index for a department from processed documents"""
+    index = PassageIndex(version)
+    query = ProcessedDocument.query.filter_by(status='processed')
+    if department:
+        query = query.filter_by(department=department)
+    for doc in query.all():
+        for passage in _split_passages(doc.summary or ''):
+            index.add(doc, passage, 'summary')
+        try:
+            key_points = json.loads(doc.key_points) if doc.key_points else []
+        except (ValueError, TypeError):
+            key_points = []
+        for point in key_points:
+            if isinstance(point, str):
+                index.add(doc, point, 'key_point')
+    index.finalize()
+    return index
+
+def deduplicate_passages(passages: List[Dict[str, Any]],
+                         threshold: float = DUPLICATE_PASSAGE_THRESHOLD) -> List[Dict[str, Any]]:
+    """Drop passages whose word shingles overlap an already kept passage"""
+    kept, kept_shingles = [], []
+    for passage in passages:
+        shingles = _shingles(passage['text'])
+        if not shingles:
+            continue
+        duplicate = False
+        for other in kept_shingles:
+            overlap = len(shingles & other) / min(len(shingles), len(other))
+            if overlap >= threshold:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(passage)
+            kept_shingles.append(shingles)
+    return kept
+
+def assemble_context(passages: List[Dict[str, Any]],
+                     max_tokens: int = MAX_CONTEXT_TOKENS) -> Tuple[str, List[Dict[str, Any]]]:
+    """Group passages per document into a numbered context within the token budget"""
+    sources: List[Dict[str, Any]] = []
+    blocks: Dict[int, List[str]] = OrderedDict()
+    used = 0
+    for passage in passages:
+        doc_id = passage['document_id']
+        header = ''
+        if doc_id not in blocks:
+            header = f"[{len(blocks) + 1}] {passage['filename']} ({passage['document_type']})"
+        line = f"- {passage['text']}"
+        cost = estimate_tokens(line) + (estimate_tokens(header) if header else 0)
+        if used + cost > max_tokens:
+            continue
+        if header:
+            blocks[doc_id] = [header]
+            sources.append({
+                'id': doc_id,
+                'original_filename': passage['filename'],
+                'document_type': passage['document_type']
+            })
+        blocks[doc_id].append(line)
+        used += cost
+    context = '\n\n'.join('\n'.join(lines) for lines in blocks.values())
+    return context, sources
+
+class AnswerCache:
+    """Thread-safe LRU cache of answers"""
+
+    def __init__(self, max_size: int = ANSWER_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+answer_cache = AnswerCache()
+_index_cache: Dict[Optional[str], PassageIndex] = {}
+_index_lock = threading.Lock()
+
+def get_passage_index(department: Optional[str], version: str) -> PassageIndex:
+    """Return the passage index for a department, rebuilding it when the version moves"""
+    with _index_lock:
+        index = _index_cache.get(department)
+        if index is None or index.version != version:
+            index = build_passage_index(department, version)
+            _index_cache[department] = index
+        return index
+
+def answer_question(question: str, department: Optional[str] = None) -> Dict[str, Any]:
+    """Answer a question from the processed documents of a department"""
+    normalized = normalize_question(question)
+    version = processed_documents_version(department)
+    cache_key = (hashlib.sha256(normalized.encode()).hexdigest(), department, version)
+
+    cached = answer_cache.get(cache_key)
+    if cached:
+        return dict(cached, cached=True)
+
+    index = get_passage_index(department, version)
+    passages = deduplicate_passages(index.search(normalized, MAX_PASSAGES * 2))[:MAX_PASSAGES]
+
+    if not passages:
+        return {
+            'answer': 'No processed documents match this question yet.',
+            'sources': [],
+            'cached': False,
+            'index_version': version
+        }
+
+    context, sources = assemble_context(passages)
+    prompt = f"Document excerpts:\n{context}\n\nQuestion: {question.strip()}\nAnswer:"
+    answer, _ = call_llm(prompt, system_message=ANSWER_SYSTEM_MESSAGE, max_tokens=ANSWER_MAX_TOKENS)
+
+    result = {
+        'answer': answer or 'The assistant could not generate an answer right now.',
+        'sources': sources,
+        'context_tokens': estimate_tokens(context),
+        'index_version': version
+    }
+    # Only cache real answers so a transient LLM failure is retried next time
+    if answer:
+        answer_cache.set(cache_key, result)
+    return dict(result, cached=False)
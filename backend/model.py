@@ -3,16 +3,26 @@ import os
 import json
 import uuid
 import boto3
+import time
 import tempfile
+import threading
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from collections import deque
+from typing import List, Dict, Any, Optional, Callable, Tuple
 from dataclasses import dataclass, asdict
 from enum import Enum
 import re
+import hashlib
 import warnings
 from dotenv import load_dotenv
 from huggingface_hub import InferenceClient
 import getpass
+from fingerprint import fingerprint_text, TextFingerprint
+from tracing import span, traced, current_trace_id, instrument_boto3_client
+from text_store import create_text_store
+from ingestion_scheduler import IngestionScheduler, QueuedUpload, INGEST_SCHEDULE_WINDOW
+from model_router import create_model_router, token_counts
+from url_cache import presigned_url_cache
 
 warnings.filterwarnings('ignore')
 
@@ -26,12 +36,22 @@ AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 
 # Initialize S3 client
-s3_client = boto3.client(
+s3_client = instrument_boto3_client(boto3.client(
     's3',
     aws_access_key_id=AWS_ACCESS_KEY_ID,
     aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
     region_name=AWS_REGION
-)
+))
+
+# Extracted text keyed by object ETag (see text_store.py)
+text_store = create_text_store(lambda: s3_client, AWS_S3_BUCKET)
+
+# Backlog ingestion defaults (overridable per run)
+INGEST_PAGE_SIZE = 1000
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 10))
+INGEST_TIME_BUDGET_SECONDS = float(os.getenv('INGEST_TIME_BUDGET_SECONDS', 240))
+# Analyze each backlog batch concurrently with async_pipeline instead of one document at a time
+INGEST_USE_ASYNC = os.getenv('INGEST_USE_ASYNC', '').lower() in ('1', 'true', 'yes')
 
 # Initialize Hugging Face Inference Client
 hf_token = os.getenv("HF_TOKEN")
@@ -44,6 +64,9 @@ client = InferenceClient(api_key=hf_token)
 # Define model to use
 MODEL_NAME = "deepseek-ai/DeepSeek-V3.2"
 
+# Per-stage model, max_tokens and temperature with fallback (see model_router.py)
+model_router = create_model_router(MODEL_NAME)
+
 # Define enums and dataclasses
 class DocumentType(Enum):
     INVOICE = "invoice"
@@ -86,6 +109,35 @@ class DocumentProcessingResult:
     processed_date: str
     s3_key: Optional[str] = None
     s3_url: Optional[str] = None
+    simhash: Optional[str] = None
+    minhash: Optional[str] = None
+    duplicate_of: Optional[int] = None
+
+# Pipeline hooks: near-duplicate lookup and progress reporting
+DuplicateLookup = Callable[[TextFingerprint], Optional[Dict[str, Any]]]
+ProgressCallback = Callable[..., None]
+
+def report_progress(progress: Optional[ProgressCallback], stage: str, s3_key: str, **details):
+    """Send a stage event to the progress callback, if any"""
+    if progress:
+        try:
+            progress(stage, s3_key, **details)
+        except Exception as e:
+            print(f"⚠️  Progress callback failed: {e}")
+
+def result_to_dict(result: DocumentProcessingResult) -> Dict[str, Any]:
+    """JSON-safe form of a processing result"""
+    data = asdict(result)
+    data['document_type'] = result.document_type.value
+    data['department'] = result.department.value
+    return data
+
+def result_from_dict(data: Dict[str, Any]) -> DocumentProcessingResult:
+    return DocumentProcessingResult(**dict(
+        data,
+        document_type=DocumentType(data['document_type']),
+        department=Department(data['department'])
+    ))
 
 @dataclass
 class CalendarEvent:
@@ -97,6 +149,7 @@ class CalendarEvent:
     action_required: bool
 
 # S3 Helper Functions
+@traced('stage.download_from_s3')
 def download_from_s3(s3_key: str) -> str:
     """Download file from S3 to local temporary file"""
     try:
@@ -114,34 +167,38 @@ def download_from_s3(s3_key: str) -> str:
         print(f"❌ Error downloading from S3: {e}")
         raise
 
+def processed_upload_args(file_path: str, department: str, document_type: str) -> Dict[str, Any]:
+    """Key and ExtraArgs of the processed copy, with department folder structure"""
+    filename = os.path.basename(file_path)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    unique_id = uuid.uuid4().hex[:8]
+    return {
+        'Key': f"processed/{department}/{document_type}/{timestamp}_{unique_id}_{filename}",
+        'ExtraArgs': {
+            'ContentType': 'application/octet-stream',
+            'Metadata': {
+                'department': department,
+                'document_type': document_type,
+                'processed_date': datetime.now().isoformat()
+            }
+        }
+    }
+
+def s3_object_url(s3_key: str) -> str:
+    return f"https://{AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
+
+@traced('stage.upload_to_s3')
 def upload_to_s3(file_path: str, department: str, document_type: str) -> Dict[str, str]:
     """Upload processed file to S3 with department folder structure"""
     try:
-        # Extract filename
-        filename = os.path.basename(file_path)
-        
-        # Create S3 key with department folder
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        unique_id = uuid.uuid4().hex[:8]
-        s3_key = f"processed/{department}/{document_type}/{timestamp}_{unique_id}_{filename}"
+        upload = processed_upload_args(file_path, department, document_type)
+        s3_key = upload['Key']
         
         # Upload to S3
-        s3_client.upload_file(
-            file_path,
-            AWS_S3_BUCKET,
-            s3_key,
-            ExtraArgs={
-                'ContentType': 'application/octet-stream',
-                'Metadata': {
-                    'department': department,
-                    'document_type': document_type,
-                    'processed_date': datetime.now().isoformat()
-                }
-            }
-        )
+        s3_client.upload_file(file_path, AWS_S3_BUCKET, s3_key, ExtraArgs=upload['ExtraArgs'])
         
         # Generate S3 URL
-        s3_url = f"https://{AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
+        s3_url = s3_object_url(s3_key)
         
         print(f"✅ Uploaded to S3: {s3_key}")
         return {'key': s3_key, 'url': s3_url}
@@ -150,6 +207,45 @@ def upload_to_s3(file_path: str, department: str, document_type: str) -> Dict[st
         print(f"❌ Error uploading to S3: {e}")
         raise
 
+@traced('stage.copy_to_processed')
+def copy_to_processed(s3_key: str, department: str, document_type: str) -> Dict[str, str]:
+    """Server-side copy of an upload into processed/ (no local file needed)"""
+    upload = processed_upload_args(s3_key, department, document_type)
+    s3_client.copy_object(
+        Bucket=AWS_S3_BUCKET,
+        CopySource={'Bucket': AWS_S3_BUCKET, 'Key': s3_key},
+        Key=upload['Key'],
+        MetadataDirective='REPLACE',
+        **upload['ExtraArgs']
+    )
+    print(f"✅ Copied to S3: {upload['Key']}")
+    return {'key': upload['Key'], 'url': s3_object_url(upload['Key'])}
+
+def store_processed_copy(s3_key: str, local_path: Optional[str], department: str, document_type: str) -> Dict[str, str]:
+    """Upload the downloaded file, or copy the upload in S3 when the text came from the text store"""
+    if local_path:
+        return upload_to_s3(local_path, department, document_type)
+    return copy_to_processed(s3_key, department, document_type)
+
+def load_document_text(s3_key: str, etag: Optional[str]):
+    """(local_path, text) of an object version; local_path is None when the text store had it"""
+    try:
+        raw_text = text_store.get(etag)
+    except Exception as e:
+        print(f"⚠️  Text store read failed for {s3_key}: {e}")
+        raw_text = None
+    if raw_text is not None:
+        print(f"📚 Extracted text reused from the text store: {s3_key}")
+        return None, raw_text
+    
+    local_path = download_from_s3(s3_key)
+    raw_text = extract_text_from_file(local_path)
+    try:
+        text_store.put(etag, raw_text)
+    except Exception as e:
+        print(f"⚠️  Text store write failed for {s3_key}: {e}")
+    return local_path, raw_text
+
 def list_s3_documents(department: str = None, limit: int = 100) -> List[Dict]:
     """List documents from S3, optionally filtered by department"""
     try:
@@ -196,253 +292,864 @@ def list_s3_documents(department: str = None, limit: int = 100) -> List[Dict]:
         return []
 
 # LLM Helper Functions
-def call_llm(prompt: str, system_message: str = None, max_tokens: int = 1000) -> str:
-    """Call Hugging Face Inference API"""
+def call_llm(prompt: str, system_message: str = None, max_tokens: Optional[int] = None,
+             stage: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """Call Hugging Face Inference API on the model routed for stage, falling back on errors
+
+    Returns (response, name of the model that answered), or ("", None) when every model fails.
+    """
     messages = []
     
     if system_message:
         messages.append({"role": "system", "content": system_message})
     
     messages.append({"role": "user", "content": prompt})
+    route = model_router.route(stage)
     
-    try:
-        completion = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=messages,
-            max_tokens=max_tokens,
-            temperature=0.3,
-        )
-        
-        response = completion.choices[0].message.content
-        return response.strip()
-    except Exception as e:
-        print(f"Error calling LLM: {e}")
-        return ""
+    for model_name in model_router.candidates(stage):
+        with span('llm.chat_completion', 'CLIENT', **{
+            'llm.model': model_name,
+            'llm.stage': stage or 'default',
+            'llm.max_tokens': max_tokens or route.max_tokens,
+            'llm.prompt_chars': len(prompt)
+        }) as llm_span:
+            started = time.perf_counter()
+            try:
+                completion = client.chat.completions.create(
+                    model=model_name,
+                    messages=messages,
+                    max_tokens=max_tokens or route.max_tokens,
+                    temperature=route.temperature,
+                )
+                response = completion.choices[0].message.content or ''
+            except Exception as e:
+                model_router.record(model_name, stage, time.perf_counter() - started, False)
+                print(f"Error calling LLM {model_name}: {e}")
+                llm_span.record_exception(e)
+                continue
+            
+            model_router.record(model_name, stage, time.perf_counter() - started, True,
+                                *token_counts(completion, len(prompt), response))
+            llm_span.set_attribute('llm.response_chars', len(response))
+            return response.strip(), model_name
+    
+    return "", None
 
 # File processing functions (keep existing extract_text_from_file, etc.)
 
-def process_s3_document(s3_key: str) -> DocumentProcessingResult:
-    """Process a document directly from S3"""
-    print(f"🚀 Processing S3 document: {s3_key}")
-    
+def reuse_duplicate_analysis(s3_key: str, local_path: Optional[str], raw_text: str,
+                             fingerprint: TextFingerprint, duplicate: Dict[str, Any],
+                             progress: Optional[ProgressCallback] = None) -> DocumentProcessingResult:
+    """Build a result from the analysis of an earlier near-duplicate document"""
+    original_filename = os.path.basename(s3_key)
     try:
-        # Download from S3
-        local_path = download_from_s3(s3_key)
-        original_filename = os.path.basename(s3_key)
-        
-        # Extract text
-        raw_text = extract_text_from_file(local_path)
-        print(f"📊 Document size: {len(raw_text)} characters")
-        
-        # Classify document
-        doc_type = classify_document(raw_text)
-        print(f"   ✅ Type: {doc_type.value.upper()}")
-        
-        # Determine department
-        department = determine_department(doc_type, raw_text)
-        print(f"   ✅ Department: {department.value.upper()}")
-        
-        # Create summary
-        summary = create_summary(raw_text, doc_type)
-        print(f"   ✅ Summary created")
-        
-        # Extract key points
-        key_points = extract_key_points(raw_text)
-        print(f"   ✅ Key points: {len(key_points)}")
-        
-        # Extract action items
-        action_items = extract_action_items(raw_text)
-        print(f"   ✅ Action items: {len(action_items)}")
-        
-        # Extract deadline
-        deadline = extract_deadline(raw_text)
-        if deadline:
-            print(f"   ✅ Deadline: {deadline}")
-        
-        # Determine priority
-        priority = determine_priority(raw_text)
-        print(f"   ✅ Priority: {priority}")
-        
-        # Generate processed filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        processed_filename = f"{department.value}_{timestamp}_{uuid.uuid4().hex[:8]}_{original_filename}"
-        
-        # Create metadata
-        doc_metadata = {
-            'original_filename': original_filename,
-            's3_key': s3_key,
-            'processed_date': datetime.now().isoformat(),
-            'document_type': doc_type.value,
-            'department': department.value,
-            'text_length': len(raw_text),
-            'priority': priority,
-            'has_deadline': deadline is not None,
-            'key_points_count': len(key_points),
-            'action_items_count': len(action_items)
-        }
-        
-        # Upload processed version to S3
-        s3_result = upload_to_s3(local_path, department.value, doc_type.value)
-        
-        # Clean up temporary file
+        doc_type = DocumentType(duplicate.get('document_type'))
+    except ValueError:
+        doc_type = DocumentType.UNKNOWN
+    try:
+        department = Department(duplicate.get('department'))
+    except ValueError:
+        department = Department.ADMIN
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    processed_filename = f"{department.value}_{timestamp}_{uuid.uuid4().hex[:8]}_{original_filename}"
+    
+    doc_metadata = dict(duplicate.get('metadata') or {})
+    doc_metadata.update({
+        'original_filename': original_filename,
+        's3_key': s3_key,
+        'processed_date': datetime.now().isoformat(),
+        'text_length': len(raw_text),
+        'duplicate_of': duplicate['id'],
+        'duplicate_similarity': duplicate['similarity'],
+        'trace_id': current_trace_id()
+    })
+    
+    report_progress(progress, 'classified', s3_key, document_type=doc_type.value,
+                    department=department.value, duplicate_of=duplicate['id'])
+    report_progress(progress, 'summarized', s3_key, department=department.value, duplicate_of=duplicate['id'])
+    
+    # Keep the newly uploaded file, but skip the LLM pipeline
+    s3_result = store_processed_copy(s3_key, local_path, department.value, doc_type.value)
+    if local_path:
         os.unlink(local_path)
-        
-        print(f"\n✅ Document processing complete!")
-        
-        return DocumentProcessingResult(
-            file_path=local_path,
-            original_filename=original_filename,
-            processed_filename=processed_filename,
-            document_type=doc_type,
-            department=department,
-            summary=summary,
-            key_points=key_points,
-            action_items=action_items,
-            deadline=deadline,
-            priority=priority,
-            metadata=doc_metadata,
-            raw_text=raw_text[:1000],
-            processed_date=datetime.now().isoformat(),
-            s3_key=s3_result['key'],
-            s3_url=s3_result['url']
-        )
-        
-    except Exception as e:
-        print(f"❌ Error processing S3 document: {e}")
-        raise
+    
+    print(f"♻️  Reused analysis of document {duplicate['id']} (similarity {duplicate['similarity']:.2f})")
+    
+    return DocumentProcessingResult(
+        file_path=local_path or s3_key,
+        original_filename=original_filename,
+        processed_filename=processed_filename,
+        document_type=doc_type,
+        department=department,
+        summary=duplicate.get('summary') or '',
+        key_points=duplicate.get('key_points') or [],
+        action_items=duplicate.get('action_items') or [],
+        deadline=duplicate.get('deadline'),
+        priority=duplicate.get('priority') or 'medium',
+        metadata=doc_metadata,
+        raw_text=raw_text[:1000],
+        processed_date=datetime.now().isoformat(),
+        s3_key=s3_result['key'],
+        s3_url=s3_result['url'],
+        simhash=fingerprint.simhash,
+        minhash=fingerprint.minhash,
+        duplicate_of=duplicate['id']
+    )
+
+def build_processing_result(s3_key: str, local_path: Optional[str], raw_text: str, fingerprint: TextFingerprint,
+                            doc_type: DocumentType, department: Department, summary: str,
+                            key_points: List[str], action_items: List[str], deadline: Optional[str],
+                            priority: str, s3_result: Dict[str, str],
+                            stage_models: Optional[Dict[str, Optional[str]]] = None) -> DocumentProcessingResult:
+    """Assemble the result and metadata of a fully analyzed document
+
+    stage_models maps each LLM stage to the model that answered it (None if
+    every model failed); only stages that succeeded get a recorded version.
+    """
+    original_filename = os.path.basename(s3_key)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    processed_filename = f"{department.value}_{timestamp}_{uuid.uuid4().hex[:8]}_{original_filename}"
+    
+    doc_metadata = {
+        'original_filename': original_filename,
+        's3_key': s3_key,
+        'processed_date': datetime.now().isoformat(),
+        'document_type': doc_type.value,
+        'department': department.value,
+        'text_length': len(raw_text),
+        'priority': priority,
+        'has_deadline': deadline is not None,
+        'key_points_count': len(key_points),
+        'action_items_count': len(action_items),
+        'trace_id': current_trace_id(),
+        'stage_models': dict(stage_models or {}),
+        'stage_versions': recorded_stage_versions(stage_models or {})
+    }
+    
+    return DocumentProcessingResult(
+        file_path=local_path or s3_key,
+        original_filename=original_filename,
+        processed_filename=processed_filename,
+        document_type=doc_type,
+        department=department,
+        summary=summary,
+        key_points=key_points,
+        action_items=action_items,
+        deadline=deadline,
+        priority=priority,
+        metadata=doc_metadata,
+        raw_text=raw_text[:1000],
+        processed_date=datetime.now().isoformat(),
+        s3_key=s3_result['key'],
+        s3_url=s3_result['url'],
+        simhash=fingerprint.simhash,
+        minhash=fingerprint.minhash
+    )
+
+def process_s3_document(s3_key: str,
+                        duplicate_lookup: Optional[DuplicateLookup] = None,
+                        progress: Optional[ProgressCallback] = None,
+                        etag: Optional[str] = None) -> DocumentProcessingResult:
+    """Process a document directly from S3
+    
+    duplicate_lookup receives the text fingerprint and may return the stored
+    analysis of a near-duplicate document, which is then reused instead of
+    running the LLM pipeline again. progress is called as
+    progress(stage, s3_key, **details) after each pipeline stage. Text
+    already extracted for this ETag is read from the text store instead of
+    downloading the object again.
+    """
+    print(f"🚀 Processing S3 document: {s3_key}")
+    
+    with span('process_s3_document', s3_key=s3_key) as doc_span:
+        try:
+            if etag is None and text_store.enabled:
+                etag = get_object_etag(s3_key)
+            
+            # Download from S3 and extract text, unless the text store has it
+            local_path, raw_text = load_document_text(s3_key, etag)
+            report_progress(progress, 'downloaded', s3_key)
+            print(f"📊 Document size: {len(raw_text)} characters")
+            report_progress(progress, 'extracted', s3_key, characters=len(raw_text))
+            
+            # Skip the LLM pipeline for near-duplicates of already processed documents
+            with span('stage.fingerprint_text'):
+                fingerprint = fingerprint_text(raw_text)
+            if duplicate_lookup:
+                with span('stage.duplicate_lookup') as lookup_span:
+                    duplicate = duplicate_lookup(fingerprint)
+                    lookup_span.set_attribute('duplicate.found', bool(duplicate))
+                if duplicate:
+                    doc_span.set_attribute('document.duplicate_of', duplicate['id'])
+                    result = reuse_duplicate_analysis(s3_key, local_path, raw_text, fingerprint, duplicate, progress)
+                    if etag:
+                        result.metadata['etag'] = etag
+                    return result
+            
+            # Classify document
+            stage_models = {}
+            doc_type, stage_models['classify_document'] = classify_document(raw_text)
+            print(f"   ✅ Type: {doc_type.value.upper()}")
+            
+            # Determine department
+            department = determine_department(doc_type, raw_text)
+            print(f"   ✅ Department: {department.value.upper()}")
+            report_progress(progress, 'classified', s3_key, document_type=doc_type.value, department=department.value)
+            
+            # Create summary
+            summary, stage_models['create_summary'] = create_summary(raw_text, doc_type)
+            print(f"   ✅ Summary created")
+            report_progress(progress, 'summarized', s3_key, department=department.value)
+            
+            # Extract key points
+            key_points, stage_models['extract_key_points'] = extract_key_points(raw_text)
+            print(f"   ✅ Key points: {len(key_points)}")
+            
+            # Extract action items
+            action_items, stage_models['extract_action_items'] = extract_action_items(raw_text)
+            print(f"   ✅ Action items: {len(action_items)}")
+            
+            # Extract deadline
+            deadline, stage_models['extract_deadline'] = extract_deadline(raw_text)
+            if deadline:
+                print(f"   ✅ Deadline: {deadline}")
+            
+            # Determine priority
+            priority = determine_priority(raw_text)
+            print(f"   ✅ Priority: {priority}")
+            
+            doc_span.set_attribute('document.department', department.value)
+            doc_span.set_attribute('document.type', doc_type.value)
+            
+            # Store processed version in S3
+            s3_result = store_processed_copy(s3_key, local_path, department.value, doc_type.value)
+            
+            # Clean up temporary file
+            if local_path:
+                os.unlink(local_path)
+            
+            print(f"\n✅ Document processing complete!")
+            
+            result = build_processing_result(
+                s3_key, local_path, raw_text, fingerprint, doc_type, department,
+                summary, key_points, action_items, deadline, priority, s3_result, stage_models
+            )
+            if etag:
+                result.metadata['etag'] = etag
+            return result
+            
+        except Exception as e:
+            print(f"❌ Error processing S3 document: {e}")
+            report_progress(progress, 'failed', s3_key, error=str(e))
+            raise
 
-def batch_process_s3_documents(s3_keys: List[str]) -> Dict[Department, List[DocumentProcessingResult]]:
+def batch_process_s3_documents(s3_keys: List[str],
+                               duplicate_lookup: Optional[DuplicateLookup] = None,
+                               progress: Optional[ProgressCallback] = None) -> Dict[Department, List[DocumentProcessingResult]]:
     """Process multiple documents from S3 and organize by department"""
     results_by_department = {dept: [] for dept in Department}
     
     for s3_key in s3_keys:
         try:
-            result = process_s3_document(s3_key)
+            result = process_s3_document(s3_key, duplicate_lookup, progress)
             results_by_department[result.department].append(result)
         except Exception as e:
             print(f"Failed to process {s3_key}: {e}")
     
     return results_by_department
 
-def auto_fetch_and_process(department: str = None) -> Dict:
-    """Automatically fetch unprocessed documents from S3 and process them"""
-    try:
-        # List all unprocessed documents from S3
-        # We'll look in the 'uploads/' prefix for unprocessed documents
-        unprocessed_docs = []
-        
-        response = s3_client.list_objects_v2(
-            Bucket=AWS_S3_BUCKET,
-            Prefix='uploads/',
-            MaxKeys=50
-        )
+def normalize_etag(etag: Optional[str]) -> str:
+    return (etag or '').strip('"')
+
+def get_object_etag(s3_key: str) -> str:
+    response = s3_client.head_object(Bucket=AWS_S3_BUCKET, Key=s3_key)
+    return normalize_etag(response.get('ETag'))
+
+def iter_upload_keys(department: str = None, start_after: Optional[str] = None,
+                     page_size: int = INGEST_PAGE_SIZE):
+    """Yield unprocessed keys under uploads/ in key order"""
+    for s3_key, _ in iter_upload_objects(department, start_after, page_size):
+        yield s3_key
+
+def iter_upload_objects(department: str = None, start_after: Optional[str] = None,
+                        page_size: int = INGEST_PAGE_SIZE):
+    """Yield (key, ETag) of unprocessed objects under uploads/ in key order, following continuation tokens"""
+    for obj in iter_upload_listing(department, start_after, page_size):
+        yield obj['Key'], normalize_etag(obj.get('ETag'))
+
+def iter_upload_listing(department: str = None, start_after: Optional[str] = None,
+                        page_size: int = INGEST_PAGE_SIZE):
+    """Yield the list_objects_v2 entries (Key, ETag, Size, LastModified) of unprocessed uploads in key order"""
+    prefix = f"uploads/{department}/" if department else 'uploads/'
+    params = {
+        'Bucket': AWS_S3_BUCKET,
+        'Prefix': prefix,
+        'PaginationConfig': {'PageSize': page_size}
+    }
+    if start_after:
+        params['StartAfter'] = start_after
+    
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(**params):
+        for obj in page.get('Contents', []):
+            # Skip folders and anything already processed
+            if obj['Key'].endswith('/') or 'processed/' in obj['Key']:
+                continue
+            yield obj
+
+def archive_upload(s3_key: str) -> str:
+    """Move a processed upload to archive/YYYY/MM/DD/"""
+    filename = os.path.basename(s3_key)
+    archive_key = f"archive/{datetime.now().strftime('%Y/%m/%d')}/{filename}"
+    
+    s3_client.copy_object(
+        Bucket=AWS_S3_BUCKET,
+        CopySource={'Bucket': AWS_S3_BUCKET, 'Key': s3_key},
+        Key=archive_key
+    )
+    s3_client.delete_object(Bucket=AWS_S3_BUCKET, Key=s3_key)
+    # URLs signed for the upload key would now return 404
+    presigned_url_cache.invalidate(s3_key)
+    
+    print(f"📦 Archived: {s3_key} -> {archive_key}")
+    return archive_key
+
+def result_summary(result: DocumentProcessingResult) -> Dict[str, Any]:
+    """Compact description of a processing result for API responses"""
+    return {
+        'original_filename': result.original_filename,
+        's3_key': result.metadata.get('s3_key'),
+        'department': result.department.value,
+        'document_type': result.document_type.value,
+        'priority': result.priority,
+        's3_url': result.s3_url,
+        'simhash': result.simhash,
+        'minhash': result.minhash,
+        'duplicate_of': result.duplicate_of
+    }
+
+def analyze_uploads(items: List[QueuedUpload],
+                    duplicate_lookup: Optional[DuplicateLookup] = None,
+                    progress: Optional[ProgressCallback] = None,
+                    use_async: bool = False) -> List[Tuple[QueuedUpload, Optional[DocumentProcessingResult], Optional[str]]]:
+    """Run the pipeline on queued uploads; (item, result, error) per item, in order.
+
+    use_async processes the items concurrently on one event loop (see
+    async_pipeline.py); duplicate lookups are then serialized, since they
+    share the caller's database session.
+    """
+    if not use_async:
+        outcomes = []
+        for item in items:
+            try:
+                outcomes.append((item, process_s3_document(item.s3_key, duplicate_lookup, progress, item.etag), None))
+            except Exception as e:
+                outcomes.append((item, None, str(e)))
+        return outcomes
+    
+    from async_pipeline import run_async_batch
+    
+    lookup = None
+    if duplicate_lookup:
+        lookup_lock = threading.Lock()
         
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                # Skip if already in processed folder
-                if 'processed/' in obj['Key']:
-                    continue
-                    
-                # Filter by department if specified
-                if department:
-                    # Check if department is in the key path
-                    if f"/{department}/" not in obj['Key']:
-                        continue
-                
-                unprocessed_docs.append(obj['Key'])
+        def lookup(fingerprint):
+            with lookup_lock:
+                return duplicate_lookup(fingerprint)
+    
+    batch = run_async_batch([item.s3_key for item in items], lookup, progress,
+                            etags={item.s3_key: item.etag for item in items if item.etag})
+    by_key = {result.metadata['s3_key']: result
+              for results in batch['results_by_department'].values() for result in results}
+    errors = {failure['s3_key']: failure['error'] for failure in batch['failed']}
+    errors.update({s3_key: 'timed out' for s3_key in batch['timed_out']})
+    errors.update({s3_key: 'cancelled' for s3_key in batch['cancelled']})
+    return [(item, by_key.get(item.s3_key), None if item.s3_key in by_key else errors.get(item.s3_key, 'not processed'))
+            for item in items]
+
+def drain_upload_backlog(department: str = None,
+                         start_after: Optional[str] = None,
+                         batch_size: int = INGEST_BATCH_SIZE,
+                         time_budget: float = INGEST_TIME_BUDGET_SECONDS,
+                         duplicate_lookup: Optional[DuplicateLookup] = None,
+                         progress: Optional[ProgressCallback] = None,
+                         on_batch: Optional[Callable[[List[DocumentProcessingResult], Optional[str]], None]] = None,
+                         ledger=None,
+                         schedule_window: int = INGEST_SCHEDULE_WINDOW,
+                         use_async: bool = INGEST_USE_ASYNC) -> Dict:
+    """Process the uploads/ backlog in batches until it is drained or the time budget runs out.
+
+    The listing starts after start_after and follows continuation tokens.
+    Up to schedule_window listed uploads are queued in an IngestionScheduler
+    and dispatched by priority class and size rather than key order (see
+    ingestion_scheduler.py); queue_wait reports how long each class waited.
+    After each batch on_batch(results, cursor) is called so the caller can
+    persist results and the cursor. The cursor only moves past keys that
+    have all been handled, so uploads still queued when the time budget
+    runs out are listed again by the next run; it is None once the end of
+    the prefix is reached, so the next run starts a new pass. Failed keys
+    stay in uploads/ and are retried on the next pass. backlog_depth counts
+    the listed uploads that were not handled yet; the rest of the listing
+    is not fetched just to count it, so unless backlog_depth_complete it is
+    a lower bound (/ingestion/status lists the whole prefix).
+
+    With a ledger (see processing_ledger.ProcessingLedger) each object
+    version is analyzed at most once: already saved versions are only
+    archived, stored analyses are reused instead of calling the LLM, and
+    versions claimed by a concurrent run are skipped. use_async analyzes the
+    documents of each batch concurrently (see analyze_uploads); ledger,
+    archiving and on_batch work the same either way.
+    """
+    started = time.monotonic()
+    deadline = started + time_budget
+    listing = iter_upload_listing(department, start_after)
+    listing_done = False
+    scheduler = IngestionScheduler()
+    listed = deque()  # queued keys in listing order, to advance the cursor
+    handled = set()
+    cursor = start_after
+    results: List[DocumentProcessingResult] = []
+    failed: List[Dict[str, str]] = []
+    skipped: List[str] = []
+    batches = 0
+    drained = False
+    
+    while True:
+        while not listing_done and len(scheduler) < schedule_window:
+            obj = next(listing, None)
+            if obj is None:
+                listing_done = True
+                break
+            scheduler.push(obj['Key'], normalize_etag(obj.get('ETag')), obj.get('Size', 0), obj.get('LastModified'))
+            listed.append(obj['Key'])
         
-        if not unprocessed_docs:
-            return {'message': 'No unprocessed documents found', 'processed': 0}
+        batch = scheduler.pop_batch(batch_size)
+        if not batch:
+            drained = True
+            cursor = None
+            if on_batch:
+                on_batch([], cursor)
+            break
         
-        print(f"📥 Found {len(unprocessed_docs)} unprocessed documents")
+        for item in batch:
+            report_progress(progress, 'queued', item.s3_key, priority_class=item.priority_class,
+                            size=item.size, waited_seconds=round(time.time() - item.queued_at, 3))
         
-        # Process documents
-        results_by_department = batch_process_s3_documents(unprocessed_docs[:10])  # Limit to 10 at a time
+        def record_failure(item, error):
+            print(f"Failed to process {item.s3_key}: {error}")
+            failed.append({'s3_key': item.s3_key, 'error': error})
+            if ledger:
+                ledger.record_failure(item.s3_key, item.etag, error)
         
-        # Move processed documents to archive
-        for s3_key in unprocessed_docs[:10]:
+        ready = []
+        to_analyze = []
+        for item in batch:
+            s3_key, etag = item.s3_key, item.etag
+            handled.add(s3_key)
             try:
-                # Extract filename
-                filename = os.path.basename(s3_key)
-                
-                # Move to archive folder
-                archive_key = f"archive/{datetime.now().strftime('%Y/%m/%d')}/{filename}"
-                
-                # Copy to archive
-                s3_client.copy_object(
-                    Bucket=AWS_S3_BUCKET,
-                    CopySource={'Bucket': AWS_S3_BUCKET, 'Key': s3_key},
-                    Key=archive_key
-                )
-                
-                # Delete from uploads
-                s3_client.delete_object(
-                    Bucket=AWS_S3_BUCKET,
-                    Key=s3_key
-                )
-                
-                print(f"📦 Archived: {s3_key} -> {archive_key}")
+                if ledger and ledger.is_saved(s3_key, etag):
+                    # Saved by an earlier run that stopped before archiving
+                    skipped.append(s3_key)
+                    archive_upload(s3_key)
+                    continue
                 
+                result = None
+                if ledger:
+                    if not ledger.start(s3_key, etag):
+                        # Claimed by a concurrent run, which also archives it
+                        skipped.append(s3_key)
+                        continue
+                    result = ledger.stored_result(s3_key, etag)
+                    if result is None:
+                        result = ledger.reusable_result(s3_key, etag)
+                        if result is not None:
+                            ledger.record_result(s3_key, etag, result)
+                if result is None:
+                    to_analyze.append(item)
+                    continue
             except Exception as e:
-                print(f"❌ Error archiving {s3_key}: {e}")
+                record_failure(item, str(e))
+                continue
+            ready.append((item, result))
         
-        # Prepare summary
-        total_processed = sum(len(docs) for docs in results_by_department.values())
-        dept_summary = {dept.value: len(docs) for dept, docs in results_by_department.items() if docs}
+        for item, result, error in analyze_uploads(to_analyze, duplicate_lookup, progress, use_async):
+            if error is None and ledger:
+                try:
+                    ledger.record_result(item.s3_key, item.etag, result)
+                except Exception as e:
+                    error = str(e)
+            if error is not None:
+                record_failure(item, error)
+                continue
+            ready.append((item, result))
         
-        return {
-            'message': f'Successfully processed {total_processed} documents',
-            'total_processed': total_processed,
-            'by_department': dept_summary,
-            'documents': [
-                {
-                    'original_filename': result.original_filename,
-                    'department': result.department.value,
-                    'document_type': result.document_type.value,
-                    'priority': result.priority,
-                    's3_url': result.s3_url
-                }
-                for dept_docs in results_by_department.values()
-                for result in dept_docs
-            ]
-        }
+        batch_results = []
+        for item, result in ready:
+            batch_results.append(result)
+            try:
+                archive_upload(item.s3_key)
+                if ledger:
+                    ledger.record_stage(item.s3_key, item.etag, 'archived')
+            except Exception as e:
+                print(f"❌ Error archiving {item.s3_key}: {e}")
+        
+        batches += 1
+        while listed and listed[0] in handled:
+            cursor = listed.popleft()
+            handled.discard(cursor)
+        results.extend(batch_results)
+        if on_batch:
+            on_batch(batch_results, cursor)
+        
+        if time.monotonic() >= deadline:
+            break
+    
+    backlog_depth = 0 if drained else len(scheduler)
+    by_department: Dict[str, int] = {}
+    for result in results:
+        by_department[result.department.value] = by_department.get(result.department.value, 0) + 1
+    
+    print(f"📥 Ingested {len(results)} documents in {batches} batches, "
+          f"{backlog_depth}{'' if drained or listing_done else '+'} waiting")
+    return {
+        'message': f'Successfully processed {len(results)} documents',
+        'total_processed': len(results),
+        'failed': failed,
+        'skipped': skipped,
+        'batches': batches,
+        'by_department': by_department,
+        'cursor': cursor,
+        'drained': drained,
+        'backlog_depth': backlog_depth,
+        'backlog_depth_complete': drained or listing_done,
+        'queue_wait': scheduler.wait_stats(),
+        'starvation_promotions': scheduler.promoted,
+        'elapsed_seconds': round(time.monotonic() - started, 3),
+        'documents': [result_summary(result) for result in results]
+    }
+
+def auto_fetch_and_process(department: str = None,
+                           duplicate_lookup: Optional[DuplicateLookup] = None,
+                           progress: Optional[ProgressCallback] = None,
+                           start_after: Optional[str] = None,
+                           on_batch: Optional[Callable[[List[DocumentProcessingResult], Optional[str]], None]] = None,
+                           batch_size: int = INGEST_BATCH_SIZE,
+                           time_budget: float = INGEST_TIME_BUDGET_SECONDS,
+                           ledger=None,
+                           use_async: bool = INGEST_USE_ASYNC) -> Dict:
+    """Automatically fetch unprocessed documents from S3 and process them"""
+    try:
+        result = drain_upload_backlog(department, start_after, batch_size, time_budget,
+                                      duplicate_lookup, progress, on_batch, ledger, use_async=use_async)
+        if not result['total_processed'] and not result['failed']:
+            result['message'] = 'No unprocessed documents found'
+        return result
         
     except Exception as e:
         print(f"❌ Error in auto-fetch: {e}")
         return {'error': str(e), 'processed': 0}
 
-# Keep existing functions from the original model.py
+# Pipeline stages
+MAX_LLM_INPUT_CHARS = 6000
+
+DEPARTMENT_BY_TYPE = {
+    DocumentType.INVOICE: Department.FINANCE,
+    DocumentType.TECHNICAL_DOC: Department.ENGINEERING,
+    DocumentType.TIMELINE: Department.MANAGEMENT,
+    DocumentType.SAFETY_REPORT: Department.SAFETY,
+    DocumentType.COMPLIANCE_DOC: Department.COMPLIANCE,
+    DocumentType.HR_DOCUMENT: Department.HR,
+    DocumentType.ENGINEERING_REPORT: Department.ENGINEERING,
+    DocumentType.OPERATIONS_MANUAL: Department.OPERATIONS,
+    DocumentType.PROCUREMENT_ORDER: Department.PROCUREMENT,
+    DocumentType.ADMINISTRATIVE: Department.ADMIN,
+}
+
+PRIORITY_KEYWORDS = {
+    'high': ['urgent', 'immediately', 'critical', 'emergency', 'hazard', 'violation', 'overdue', 'asap'],
+    'low': ['fyi', 'for your information', 'no action required', 'archive'],
+}
+
+def _llm_input(text: str) -> str:
+    return text[:MAX_LLM_INPUT_CHARS]
+
+def _parse_list(response: str) -> List[str]:
+    """Lines of a bulleted or numbered LLM answer"""
+    items = []
+    for line in response.splitlines():
+        line = re.sub(r'^\s*(?:[-*\u2022]|\d+[.)])\s*', '', line).strip()
+        if line and line.upper() != 'NONE':
+            items.append(line)
+    return items
+
+@traced('stage.extract_text_from_file')
 def extract_text_from_file(file_path: str) -> str:
     """Extract text from file - handles both PDF and text files"""
-    # ... (keep existing implementation)
+    extension = os.path.splitext(file_path)[1].lower()
+    
+    if extension == '.pdf':
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            PdfReader = None
+        if PdfReader:
+            reader = PdfReader(file_path)
+            return '\n'.join(page.extract_text() or '' for page in reader.pages)
+    
+    if extension == '.docx':
+        try:
+            import docx
+            return '\n'.join(paragraph.text for paragraph in docx.Document(file_path).paragraphs)
+        except ImportError:
+            pass
+    
+    with open(file_path, 'rb') as f:
+        return f.read().decode('utf-8', errors='ignore')
+
+# LLM stages are split into a request builder and a parser so the
+# asynchronous pipeline (async_pipeline.py) sends the same prompts
+def classification_request(text: str) -> Dict[str, Any]:
+    types = ', '.join(t.value for t in DocumentType if t != DocumentType.UNKNOWN)
+    return {
+        'prompt': f"Classify this document as one of: {types}.\n"
+                  f"Reply with the type only.\n\nDocument:\n{_llm_input(text)}",
+        'system_message': "You classify documents of an infrastructure organisation.",
+        'stage': 'classify_document'
+    }
+
+def parse_document_type(response: str) -> DocumentType:
+    response = response.lower()
+    for doc_type in DocumentType:
+        if doc_type.value in response:
+            return doc_type
+    return DocumentType.UNKNOWN
+
+def summary_request(text: str, doc_type: DocumentType) -> Dict[str, Any]:
+    return {
+        'prompt': f"Summarize this {doc_type.value.replace('_', ' ')} in 3-5 sentences for the "
+                  f"department that must act on it.\n\nDocument:\n{_llm_input(text)}",
+        'stage': 'create_summary'
+    }
+
+def parse_summary(response: str, text: str) -> str:
+    return response or text[:500]
+
+def key_points_request(text: str) -> Dict[str, Any]:
+    return {
+        'prompt': f"List the key points of this document, one per line.\n\nDocument:\n{_llm_input(text)}",
+        'stage': 'extract_key_points'
+    }
+
+def action_items_request(text: str) -> Dict[str, Any]:
+    return {
+        'prompt': "List the concrete action items in this document, one per line, "
+                  f"including any due dates. Reply NONE if there are none.\n\nDocument:\n{_llm_input(text)}",
+        'stage': 'extract_action_items'
+    }
 
-def classify_document(text: str) -> DocumentType:
+def parse_items(response: str) -> List[str]:
+    return _parse_list(response)[:10]
+
+def deadline_request(text: str) -> Dict[str, Any]:
+    return {
+        'prompt': "What is the main deadline or due date in this document? Reply with the date "
+                  f"only, or NONE.\n\nDocument:\n{_llm_input(text)}",
+        'stage': 'extract_deadline'
+    }
+
+def parse_deadline(response: str) -> Optional[str]:
+    if not response or response.strip().upper().startswith('NONE'):
+        return None
+    return response.strip()
+
+# LLM stages return (output, model that answered or None)
+StageOutput = Tuple[Any, Optional[str]]
+
+@traced('stage.classify_document')
+def classify_document(text: str) -> StageOutput:
     """Classify document type using LLM"""
-    # ... (keep existing implementation)
+    response, model_name = call_llm(**classification_request(text))
+    return parse_document_type(response), model_name
 
+@traced('stage.determine_department')
 def determine_department(doc_type: DocumentType, text: str) -> Department:
     """Determine which department should handle this document"""
-    # ... (keep existing implementation)
+    if doc_type in DEPARTMENT_BY_TYPE:
+        return DEPARTMENT_BY_TYPE[doc_type]
+    
+    lowered = text.lower()
+    for department in Department:
+        if department.value in lowered:
+            return department
+    return Department.ADMIN
 
-def create_summary(text: str, doc_type: DocumentType) -> str:
+@traced('stage.create_summary')
+def create_summary(text: str, doc_type: DocumentType) -> StageOutput:
     """Create intelligent summary"""
-    # ... (keep existing implementation)
+    response, model_name = call_llm(**summary_request(text, doc_type))
+    return parse_summary(response, text), model_name
 
-def extract_key_points(text: str) -> List[str]:
+@traced('stage.extract_key_points')
+def extract_key_points(text: str) -> StageOutput:
     """Extract key points from document"""
-    # ... (keep existing implementation)
+    response, model_name = call_llm(**key_points_request(text))
+    return parse_items(response), model_name
 
-def extract_action_items(text: str) -> List[str]:
+@traced('stage.extract_action_items')
+def extract_action_items(text: str) -> StageOutput:
     """Extract action items"""
-    # ... (keep existing implementation)
+    response, model_name = call_llm(**action_items_request(text))
+    return parse_items(response), model_name
 
-def extract_deadline(text: str) -> Optional[str]:
+@traced('stage.extract_deadline')
+def extract_deadline(text: str) -> StageOutput:
     """Extract deadline or due date"""
-    # ... (keep existing implementation)
+    response, model_name = call_llm(**deadline_request(text))
+    return parse_deadline(response), model_name
 
+@traced('stage.determine_priority')
 def determine_priority(text: str) -> str:
     """Determine document priority"""
-    # ... (keep existing implementation)
+    lowered = text.lower()
+    for priority in ('high', 'low'):
+        if any(keyword in lowered for keyword in PRIORITY_KEYWORDS[priority]):
+            return priority
+    return 'medium'
+
+# Stage versions: a stage result is stale when its prompt, model or code changes
+STAGE_CODE_VERSIONS = {
+    'classify_document': 1,
+    'determine_department': 1,
+    'create_summary': 1,
+    'extract_key_points': 1,
+    'extract_action_items': 1,
+    'extract_deadline': 1,
+    'determine_priority': 1,
+}
+
+# Prompt builders by stage, rendered with a placeholder to version the template
+STAGE_REQUESTS = {
+    'classify_document': classification_request,
+    'create_summary': lambda text: summary_request(text, DocumentType.UNKNOWN),
+    'extract_key_points': key_points_request,
+    'extract_action_items': action_items_request,
+    'extract_deadline': deadline_request,
+}
+
+# Rule tables of the stages that do not call the LLM
+STAGE_RULES = {
+    'determine_department': DEPARTMENT_BY_TYPE,
+    'determine_priority': PRIORITY_KEYWORDS,
+}
+
+# Stages that must be recomputed when the document type changes
+TYPE_DEPENDENT_STAGES = ('determine_department', 'create_summary')
+
+STAGE_FIELDS = {
+    'classify_document': 'document_type',
+    'determine_department': 'department',
+    'create_summary': 'summary',
+    'extract_key_points': 'key_points',
+    'extract_action_items': 'action_items',
+    'extract_deadline': 'deadline',
+    'determine_priority': 'priority',
+}
+
+def stage_model(stage: str) -> str:
+    """Primary model routed for an LLM stage"""
+    return model_router.route(stage).models[0]
+
+def stage_version(stage: str, model_name: Optional[str] = None) -> str:
+    """Short hash of everything that determines a stage's output besides the text.
+
+    model_name is the model that produced the output (default: the routed primary).
+    """
+    parts = {'stage': stage, 'code': STAGE_CODE_VERSIONS[stage]}
+    if stage in STAGE_REQUESTS:
+        parts['request'] = STAGE_REQUESTS[stage]('{document}')
+        route = model_router.route(stage)
+        parts['model'] = model_name or stage_model(stage)
+        parts['generation'] = {'max_tokens': route.max_tokens, 'temperature': route.temperature}
+    if stage in STAGE_RULES:
+        parts['rules'] = {getattr(key, 'value', key): getattr(value, 'value', value)
+                          for key, value in STAGE_RULES[stage].items()}
+    encoded = json.dumps(parts, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+def stage_versions() -> Dict[str, str]:
+    return {stage: stage_version(stage) for stage in STAGE_CODE_VERSIONS}
+
+def recorded_stage_versions(stage_models: Dict[str, Optional[str]]) -> Dict[str, str]:
+    """Versions to record for one analysis: rule stages always, LLM stages only
+    if a model answered, versioned by that model. A fallback answer therefore
+    stays stale and is rerun once the primary model is back."""
+    versions = {}
+    for stage in STAGE_CODE_VERSIONS:
+        if stage not in STAGE_REQUESTS:
+            versions[stage] = stage_version(stage)
+        elif stage_models.get(stage):
+            versions[stage] = stage_version(stage, stage_models[stage])
+    return versions
+
+def stale_stages(recorded: Optional[Dict[str, str]], current: Optional[Dict[str, str]] = None) -> List[str]:
+    """Stages whose recorded version differs from the current one (all if never recorded)"""
+    current = current or stage_versions()
+    recorded = recorded or {}
+    return [stage for stage in STAGE_CODE_VERSIONS if recorded.get(stage) != current[stage]]
+
+def rerun_stages(raw_text: str, fields: Dict[str, Any], stages: List[str]) -> Dict[str, Any]:
+    """Recompute the given stages on stored text.
+
+    fields holds the current stage outputs (document_type and department as
+    enum values). Returns the changed outputs, the stages actually run, the
+    versions to record for those that succeeded and the LLM stages no model
+    answered (their stored output is kept); a changed document type also
+    reruns the stages that depend on it.
+    """
+    stages = set(stages)
+    updates: Dict[str, Any] = {}
+    stage_models: Dict[str, Optional[str]] = {}
+    doc_type = DocumentType(fields.get('document_type') or DocumentType.UNKNOWN.value)
+    
+    if 'classify_document' in stages:
+        new_type, stage_models['classify_document'] = classify_document(raw_text)
+        if stage_models['classify_document'] and new_type != doc_type:
+            doc_type = new_type
+            updates['document_type'] = new_type.value
+            stages.update(TYPE_DEPENDENT_STAGES)
+    if 'determine_department' in stages:
+        updates['department'] = determine_department(doc_type, raw_text).value
+    if 'create_summary' in stages:
+        summary, stage_models['create_summary'] = create_summary(raw_text, doc_type)
+        if stage_models['create_summary']:
+            updates['summary'] = summary
+    if 'extract_key_points' in stages:
+        key_points, stage_models['extract_key_points'] = extract_key_points(raw_text)
+        if stage_models['extract_key_points']:
+            updates['key_points'] = key_points
+    if 'extract_action_items' in stages:
+        action_items, stage_models['extract_action_items'] = extract_action_items(raw_text)
+        if stage_models['extract_action_items']:
+            updates['action_items'] = action_items
+    if 'extract_deadline' in stages:
+        deadline, stage_models['extract_deadline'] = extract_deadline(raw_text)
+        if stage_models['extract_deadline']:
+            updates['deadline'] = deadline
+    if 'determine_priority' in stages:
+        updates['priority'] = determine_priority(raw_text)
+    
+    changed = {field: value for field, value in updates.items() if fields.get(field) != value}
+    versions = {stage: version for stage, version in recorded_stage_versions(stage_models).items()
+                if stage in stages}
+    return {
+        'changed': changed,
+        'stages': sorted(stages, key=list(STAGE_CODE_VERSIONS).index),
+        'versions': versions,
+        'stage_models': stage_models,
+        'failed_stages': sorted((stage for stage, name in stage_models.items() if not name),
+                                key=list(STAGE_CODE_VERSIONS).index)
+    }
 
 if __name__ == "__main__":
     print("=" * 60)
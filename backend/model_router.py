@@ -0,0 +1,199 @@
+# model_router.py - Per-stage LLM routing with latency- and error-aware fallback
+#
+# Every pipeline stage maps to a Route: an ordered list of models plus the
+# max_tokens and temperature it is called with. One-word answers run on small,
+# fast models; summaries and extraction stay on the large model. A call goes
+# to the first healthy model of its route. A model is taken out of rotation
+# for LLM_FALLBACK_COOLDOWN_SECONDS when the mean latency or the error rate of
+# its last LLM_HEALTH_WINDOW calls crosses the threshold; after the cooldown
+# it gets traffic again with a clean window. Token usage is priced per model
+# (LLM_MODEL_PRICES) so cost is reported next to latency.
+#
+# LLM_ROUTES overrides routes, as inline JSON or the path of a JSON file:
+#   {"classify_document": {"models": ["Qwen/Qwen2.5-7B-Instruct"], "max_tokens": 10}}
+import os
+import json
+import time
+import threading
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional, Tuple
+
+SMALL_MODEL = "Qwen/Qwen2.5-7B-Instruct"
+SMALL_FALLBACK_MODEL = "meta-llama/Llama-3.1-8B-Instruct"
+LARGE_FALLBACK_MODEL = "meta-llama/Llama-3.3-70B-Instruct"
+
+LLM_HEALTH_WINDOW = int(os.getenv('LLM_HEALTH_WINDOW', 20))
+LLM_HEALTH_MIN_CALLS = int(os.getenv('LLM_HEALTH_MIN_CALLS', 5))
+LLM_FALLBACK_LATENCY_SECONDS = float(os.getenv('LLM_FALLBACK_LATENCY_SECONDS', 15))
+LLM_FALLBACK_ERROR_RATE = float(os.getenv('LLM_FALLBACK_ERROR_RATE', 0.5))
+LLM_FALLBACK_COOLDOWN_SECONDS = float(os.getenv('LLM_FALLBACK_COOLDOWN_SECONDS', 60))
+
+# Estimated USD per million (input, output) tokens; override with LLM_MODEL_PRICES
+DEFAULT_MODEL_PRICES = {
+    "deepseek-ai/DeepSeek-V3.2": (0.28, 0.42),
+    LARGE_FALLBACK_MODEL: (0.60, 0.60),
+    SMALL_MODEL: (0.05, 0.10),
+    SMALL_FALLBACK_MODEL: (0.05, 0.08),
+}
+
+@dataclass(frozen=True)
+class Route:
+    models: Tuple[str, ...]
+    max_tokens: int
+    temperature: float
+
+def default_routes(default_model: str) -> Dict[str, Route]:
+    """Routes of the pipeline stages; 'default' serves calls without a stage"""
+    small = (SMALL_MODEL, SMALL_FALLBACK_MODEL, default_model)
+    large = (default_model, LARGE_FALLBACK_MODEL)
+    return {
+        'classify_document': Route(small, 20, 0.0),
+        'extract_deadline': Route(small, 20, 0.0),
+        'create_summary': Route(large, 300, 0.3),
+        'extract_key_points': Route(large, 300, 0.2),
+        'extract_action_items': Route(large, 300, 0.2),
+        'default': Route(large, 1000, 0.3),
+    }
+
+def _load_json_setting(value: Optional[str]) -> Dict[str, Any]:
+    if not value:
+        return {}
+    if value.strip().startswith('{'):
+        return json.loads(value)
+    with open(value) as f:
+        return json.load(f)
+
+def token_counts(completion: Any, prompt_chars: int, response: str) -> Tuple[int, int]:
+    """(prompt, completion) tokens from the response usage, estimated at ~4 characters per token without it"""
+    usage = getattr(completion, 'usage', None)
+    prompt_tokens = getattr(usage, 'prompt_tokens', None)
+    completion_tokens = getattr(usage, 'completion_tokens', None)
+    if prompt_tokens is None:
+        prompt_tokens = prompt_chars // 4 + 1
+    if completion_tokens is None:
+        completion_tokens = len(response or '') // 4 + 1
+    return int(prompt_tokens), int(completion_tokens)
+
+class _ModelHealth:
+    def __init__(self, window: int):
+        self.window = deque(maxlen=window)  # (seconds, ok) of recent calls
+        self.tripped_until = 0.0
+        self.trips = 0
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self.by_stage: Dict[str, int] = {}
+
+class ModelRouter:
+    """Chooses the model of each LLM call and keeps per-model health, latency and cost"""
+
+    def __init__(self, routes: Dict[str, Route], prices: Optional[Dict[str, Tuple[float, float]]] = None,
+                 window: int = LLM_HEALTH_WINDOW, min_calls: int = LLM_HEALTH_MIN_CALLS,
+                 latency_threshold: float = LLM_FALLBACK_LATENCY_SECONDS,
+                 error_threshold: float = LLM_FALLBACK_ERROR_RATE,
+                 cooldown: float = LLM_FALLBACK_COOLDOWN_SECONDS, clock=time.monotonic):
+        self.routes = routes
+        self.prices = dict(DEFAULT_MODEL_PRICES if prices is None else prices)
+        self.window = window
+        self.min_calls = min_calls
+        self.latency_threshold = latency_threshold
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self._health: Dict[str, _ModelHealth] = {}
+        self._fallbacks: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def route(self, stage: Optional[str]) -> Route:
+        return self.routes.get(stage) or self.routes['default']
+
+    def _model(self, name: str) -> _ModelHealth:
+        health = self._health.get(name)
+        if health is None:
+            health = self._health[name] = _ModelHealth(self.window)
+        return health
+
+    def candidates(self, stage: Optional[str]) -> List[str]:
+        """Models to try in order: healthy ones first, then those cooling down (soonest back first)"""
+        now = self.clock()
+        with self._lock:
+            models = self.route(stage).models
+            healthy = [name for name in models if self._model(name).tripped_until <= now]
+            cooling = sorted((name for name in models if name not in healthy),
+                             key=lambda name: self._health[name].tripped_until)
+            return healthy + cooling
+
+    def record(self, model: str, stage: Optional[str], seconds: float, ok: bool,
+               prompt_tokens: int = 0, completion_tokens: int = 0):
+        with self._lock:
+            health = self._model(model)
+            health.calls += 1
+            health.errors += 0 if ok else 1
+            health.seconds += seconds
+            health.prompt_tokens += prompt_tokens
+            health.completion_tokens += completion_tokens
+            price = self.prices.get(model)
+            if price:
+                health.cost_usd += (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+            stage_name = stage or 'default'
+            health.by_stage[stage_name] = health.by_stage.get(stage_name, 0) + 1
+            if ok and model != self.route(stage).models[0]:
+                self._fallbacks[stage_name] = self._fallbacks.get(stage_name, 0) + 1
+
+            health.window.append((seconds, ok))
+            if len(health.window) < self.min_calls:
+                return
+            latencies = [elapsed for elapsed, succeeded in health.window if succeeded]
+            error_rate = 1 - len(latencies) / len(health.window)
+            mean_latency = sum(latencies) / len(latencies) if latencies else 0.0
+            if error_rate >= self.error_threshold or mean_latency >= self.latency_threshold:
+                health.tripped_until = self.clock() + self.cooldown
+                health.trips += 1
+                health.window.clear()
+                print(f"⚠️  LLM model {model} unhealthy (error rate {error_rate:.0%}, "
+                      f"mean latency {mean_latency:.1f}s); falling back for {self.cooldown:.0f}s")
+
+    def stats(self) -> Dict[str, Any]:
+        now = self.clock()
+        with self._lock:
+            models = {}
+            for name, health in self._health.items():
+                latencies = sorted(elapsed for elapsed, ok in health.window if ok)
+                models[name] = {
+                    'calls': health.calls,
+                    'errors': health.errors,
+                    'mean_seconds': round(health.seconds / health.calls, 3) if health.calls else None,
+                    'recent_p50_seconds': round(latencies[len(latencies) // 2], 3) if latencies else None,
+                    'recent_p95_seconds': round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], 3)
+                    if latencies else None,
+                    'prompt_tokens': health.prompt_tokens,
+                    'completion_tokens': health.completion_tokens,
+                    'cost_usd': round(health.cost_usd, 6) if name in self.prices else None,
+                    'calls_by_stage': dict(health.by_stage),
+                    'trips': health.trips,
+                    'cooling_down_seconds': round(max(health.tripped_until - now, 0.0), 1)
+                }
+            return {
+                'routes': {stage: asdict(route) for stage, route in self.routes.items()},
+                'models': models,
+                'fallbacks_by_stage': dict(self._fallbacks)
+            }
+
+def create_model_router(default_model: str) -> ModelRouter:
+    """Router over default_routes, with LLM_ROUTES and LLM_MODEL_PRICES overrides"""
+    routes = default_routes(default_model)
+    for stage, override in _load_json_setting(os.getenv('LLM_ROUTES')).items():
+        base = routes.get(stage) or routes['default']
+        routes[stage] = Route(
+            models=tuple(override.get('models', base.models)),
+            max_tokens=int(override.get('max_tokens', base.max_tokens)),
+            temperature=float(override.get('temperature', base.temperature))
+        )
+    prices = dict(DEFAULT_MODEL_PRICES)
+    for name, price in _load_json_setting(os.getenv('LLM_MODEL_PRICES')).items():
+        prices[name] = tuple(price)
+    return ModelRouter(routes, prices)
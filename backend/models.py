@@ -3,6 +3,7 @@ from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import json
+from json_provider import dumps_with_raw, raw_json
 
 db = SQLAlchemy()
 
@@ -46,6 +47,9 @@ class User(db.Model):
 
 class Document(db.Model):
     __tablename__ = 'documents'
+    __table_args__ = (
+        db.Index('ix_documents_department_updated', 'department', 'updated_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200))
@@ -61,6 +65,7 @@ class Document(db.Model):
     uploaded_by = db.Column(db.Integer, db.ForeignKey('users.id'))
     views = db.Column(db.Integer, default=0)
     downloads = db.Column(db.Integer, default=0)
+    content_sha256 = db.Column(db.String(64), index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -80,6 +85,7 @@ class Document(db.Model):
             'uploaded_by': self.uploaded_by,
             'views': self.views,
             'downloads': self.downloads,
+            'content_sha256': self.content_sha256,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -89,6 +95,9 @@ class Document(db.Model):
 
 class ProcessedDocument(db.Model):
     __tablename__ = 'processed_documents'
+    __table_args__ = (
+        db.Index('ix_processed_documents_department_updated', 'department', 'updated_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     original_filename = db.Column(db.String(200), nullable=False)
@@ -104,7 +113,11 @@ class ProcessedDocument(db.Model):
     doc_metadata = db.Column(db.Text)  # JSON string
     processed_by = db.Column(db.Integer, db.ForeignKey('users.id'))
     processed_date = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     status = db.Column(db.String(20), default='processed')
+    simhash = db.Column(db.String(16))  # 64-bit hex SimHash of extracted text
+    minhash = db.Column(db.Text)  # hex-packed MinHash signature
+    duplicate_of = db.Column(db.Integer, db.ForeignKey('processed_documents.id'), nullable=True)
     
     def to_dict(self):
         return {
@@ -122,8 +135,258 @@ class ProcessedDocument(db.Model):
             'metadata': json.loads(self.doc_metadata) if self.doc_metadata else {},
             'processed_by': self.processed_by,
             'processed_date': self.processed_date.isoformat() if self.processed_date else None,
-            'status': self.status
+            'status': self.status,
+            'duplicate_of': self.duplicate_of
+        }
+    
+    def to_json(self, **extra):
+        """Same shape as to_dict() plus extra fields, with stored JSON columns passed through as is"""
+        return dumps_with_raw(dict({
+            'id': self.id,
+            'original_filename': self.original_filename,
+            'processed_filename': self.processed_filename,
+            'file_path': self.file_path,
+            'document_type': self.document_type,
+            'department': self.department,
+            'summary': self.summary,
+            'deadline': self.deadline,
+            'priority': self.priority,
+            'processed_by': self.processed_by,
+            'processed_date': self.processed_date.isoformat() if self.processed_date else None,
+            'status': self.status,
+            'duplicate_of': self.duplicate_of
+        }, **extra), {
+            'key_points': raw_json(self.key_points, '[]'),
+            'action_items': raw_json(self.action_items, '[]'),
+            'metadata': raw_json(self.doc_metadata, '{}')
+        })
+    
+    def __repr__(self):
+        return f'<ProcessedDocument {self.original_filename}>'
+
+class UploadSession(db.Model):
+    __tablename__ = 'upload_sessions'
+    
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    filename = db.Column(db.String(200), nullable=False)
+    title = db.Column(db.String(200))
+    description = db.Column(db.Text)
+    department = db.Column(db.String(50))
+    category = db.Column(db.String(100))
+    tags = db.Column(db.Text)
+    content_type = db.Column(db.String(100))
+    s3_key = db.Column(db.String(500), nullable=False)
+    upload_id = db.Column(db.String(200), nullable=False)
+    expected_size = db.Column(db.BigInteger)
+    part_size = db.Column(db.Integer)
+    status = db.Column(db.String(20), default='open')  # open, completed, aborted
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'title': self.title,
+            'department': self.department,
+            'category': self.category,
+            's3_key': self.s3_key,
+            'expected_size': self.expected_size,
+            'part_size': self.part_size,
+            'status': self.status,
+            'document_id': self.document_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+    
+    def __repr__(self):
+        return f'<UploadSession {self.id} {self.filename}>'
+
+class IngestionCursor(db.Model):
+    """Where the last backlog ingestion run stopped in the uploads/ listing"""
+    __tablename__ = 'ingestion_cursors'
+    
+    name = db.Column(db.String(100), primary_key=True)  # 'all' or a department
+    start_after = db.Column(db.String(1024))  # None = start a new pass
+    passes_completed = db.Column(db.Integer, default=0)
+    last_backlog_depth = db.Column(db.Integer)
+    last_run_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'start_after': self.start_after,
+            'passes_completed': self.passes_completed,
+            'last_backlog_depth': self.last_backlog_depth,
+            'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+    
+    def __repr__(self):
+        return f'<IngestionCursor {self.name} {self.start_after}>'
+
+class ProcessingLedgerEntry(db.Model):
+    """Pipeline state of one S3 object version, keyed by (key, ETag)"""
+    __tablename__ = 'processing_ledger'
+    __table_args__ = (
+        db.UniqueConstraint('s3_key', 'etag', name='uq_processing_ledger_key_etag'),
+        db.Index('ix_processing_ledger_etag_stage', 'etag', 'stage'),
+        db.Index('ix_processing_ledger_stage', 'stage'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    s3_key = db.Column(db.String(1024), nullable=False)
+    etag = db.Column(db.String(100), nullable=False)
+    stage = db.Column(db.String(20), default='pending')  # pending, analyzed, archived, saved, failed
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text)
+    result = db.Column(db.Text)  # JSON of the pipeline result once analyzed
+    processed_document_id = db.Column(db.Integer, db.ForeignKey('processed_documents.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            's3_key': self.s3_key,
+            'etag': self.etag,
+            'stage': self.stage,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'processed_document_id': self.processed_document_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+    
+    def __repr__(self):
+        return f'<ProcessingLedgerEntry {self.s3_key} {self.etag} {self.stage}>'
+
+class DocumentActionItem(db.Model):
+    __tablename__ = 'document_action_items'
+    __table_args__ = (
+        db.Index('ix_action_items_department_status_due', 'department', 'status', 'due_date'),
+        db.Index('ix_action_items_status_due', 'status', 'due_date'),
+        db.Index('ix_action_items_document_position', 'document_id', 'position'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('processed_documents.id'), nullable=False)
+    department = db.Column(db.String(50))
+    text = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default='open')  # open, in_progress, done, cancelled
+    due_date = db.Column(db.Date, nullable=True)
+    position = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'document_id': self.document_id,
+            'department': self.department,
+            'text': self.text,
+            'status': self.status,
+            'due_date': self.due_date.isoformat() if self.due_date else None,
+            'position': self.position,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+    
+    def __repr__(self):
+        return f'<DocumentActionItem {self.id} {self.status}>'
+
+class DocumentKeyPoint(db.Model):
+    __tablename__ = 'document_key_points'
+    __table_args__ = (
+        db.Index('ix_key_points_department', 'department'),
+        db.Index('ix_key_points_document_position', 'document_id', 'position'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('processed_documents.id'), nullable=False)
+    department = db.Column(db.String(50))
+    text = db.Column(db.Text, nullable=False)
+    position = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'document_id': self.document_id,
+            'department': self.department,
+            'text': self.text,
+            'position': self.position,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+    
+    def __repr__(self):
+        return f'<DocumentKeyPoint {self.id}>'
+
+class DocumentCalendarEvent(db.Model):
+    """Dated event (document deadline or dated action item) of a processed document"""
+    __tablename__ = 'document_calendar_events'
+    __table_args__ = (
+        db.Index('ix_calendar_events_department_date', 'department', 'event_date'),
+        db.Index('ix_calendar_events_date', 'event_date'),
+        db.Index('ix_calendar_events_document', 'document_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('processed_documents.id'), nullable=False)
+    department = db.Column(db.String(50), nullable=False)
+    title = db.Column(db.String(300), nullable=False)
+    description = db.Column(db.Text)
+    event_date = db.Column(db.Date, nullable=False)
+    priority = db.Column(db.String(20))
+    action_required = db.Column(db.Boolean, default=True)
+    source = db.Column(db.String(20))  # deadline, action_item
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'document_id': self.document_id,
+            'department': self.department,
+            'title': self.title,
+            'description': self.description,
+            'date': self.event_date.isoformat() if self.event_date else None,
+            'priority': self.priority,
+            'action_required': self.action_required,
+            'source': self.source,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+    
+    def __repr__(self):
+        return f'<DocumentCalendarEvent {self.id} {self.event_date}>'
+
+class CalendarFeedToken(db.Model):
+    """Long-lived, revocable token that only grants read access to one department's iCal feed"""
+    __tablename__ = 'calendar_feed_tokens'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    department = db.Column(db.String(50), nullable=False)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)  # sha256 of the token
+    label = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime)
+    revoked_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'department': self.department,
+            'label': self.label,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'last_used_at': self.last_used_at.isoformat() if self.last_used_at else None,
+            'revoked_at': self.revoked_at.isoformat() if self.revoked_at else None
         }
     
     def __repr__(self):
-        return f'<ProcessedDocument {self.original_filename}>'
\ No newline at end of file
+        return f'<CalendarFeedToken {self.id} {self.department}>'
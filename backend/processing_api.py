@@ -1,100 +1,214 @@
 # processing_api.py
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app
 import os
 import uuid
 import json
-from datetime import datetime
+import hmac
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from datetime import datetime, date, timedelta
 from werkzeug.utils import secure_filename
-from models import db, User, Document, ProcessedDocument
+from botocore.exceptions import ClientError
+from models import db, User, Document, ProcessedDocument, DocumentActionItem, DocumentKeyPoint, IngestionCursor, ProcessingLedgerEntry, CalendarFeedToken
 from model import (
     batch_process_s3_documents, 
     auto_fetch_and_process,
     process_s3_document,
     list_s3_documents,
     download_from_s3,
-    DocumentProcessingResult
+    iter_upload_listing,
+    get_object_etag,
+    result_summary,
+    text_store,
+    model_router,
+    DocumentProcessingResult,
+    INGEST_BATCH_SIZE,
+    INGEST_TIME_BUDGET_SECONDS,
+    INGEST_USE_ASYNC,
+    AWS_S3_BUCKET
 )
-import jwt
+from knowledge_base import answer_question
+from document_items import save_document_items, ACTION_ITEM_STATUSES
+from fingerprint import NearDuplicateIndex, TextFingerprint
+from auth_api import presigned_get_url, STREAM_BATCH_SIZE
+from url_cache import presigned_url_cache
+from json_provider import stream_json_array
+from versioning import (
+    conditional_get,
+    processed_documents_version,
+    documents_version,
+    time_bucket,
+    S3_LISTING_VERSION_SECONDS
+)
+from auth_middleware import auth_required as auth_required_api, authenticate_request, authenticate_stream_request, load_user_state
+from progress_events import progress_broker
+from processing_ledger import processing_ledger, DocumentInProgress
+from result_writer import bulk_save_results, document_row
+from reprocessing import reprocess_documents, REPROCESS_WORKERS
+from calendar_index import (
+    save_calendar_events,
+    events_in_range,
+    calendar_version,
+    ical_feed_cache,
+    issue_feed_token,
+    revoke_feed_token,
+    feed_token_entry,
+    CALENDAR_MAX_RANGE_DAYS,
+    CALENDAR_MAX_EVENTS
+)
+from s3_events import S3EventConsumer, confirm_sns_subscription
+from ingestion_scheduler import IngestionScheduler, PRIORITY_CLASSES, priority_class
+from tracing import span, trace_store
+from profiling import profiler
 
 processing_bp = Blueprint('processing', __name__)
 
 ALLOWED_EXTENSIONS = {'pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt', 'jpg', 'jpeg', 'png'}
 
+# Largest character range served by /document/<id>/text
+TEXT_RANGE_MAX_CHARS = 200_000
+
+# Background jobs share a bounded pool; beyond the queue limit they are refused
+BACKGROUND_JOB_WORKERS = int(os.getenv('BACKGROUND_JOB_WORKERS', 4))
+BACKGROUND_JOB_QUEUE_LIMIT = int(os.getenv('BACKGROUND_JOB_QUEUE_LIMIT', 100))
+background_executor = ThreadPoolExecutor(BACKGROUND_JOB_WORKERS, thread_name_prefix='background-job')
+_background_jobs = threading.BoundedSemaphore(BACKGROUND_JOB_QUEUE_LIMIT)
+
+def submit_background_job(target) -> bool:
+    """Run target on the background pool; False when too many jobs are queued or running"""
+    if not _background_jobs.acquire(blocking=False):
+        return False
+    
+    def run():
+        try:
+            target()
+        finally:
+            _background_jobs.release()
+    
+    try:
+        background_executor.submit(run)
+    except Exception:
+        _background_jobs.release()
+        raise
+    return True
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# JWT Configuration
-JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'infradoc-ai-secret-jwt-key-2024')
+# Near-duplicate index over fingerprints of processed documents
+near_duplicate_index = NearDuplicateIndex()
 
-def verify_token(token):
-    """Verify JWT token"""
-    try:
-        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=['HS256'])
-        return payload
-    except jwt.ExpiredSignatureError:
-        return None
-    except jwt.InvalidTokenError:
-        return None
+def load_near_duplicate_index():
+    """Populate the LSH index from stored fingerprints on first use"""
+    if near_duplicate_index.loaded:
+        return
+    rows = db.session.query(
+        ProcessedDocument.id, ProcessedDocument.simhash, ProcessedDocument.minhash
+    ).filter(
+        ProcessedDocument.status == 'processed',
+        ProcessedDocument.minhash.isnot(None),
+        ProcessedDocument.duplicate_of.is_(None)
+    ).all()
+    for doc_id, simhash, minhash in rows:
+        near_duplicate_index.add(doc_id, TextFingerprint(simhash=simhash, minhash=minhash))
+    near_duplicate_index.loaded = True
+    print(f"🔎 Loaded {len(rows)} fingerprints into near-duplicate index")
 
-def authenticate_user_from_request():
-    """Extract and authenticate user from request using JWT or credentials"""
-    # Method 1: Try JWT token
-    auth_header = request.headers.get('Authorization')
-    if auth_header and auth_header.startswith('Bearer '):
-        token = auth_header.split(' ')[1]
-        payload = verify_token(token)
-        if payload:
-            user = User.query.get(payload['user_id'])
-            if user and user.is_active:
-                return user
-    
-    # Method 2: Try credentials from various sources
-    username = None
-    password = None
+def find_near_duplicate(fingerprint):
+    """Return the stored analysis of a near-duplicate processed document, if any"""
+    load_near_duplicate_index()
+    match = near_duplicate_index.query(fingerprint)
+    if not match:
+        return None
     
-    # Try JSON body
-    data = request.get_json(silent=True)
-    if data:
-        username = data.get('username')
-        password = data.get('password')
+    doc = ProcessedDocument.query.get(match['document_id'])
+    if not doc or doc.status != 'processed':
+        return None
     
-    # Try form data
-    if not username or not password:
-        username = request.form.get('username')
-        password = request.form.get('password')
+    return {
+        'id': doc.id,
+        'similarity': match['similarity'],
+        'document_type': doc.document_type,
+        'department': doc.department,
+        'summary': doc.summary,
+        'key_points': json.loads(doc.key_points) if doc.key_points else [],
+        'action_items': json.loads(doc.action_items) if doc.action_items else [],
+        'deadline': doc.deadline,
+        'priority': doc.priority,
+        'metadata': json.loads(doc.doc_metadata) if doc.doc_metadata else {}
+    }
+
+def save_auto_processed_documents(results, user_id):
+    """Upsert the full results of a backlog run in batches (see result_writer).
+
+    Existence is decided by the ledger entry of the object version
+    (key + ETag), not by filename.
+    """
+    with span('db.bulk_save_results', **{'documents.count': len(results)}):
+        written = bulk_save_results(results, user_id)
     
-    # Try query parameters
-    if not username or not password:
-        username = request.args.get('username')
-        password = request.args.get('password')
+    for document_id, result in written['documents']:
+        if result.minhash and not result.duplicate_of:
+            near_duplicate_index.add(document_id, TextFingerprint(simhash=result.simhash, minhash=result.minhash))
+    return written
+
+def get_ingestion_cursor(department=None) -> IngestionCursor:
+    name = department or 'all'
+    cursor = IngestionCursor.query.get(name)
+    if not cursor:
+        cursor = IngestionCursor(name=name, passes_completed=0)
+        db.session.add(cursor)
+    return cursor
+
+def run_backlog_ingestion(department, data, job_id, user_id):
+    """Drain the uploads/ backlog from the persisted cursor.
+
+    Results and the cursor are committed after every batch, so an
+    interrupted run resumes where it stopped.
+    """
+    cursor = get_ingestion_cursor(department)
+    batch_size = min(max(int(data.get('batch_size') or INGEST_BATCH_SIZE), 1), 100)
+    time_budget = float(data.get('time_budget_seconds') or INGEST_TIME_BUDGET_SECONDS)
+    use_async = bool(data.get('use_async', INGEST_USE_ASYNC))
+    report = progress_broker.reporter(job_id)
     
-    if not username or not password:
-        return None
+    # Results analyzed by a run that crashed before saving them
+    recovered = [result for result in processing_ledger.unsaved_results()
+                 if processing_ledger.start(result.metadata['s3_key'], result.metadata['etag'])]
+    if recovered:
+        save_auto_processed_documents(recovered, user_id)
+        db.session.commit()
+        print(f"♻️  Recovered {len(recovered)} analyzed documents from the ledger")
     
-    user = User.query.filter_by(username=username).first()
-    if not user or not user.check_password(password):
-        return None
+    def on_batch(results, start_after):
+        documents = [result_summary(result) for result in results]
+        save_auto_processed_documents(results, user_id)
+        if start_after is None and cursor.start_after is not None:
+            cursor.passes_completed = (cursor.passes_completed or 0) + 1
+        cursor.start_after = start_after
+        cursor.last_run_at = datetime.utcnow()
+        db.session.commit()
+        for doc_data in documents:
+            report('saved', doc_data.get('s3_key'),
+                   department=doc_data['department'],
+                   document_type=doc_data['document_type'])
     
-    if not user.is_active:
-        return None
+    result = auto_fetch_and_process(
+        department, find_near_duplicate, report,
+        start_after=cursor.start_after,
+        on_batch=on_batch,
+        batch_size=batch_size,
+        time_budget=time_budget,
+        ledger=processing_ledger,
+        use_async=use_async
+    )
     
-    return user
-
-def auth_required_api(required_role=None):
-    def decorator(f):
-        def wrapper(*args, **kwargs):
-            user = authenticate_user_from_request()
-            if not user:
-                return jsonify({'error': 'Authentication required'}), 401
-            
-            if required_role and user.role != required_role:
-                return jsonify({'error': 'Admin access required'}), 403
-            
-            request.user = user
-            return f(*args, **kwargs)
-        wrapper.__name__ = f.__name__
-        return wrapper
-    return decorator
+    if 'error' not in result:
+        result['recovered'] = len(recovered)
+        cursor.last_backlog_depth = result['backlog_depth']
+        db.session.commit()
+    return result
 
 @processing_bp.route('/auto-process', methods=['POST'])
 @auth_required_api(required_role='admin')
@@ -104,48 +218,270 @@ def auto_process_documents():
         
         data = request.get_json() or {}
         department = data.get('department')
+        job_id = data.get('job_id') or uuid.uuid4().hex
         
-        result = auto_fetch_and_process(department)
+        result = run_backlog_ingestion(department, data, job_id, user.id)
         
         if 'error' in result:
             return jsonify({'error': result['error']}), 500
         
-        if 'documents' in result:
-            for doc_data in result['documents']:
-                existing = ProcessedDocument.query.filter_by(
-                    original_filename=doc_data['original_filename']
-                ).first()
-                
-                if not existing:
-                    processed_doc = ProcessedDocument(
-                        original_filename=doc_data['original_filename'],
-                        processed_filename=f"processed_{doc_data['original_filename']}",
-                        file_path=doc_data.get('s3_url', ''),
-                        document_type=doc_data['document_type'],
-                        department=doc_data['department'],
-                        summary='',
-                        key_points=json.dumps([]),
-                        action_items=json.dumps([]),
-                        priority=doc_data['priority'],
-                        processed_by=user.id,
-                        status='pending_processing'
-                    )
-                    
-                    db.session.add(processed_doc)
-        
-        db.session.commit()
-        
         return jsonify({
             'message': result.get('message', 'Processing completed'),
+            'job_id': job_id,
             'total_processed': result.get('total_processed', 0),
             'by_department': result.get('by_department', {}),
-            'documents': result.get('documents', [])
+            'documents': result.get('documents', []),
+            'failed': result.get('failed', []),
+            'batches': result.get('batches', 0),
+            'drained': result.get('drained', False),
+            'backlog_depth': result.get('backlog_depth', 0),
+            'backlog_depth_complete': result.get('backlog_depth_complete', True),
+            'queue_wait': result.get('queue_wait', {}),
+            'starvation_promotions': result.get('starvation_promotions', 0),
+            'cursor': result.get('cursor'),
+            'elapsed_seconds': result.get('elapsed_seconds')
         })
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@processing_bp.route('/ingestion/status', methods=['GET'])
+@auth_required_api(required_role='admin')
+def ingestion_status():
+    """Persisted cursor and the current backlog depth under uploads/"""
+    try:
+        department = request.args.get('department')
+        cursor = get_ingestion_cursor(department)
+        
+        total = ahead = 0
+        by_class = {name: 0 for name in PRIORITY_CLASSES}
+        for obj in iter_upload_listing(department):
+            total += 1
+            if not cursor.start_after or obj['Key'] > cursor.start_after:
+                ahead += 1
+            by_class[priority_class(obj['Key'], obj.get('Size', 0))] += 1
+        
+        return jsonify({
+            'cursor': cursor.to_dict(),
+            'backlog_depth': total,
+            'remaining_in_pass': ahead,
+            'by_priority_class': by_class
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@processing_bp.route('/reprocess', methods=['POST'])
+@auth_required_api(required_role='admin')
+def reprocess():
+    """Rerun stale pipeline stages on stored text (see reprocessing.py)"""
+    try:
+        data = request.get_json() or {}
+        job_id = data.get('job_id') or uuid.uuid4().hex
+        options = {
+            'department': data.get('department'),
+            'document_ids': data.get('document_ids'),
+            'stages': data.get('stages'),
+            'after_id': int(data.get('after_id') or 0),
+            'limit': data.get('limit'),
+            'workers': min(max(int(data.get('workers') or REPROCESS_WORKERS), 1), 32),
+            'dry_run': bool(data.get('dry_run')),
+            'progress': progress_broker.reporter(job_id)
+        }
+        
+        if data.get('background') and not options['dry_run']:
+            app = current_app._get_current_object()
+            
+            def target():
+                with app.app_context(), span('reprocess_job', job_id=job_id):
+                    try:
+                        reprocess_documents(**options)
+                    except Exception as e:
+                        print(f"❌ Reprocessing job {job_id} failed: {e}")
+            
+            if not submit_background_job(target):
+                return jsonify({'error': 'Too many background jobs queued, try again later'}), 503
+            return jsonify({'job_id': job_id, 'status': 'queued'}), 202
+        
+        result = reprocess_documents(**options)
+        return jsonify(dict(result, job_id=job_id))
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@processing_bp.route('/ingestion/ledger', methods=['GET'])
+@auth_required_api(required_role='admin')
+def list_ledger_entries():
+    """Ledger entries, optionally filtered by stage (e.g. ?stage=failed)"""
+    try:
+        query = ProcessingLedgerEntry.query
+        stage = request.args.get('stage')
+        if stage:
+            query = query.filter(ProcessingLedgerEntry.stage == stage)
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+        entries = query.order_by(ProcessingLedgerEntry.updated_at.desc()).limit(limit).all()
+        
+        return jsonify({'entries': [entry.to_dict() for entry in entries]})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def save_processing_result(result: DocumentProcessingResult, user_id: int) -> ProcessedDocument:
+    """Persist a pipeline result with its normalized items and index its fingerprint"""
+    processed_doc = ProcessedDocument(**document_row(result, user_id))
+    
+    with span('db.save_processing_result', **{'document.department': result.department.value}):
+        db.session.add(processed_doc)
+        db.session.flush()
+        save_document_items(processed_doc, result.key_points, result.action_items)
+        save_calendar_events([(processed_doc, result.action_items)])
+        if result.metadata.get('etag'):
+            processing_ledger.mark_saved(result.metadata['s3_key'], result.metadata['etag'], processed_doc.id)
+        db.session.commit()
+    
+    if result.minhash and not result.duplicate_of:
+        near_duplicate_index.add(processed_doc.id, TextFingerprint(simhash=result.simhash, minhash=result.minhash))
+    
+    return processed_doc
+
+def run_processing_job(job_id: str, s3_key: str, user_id: Optional[int],
+                       etag: Optional[str] = None) -> ProcessedDocument:
+    """Process one S3 document and save it, publishing progress under job_id"""
+    report = progress_broker.reporter(job_id)
+    report('queued', s3_key)
+    try:
+        etag = etag or get_object_etag(s3_key)
+        document_id = processing_ledger.saved_document_id(s3_key, etag)
+        if document_id:
+            # This exact object version is already in the database
+            processed_doc = ProcessedDocument.query.get(document_id)
+            report('saved', s3_key, document_id=document_id, department=processed_doc.department,
+                   document_type=processed_doc.document_type, already_processed=True)
+            return processed_doc
+        
+        if not processing_ledger.start(s3_key, etag):
+            raise DocumentInProgress(f"{s3_key} is already being processed")
+        result = processing_ledger.stored_result(s3_key, etag)
+        if result is None:
+            result = processing_ledger.reusable_result(s3_key, etag)
+            if result is not None:
+                processing_ledger.record_result(s3_key, etag, result)
+        if result is None:
+            # Process the document, reusing the analysis of near-duplicates
+            result = process_s3_document(s3_key, find_near_duplicate, report, etag)
+            result.metadata['etag'] = etag
+            processing_ledger.record_result(s3_key, etag, result)
+        processed_doc = save_processing_result(result, user_id)
+    except Exception as e:
+        db.session.rollback()
+        if etag and not isinstance(e, DocumentInProgress):
+            processing_ledger.record_failure(s3_key, etag, str(e))
+        report('failed', s3_key, error=str(e))
+        raise
+    
+    report('saved', s3_key, document_id=processed_doc.id, department=processed_doc.department,
+           document_type=processed_doc.document_type, duplicate_of=processed_doc.duplicate_of)
+    return processed_doc
+
+def run_processing_job_in_background(job_id: str, s3_key: str, user_id: int) -> bool:
+    """Queue a processing job on the background pool; False when the queue is full"""
+    app = current_app._get_current_object()
+    
+    def target():
+        with app.app_context(), span('processing_job', job_id=job_id, s3_key=s3_key):
+            try:
+                run_processing_job(job_id, s3_key, user_id)
+            except Exception as e:
+                print(f"❌ Background processing of {s3_key} failed: {e}")
+    
+    return submit_background_job(target)
+
+def handle_s3_events(batch):
+    """Process a coalesced batch of new uploads announced by S3 notifications"""
+    job_id = f"s3-events-{uuid.uuid4().hex[:12]}"
+    scheduler = IngestionScheduler()
+    for event in batch:
+        scheduler.push(event.s3_key, event.etag, event.size)
+    failed = []
+    while len(scheduler):
+        event = scheduler.pop()
+        try:
+            with span('processing_job', job_id=job_id, s3_key=event.s3_key, trigger='s3_event',
+                      priority_class=event.priority_class):
+                run_processing_job(job_id, event.s3_key, None, event.etag)
+        except DocumentInProgress:
+            # Another job holds the claim and will finish it
+            continue
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                # Removed since it was announced, e.g. an upload deduplicated into an existing object
+                print(f"⏭️  {event.s3_key} no longer exists, skipping its event")
+                continue
+            print(f"❌ Event-driven processing of {event.s3_key} failed: {e}")
+            failed.append(event.s3_key)
+        except Exception as e:
+            print(f"❌ Event-driven processing of {event.s3_key} failed: {e}")
+            failed.append(event.s3_key)
+    if failed:
+        # Raising keeps SQS messages of the batch for redelivery; saved keys are skipped then
+        raise RuntimeError(f"{len(failed)} of {len(batch)} S3 events failed: {', '.join(failed)}")
+
+s3_event_consumer = None
+_s3_event_consumer_lock = threading.Lock()
+
+def get_s3_event_consumer() -> S3EventConsumer:
+    global s3_event_consumer
+    with _s3_event_consumer_lock:
+        if s3_event_consumer is None:
+            app = current_app._get_current_object()
+            
+            def handler(batch):
+                with app.app_context():
+                    handle_s3_events(batch)
+            
+            s3_event_consumer = S3EventConsumer(handler, bucket=AWS_S3_BUCKET)
+        return s3_event_consumer
+
+def s3_events_authorized() -> bool:
+    """Shared-secret X-S3-Events-Token header (for SNS/SQS forwarders) or an admin session"""
+    expected = os.getenv('S3_EVENTS_TOKEN')
+    provided = request.headers.get('X-S3-Events-Token')
+    if expected and provided and hmac.compare_digest(expected, provided):
+        return True
+    user = authenticate_request()
+    return bool(user and user.role == 'admin')
+
+@processing_bp.route('/s3-events', methods=['POST'])
+def receive_s3_events():
+    """Accept S3 ObjectCreated notifications (raw, SNS or SQS JSON) for uploads/"""
+    if not s3_events_authorized():
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    payload = request.get_json(force=True, silent=True)
+    if payload is None:
+        return jsonify({'error': 'JSON payload required'}), 400
+    
+    if isinstance(payload, dict) and payload.get('Type') == 'SubscriptionConfirmation':
+        # Only topics listed in S3_EVENTS_SNS_TOPIC_ARNS are confirmed automatically
+        try:
+            confirmed = confirm_sns_subscription(payload)
+        except Exception as e:
+            return jsonify({'error': f'Subscription confirmation failed: {e}'}), 502
+        if not confirmed:
+            print(f"📨 SNS subscription for {payload.get('TopicArn')} not confirmed; "
+                  f"add it to S3_EVENTS_SNS_TOPIC_ARNS or visit {payload.get('SubscribeURL')}")
+            return jsonify({'error': 'Topic not allowed'}), 403
+        print(f"✅ Confirmed SNS subscription for {payload.get('TopicArn')}")
+        return jsonify({'message': 'Subscription confirmed'}), 200
+    
+    counts = get_s3_event_consumer().submit(payload)
+    return jsonify(dict(counts, pending=len(s3_event_consumer.queue))), 202
+
 @processing_bp.route('/process-s3-document', methods=['POST'])
 @auth_required_api(required_role='admin')
 def process_s3_document_api():
@@ -160,46 +496,75 @@ def process_s3_document_api():
         if not s3_key:
             return jsonify({'error': 'S3 key required'}), 400
         
-        # Process the document
-        result = process_s3_document(s3_key)
-        
-        # Save to database
-        processed_doc = ProcessedDocument(
-            original_filename=result.original_filename,
-            processed_filename=result.processed_filename,
-            file_path=result.s3_url,
-            document_type=result.document_type.value,
-            department=result.department.value,
-            summary=result.summary,
-            key_points=json.dumps(result.key_points),
-            action_items=json.dumps(result.action_items),
-            deadline=result.deadline,
-            priority=result.priority,
-            doc_metadata=json.dumps(result.metadata),
-            processed_by=user.id,
-            status='processed'
-        )
+        job_id = data.get('job_id') or uuid.uuid4().hex
         
-        db.session.add(processed_doc)
-        db.session.commit()
+        # Background jobs answer immediately; follow them on /events?job_id=...
+        if data.get('background'):
+            if not run_processing_job_in_background(job_id, s3_key, user.id):
+                return jsonify({'error': 'Too many background jobs queued, try again later'}), 503
+            return jsonify({
+                'message': 'Document queued for processing',
+                'job_id': job_id,
+                's3_key': s3_key
+            }), 202
+        
+        processed_doc = run_processing_job(job_id, s3_key, user.id)
+        summary = processed_doc.summary or ''
         
         return jsonify({
             'message': 'Document processed successfully',
+            'job_id': job_id,
             'document': {
                 'id': processed_doc.id,
-                'original_filename': result.original_filename,
-                'department': result.department.value,
-                'document_type': result.document_type.value,
-                'priority': result.priority,
-                'summary': result.summary[:200] + '...' if len(result.summary) > 200 else result.summary,
-                's3_url': result.s3_url
+                'original_filename': processed_doc.original_filename,
+                'department': processed_doc.department,
+                'document_type': processed_doc.document_type,
+                'priority': processed_doc.priority,
+                'summary': summary[:200] + '...' if len(summary) > 200 else summary,
+                's3_url': processed_doc.file_path,
+                'duplicate_of': processed_doc.duplicate_of
             }
         })
         
+    except DocumentInProgress as e:
+        return jsonify({'error': str(e), 'job_id': job_id}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@processing_bp.route('/events', methods=['GET'])
+@auth_required_api(authenticate=authenticate_stream_request)
+def processing_events():
+    """Server-Sent Events stream of processing progress.
+
+    Filter with ?department= or ?job_id=. Non-admin users only see their
+    own department. Reconnecting clients send Last-Event-ID to replay
+    events they missed.
+    """
+    user = request.user
+    department = request.args.get('department')
+    job_id = request.args.get('job_id')
+    
+    if user.role != 'admin':
+        department = user.department
+    elif department == 'admin':
+        department = None
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    
+    subscription = progress_broker.subscribe(department, job_id, last_event_id)
+    response = Response(
+        stream_with_context(progress_broker.stream(subscription)),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @processing_bp.route('/list-s3-documents', methods=['GET'])
 @auth_required_api(required_role='admin')
 def list_s3_documents_api():
@@ -222,6 +587,11 @@ def list_s3_documents_api():
 
 @processing_bp.route('/department-documents/<department>', methods=['GET'])
 @auth_required_api()
+@conditional_get(lambda department: (
+    processed_documents_version(department),
+    documents_version(department),
+    time_bucket(S3_LISTING_VERSION_SECONDS)
+))
 def get_department_documents(department):
     try:
         user = request.user
@@ -230,70 +600,43 @@ def get_department_documents(department):
         if user.role != 'admin' and user.department != department:
             return jsonify({'error': 'Access denied'}), 403
         
+        # Uploader names in one query instead of one per document
+        usernames = dict(db.session.query(User.id, User.username).all())
+        
         # Get processed documents from database for this department
         db_documents = ProcessedDocument.query.filter_by(
             department=department,
             status='processed'
-        ).order_by(ProcessedDocument.processed_date.desc()).all()
-        
-        # Convert database documents to response format
-        all_documents = []
-        
-        for doc in db_documents:
-            # Parse JSON fields if they exist
-            key_points = []
-            action_items = []
-            
-            if doc.key_points:
-                try:
-                    key_points = json.loads(doc.key_points)
-                except:
-                    key_points = []
-            
-            if doc.action_items:
-                try:
-                    action_items = json.loads(doc.action_items)
-                except:
-                    action_items = []
-            
-            # Build document object
-            doc_obj = {
-                'id': doc.id,
-                'original_filename': doc.original_filename,
-                'document_type': doc.document_type,
-                'department': doc.department,
-                'summary': doc.summary or '',
-                'key_points': key_points,
-                'action_items': action_items,
-                'deadline': doc.deadline.isoformat() if doc.deadline else None,
-                'priority': doc.priority or 'medium',
-                'processed_date': doc.processed_date.isoformat() if doc.processed_date else None,
-                'file_path': doc.file_path,
-                'file_size': doc.doc_metadata.get('file_size', 'Unknown') if doc.doc_metadata else 'Unknown',
-                'uploaded_by': User.query.get(doc.processed_by).username if doc.processed_by else 'System',
-                'status': doc.status,
-                'source': 'database',
-                's3_url': doc.file_path if doc.file_path.startswith('http') else None,
-                'metadata': json.loads(doc.doc_metadata) if doc.doc_metadata else {}
-            }
-            all_documents.append(doc_obj)
+        ).order_by(ProcessedDocument.processed_date.desc()).yield_per(STREAM_BATCH_SIZE)
         
         # Also fetch unprocessed S3 documents for this department
         s3_docs = list_s3_documents(department)
         
-        # Add S3 documents that aren't in database yet
-        s3_filenames = [d['original_filename'] for d in all_documents]
-        for s3_doc in s3_docs:
-            filename = os.path.basename(s3_doc['key'])
-            if filename not in s3_filenames:
-                # Extract department from S3 key path
-                dept_from_key = s3_doc.get('department', department)
+        def rows():
+            # Stored JSON columns are passed through without re-encoding
+            s3_filenames = set()
+            for doc in db_documents:
+                s3_filenames.add(doc.original_filename)
+                yield doc.to_json(
+                    summary=doc.summary or '',
+                    priority=doc.priority or 'medium',
+                    file_size='Unknown',
+                    uploaded_by=usernames.get(doc.processed_by, 'System') if doc.processed_by else 'System',
+                    source='database',
+                    s3_url=doc.file_path if doc.file_path and doc.file_path.startswith('http') else None
+                )
+            
+            # Add S3 documents that aren't in database yet
+            for s3_doc in s3_docs:
+                filename = os.path.basename(s3_doc['key'])
+                if filename in s3_filenames:
+                    continue
                 
-                all_documents.append({
+                yield {
                     'id': None,  # No database ID yet
                     'original_filename': filename,
                     'document_type': s3_doc.get('document_type', 'unknown'),
-                    'department': dept_from_key,
+                    'department': s3_doc.get('department', department),
                     'summary': 'Document is in S3 but not yet fully processed. Please run processing.',
                     'key_points': [],
                     'action_items': [],
@@ -305,9 +648,9 @@ def get_department_documents(department):
                     's3_key': s3_doc.get('key'),
                     'file_size': f"{s3_doc.get('size', 0) / 1024 / 1024:.2f} MB",
                     'uploaded_by': 'System (S3)'
-                })
+                }
         
-        return jsonify(all_documents)
+        return stream_json_array(rows())
         
     except Exception as e:
         print(f"Error in get_department_documents: {e}")
@@ -347,8 +690,180 @@ def get_document_details(doc_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@processing_bp.route('/document/<int:doc_id>/text', methods=['GET'])
+@auth_required_api()
+def get_document_text(doc_id):
+    """Extracted text of a processed document from the text store (?start=&end= character range)"""
+    try:
+        user = request.user
+        
+        document = ProcessedDocument.query.get_or_404(doc_id)
+        if user.role != 'admin' and user.department != document.department:
+            return jsonify({'error': 'Access denied'}), 403
+        
+        metadata = json.loads(document.doc_metadata) if document.doc_metadata else {}
+        stored = text_store.open(metadata.get('etag'))
+        if stored is None:
+            return jsonify({'error': 'Extracted text is not stored for this document'}), 404
+        
+        start = max(request.args.get('start', 0, type=int), 0)
+        end = request.args.get('end', type=int)
+        end = min(end, len(stored)) if end is not None else min(len(stored), start + TEXT_RANGE_MAX_CHARS)
+        if end - start > TEXT_RANGE_MAX_CHARS:
+            return jsonify({'error': f'At most {TEXT_RANGE_MAX_CHARS} characters per request'}), 400
+        
+        return jsonify({
+            'id': document.id,
+            'etag': metadata.get('etag'),
+            'total_chars': len(stored),
+            'start': start,
+            'end': max(end, start),
+            'text': stored.read(start, end)
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def parse_calendar_date(value: Optional[str], default: date) -> date:
+    if not value:
+        return default
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Invalid date: {value} (expected YYYY-MM-DD)')
+
+def calendar_window():
+    """(start, end) of /calendar: ?start= and ?end=, by default today and the next 7 days"""
+    start = parse_calendar_date(request.args.get('start'), date.today())
+    end = parse_calendar_date(request.args.get('end'), start + timedelta(days=7))
+    return start, end
+
+def calendar_etag_parts():
+    # The default window moves at midnight, so the resolved dates are part of the version
+    try:
+        start, end = calendar_window()
+    except ValueError:
+        return (calendar_version(), 'invalid-range')
+    return (calendar_version(), start.isoformat(), end.isoformat())
+
+@processing_bp.route('/calendar', methods=['GET'])
+@auth_required_api()
+@conditional_get(calendar_etag_parts)
+def get_calendar_events():
+    """Events between ?start= and ?end= (YYYY-MM-DD, default the next 7 days), per department"""
+    try:
+        user = request.user
+        department = request.args.get('department')
+        if user.role != 'admin':
+            if department and department != user.department:
+                return jsonify({'error': 'Access denied'}), 403
+            department = user.department
+        
+        try:
+            start, end = calendar_window()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if end < start or (end - start).days > CALENDAR_MAX_RANGE_DAYS:
+            return jsonify({'error': f'end must be within {CALENDAR_MAX_RANGE_DAYS} days after start'}), 400
+        
+        limit = min(request.args.get('limit', CALENDAR_MAX_EVENTS, type=int), CALENDAR_MAX_EVENTS)
+        events = events_in_range(department, start, end, limit)
+        
+        return jsonify({
+            'department': department,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'count': len(events),
+            'events': [event.to_dict() for event in events]
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@processing_bp.route('/calendar/<department>.ics', methods=['GET'])
+def get_department_ical(department):
+    """iCalendar feed of a department's deadlines.
+
+    Calendar apps cannot send headers, so they subscribe with ?token= set
+    to a feed token from POST /calendar/feed-tokens; it grants this feed
+    only and can be revoked. A bearer token in the Authorization header
+    works as well.
+    """
+    try:
+        entry = feed_token_entry(request.args.get('token'), department)
+        if entry:
+            user = load_user_state(entry.user_id)
+            if not user or not user.is_active:
+                return jsonify({'error': 'Authentication required'}), 401
+        else:
+            user = authenticate_request()
+            if not user:
+                return jsonify({'error': 'Authentication required'}), 401
+        if user.role != 'admin' and user.department != department:
+            return jsonify({'error': 'Access denied'}), 403
+        
+        body, version = ical_feed_cache.feed(department)
+        if request.if_none_match.contains(version):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype='text/calendar')
+            response.headers['Content-Disposition'] = f'inline; filename="{department}.ics"'
+        response.set_etag(version)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@processing_bp.route('/calendar/feed-tokens', methods=['GET', 'POST'])
+@auth_required_api()
+def calendar_feed_tokens():
+    """List your feed tokens, or create one for a department's iCal feed"""
+    try:
+        user = request.user
+        if request.method == 'GET':
+            entries = CalendarFeedToken.query.filter_by(user_id=user.id, revoked_at=None) \
+                .order_by(CalendarFeedToken.id).all()
+            return jsonify({'tokens': [entry.to_dict() for entry in entries]})
+        
+        data = request.get_json(silent=True) or {}
+        department = data.get('department') or user.department
+        if user.role != 'admin' and department != user.department:
+            return jsonify({'error': 'Access denied'}), 403
+        
+        entry, token = issue_feed_token(user.id, department, (data.get('label') or '')[:100] or None)
+        return jsonify({
+            'token': token,
+            'feed_url': f"{request.host_url.rstrip('/')}/api/processing/calendar/{department}.ics?token={token}",
+            'feed_token': entry.to_dict()
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@processing_bp.route('/calendar/feed-tokens/<int:token_id>', methods=['DELETE'])
+@auth_required_api()
+def revoke_calendar_feed_token(token_id):
+    try:
+        user = request.user
+        entry = CalendarFeedToken.query.get(token_id)
+        if not entry or (entry.user_id != user.id and user.role != 'admin'):
+            return jsonify({'error': 'Feed token not found'}), 404
+        revoke_feed_token(entry)
+        return jsonify({'message': 'Feed token revoked', 'feed_token': entry.to_dict()})
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @processing_bp.route('/documents/summary', methods=['GET'])
 @auth_required_api(required_role='admin')
+@conditional_get(lambda: (
+    processed_documents_version(),
+    documents_version(),
+    time_bucket(S3_LISTING_VERSION_SECONDS)
+))
 def get_documents_summary():
     try:
         user = request.user
@@ -420,15 +935,18 @@ def trigger_processing():
         
         data = request.get_json() or {}
         department = data.get('department')
+        job_id = data.get('job_id') or uuid.uuid4().hex
         
-        result = auto_fetch_and_process(department)
+        result = run_backlog_ingestion(department, data, job_id, user.id)
         
         return jsonify({
             'message': 'Processing triggered',
+            'job_id': job_id,
             'result': result
         })
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @processing_bp.route('/download-document/<int:doc_id>', methods=['GET'])
@@ -460,23 +978,14 @@ def download_document(doc_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@processing_bp.route('/get-s3-url/<s3_key>', methods=['GET'])
+@processing_bp.route('/get-s3-url/<path:s3_key>', methods=['GET'])
 @auth_required_api()
 def get_s3_url(s3_key):
     try:
         user = request.user
         
-        from model import s3_client, AWS_S3_BUCKET, AWS_REGION
-        
-        # Generate presigned URL (expires in 1 hour)
-        presigned_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={
-                'Bucket': AWS_S3_BUCKET,
-                'Key': s3_key
-            },
-            ExpiresIn=3600
-        )
+        # Reuse a cached presigned URL while it is still fresh
+        presigned_url = presigned_get_url(s3_key, user.department)
         
         return jsonify({
             'presigned_url': presigned_url,
@@ -486,6 +995,237 @@ def get_s3_url(s3_key):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@processing_bp.route('/ask', methods=['POST'])
+@auth_required_api()
+def ask_knowledge_base():
+    try:
+        user = request.user
+
+        data = request.get_json() or {}
+        question = (data.get('question') or '').strip()
+        if not question:
+            return jsonify({'error': 'Question required'}), 400
+
+        department = data.get('department') or user.department
+
+        # Check if user has access to this department
+        if user.role != 'admin' and user.department != department:
+            return jsonify({'error': 'Access denied'}), 403
+
+        # Admins asking from the admin department search every department
+        if department == 'admin':
+            department = None
+
+        result = answer_question(question, department)
+
+        return jsonify(result)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@processing_bp.route('/action-items', methods=['GET'])
+@auth_required_api()
+def list_action_items():
+    try:
+        user = request.user
+        
+        department = request.args.get('department')
+        status = request.args.get('status')
+        due_before = request.args.get('due_before')
+        due_after = request.args.get('due_after')
+        document_id = request.args.get('document_id', type=int)
+        limit = min(request.args.get('limit', 500, type=int), 5000)
+        offset = request.args.get('offset', 0, type=int)
+        
+        query = DocumentActionItem.query
+        
+        # Non-admin users only see their own department
+        if user.role != 'admin':
+            query = query.filter(DocumentActionItem.department == user.department)
+        elif department:
+            query = query.filter(DocumentActionItem.department == department)
+        
+        if status:
+            query = query.filter(DocumentActionItem.status.in_(status.split(',')))
+        if due_before:
+            query = query.filter(DocumentActionItem.due_date <= datetime.strptime(due_before, '%Y-%m-%d').date())
+        if due_after:
+            query = query.filter(DocumentActionItem.due_date >= datetime.strptime(due_after, '%Y-%m-%d').date())
+        if document_id:
+            query = query.filter(DocumentActionItem.document_id == document_id)
+        
+        items = query.order_by(
+            DocumentActionItem.due_date.is_(None),
+            DocumentActionItem.due_date,
+            DocumentActionItem.id
+        ).offset(offset).limit(limit).yield_per(STREAM_BATCH_SIZE)
+        
+        return stream_json_array(item.to_dict() for item in items)
+        
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@processing_bp.route('/action-items/<int:item_id>', methods=['PATCH'])
+@auth_required_api()
+def update_action_item(item_id):
+    try:
+        user = request.user
+        
+        item = DocumentActionItem.query.get_or_404(item_id)
+        
+        # Check permissions
+        if user.role != 'admin' and user.department != item.department:
+            return jsonify({'error': 'Access denied'}), 403
+        
+        data = request.get_json() or {}
+        
+        if 'status' in data:
+            if data['status'] not in ACTION_ITEM_STATUSES:
+                return jsonify({'error': f'Status must be one of {ACTION_ITEM_STATUSES}'}), 400
+            item.status = data['status']
+        
+        if 'due_date' in data:
+            if data['due_date']:
+                try:
+                    item.due_date = datetime.strptime(data['due_date'], '%Y-%m-%d').date()
+                except ValueError:
+                    return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+            else:
+                item.due_date = None
+        
+        if data.get('text'):
+            item.text = data['text']
+        
+        db.session.commit()
+        
+        return jsonify({
+            'message': 'Action item updated',
+            'item': item.to_dict()
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@processing_bp.route('/key-points', methods=['GET'])
+@auth_required_api()
+def list_key_points():
+    try:
+        user = request.user
+        
+        department = request.args.get('department')
+        document_id = request.args.get('document_id', type=int)
+        search = request.args.get('search')
+        limit = min(request.args.get('limit', 500, type=int), 5000)
+        offset = request.args.get('offset', 0, type=int)
+        
+        query = DocumentKeyPoint.query
+        
+        if user.role != 'admin':
+            query = query.filter(DocumentKeyPoint.department == user.department)
+        elif department:
+            query = query.filter(DocumentKeyPoint.department == department)
+        
+        if document_id:
+            query = query.filter(DocumentKeyPoint.document_id == document_id)
+        if search:
+            query = query.filter(DocumentKeyPoint.text.contains(search))
+        
+        points = query.order_by(
+            DocumentKeyPoint.document_id.desc(),
+            DocumentKeyPoint.position
+        ).offset(offset).limit(limit).yield_per(STREAM_BATCH_SIZE)
+        
+        return stream_json_array(point.to_dict() for point in points)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@processing_bp.route('/traces', methods=['GET'])
+@auth_required_api(required_role='admin')
+def list_slowest_traces():
+    """Slowest recent traces, optionally filtered by root span name (?name=process_s3_document)"""
+    limit = min(request.args.get('limit', 20, type=int), 200)
+    return jsonify({'traces': trace_store.slowest(limit, request.args.get('name'))})
+
+@processing_bp.route('/traces/<trace_id>', methods=['GET'])
+@auth_required_api(required_role='admin')
+def get_trace(trace_id):
+    trace = trace_store.get(trace_id)
+    if not trace:
+        return jsonify({'error': 'Trace not found'}), 404
+    return jsonify(trace)
+
+@processing_bp.route('/llm/models', methods=['GET'])
+@auth_required_api(required_role='admin')
+def llm_model_stats():
+    """Stage routes plus per-model calls, recent latency, fallbacks and estimated cost"""
+    return jsonify(model_router.stats())
+
+@processing_bp.route('/url-cache', methods=['GET'])
+@auth_required_api(required_role='admin')
+def url_cache_stats():
+    """Size and hit/miss counts of this worker's presigned URL cache"""
+    return jsonify(presigned_url_cache.stats())
+
+@processing_bp.route('/profile', methods=['GET', 'POST'])
+@auth_required_api(required_role='admin')
+def profile_worker():
+    """Start profiling the next N requests or T seconds of this worker (POST), or show status (GET)"""
+    if request.method == 'GET':
+        return jsonify(profiler.status())
+    
+    data = request.get_json() or {}
+    try:
+        session = profiler.start(
+            current_app._get_current_object(),
+            requests=data.get('requests'),
+            seconds=data.get('seconds'),
+            cpu=data.get('cpu', True),
+            memory=data.get('memory', True),
+            path_prefix=data.get('path_prefix')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    
+    return jsonify({'message': 'Profiling started', 'session': session.status()}), 202
+
+@processing_bp.route('/profile/stop', methods=['POST'])
+@auth_required_api(required_role='admin')
+def stop_profiling():
+    profiler.stop()
+    return jsonify(profiler.status())
+
+@processing_bp.route('/profile/result', methods=['GET'])
+@auth_required_api(required_role='admin')
+def profile_result():
+    """Last profile: ?format=text (default, JSON with pstats text and allocations), collapsed or pstats"""
+    fmt = request.args.get('format', 'text')
+    if fmt not in ('text', 'collapsed', 'pstats'):
+        return jsonify({'error': 'format must be text, collapsed or pstats'}), 400
+    
+    try:
+        report = profiler.report(fmt, request.args.get('sort', 'cumulative'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if report is None:
+        return jsonify({'error': 'No profile available'}), 404
+    
+    if fmt == 'pstats':
+        with open(report, 'rb') as f:
+            data = f.read()
+        os.unlink(report)
+        response = Response(data, mimetype='application/octet-stream')
+        response.headers['Content-Disposition'] = 'attachment; filename=profile.prof'
+        return response
+    if fmt == 'collapsed':
+        return Response(report, mimetype='text/plain')
+    return jsonify(report)
+
 @processing_bp.route('/test-connection', methods=['GET'])
 def test_connection():
     return jsonify({
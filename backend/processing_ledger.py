@@ -0,0 +1,172 @@
+# processing_ledger.py - Exactly-once processing state per S3 object version
+import os
+import json
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import and_, case, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models import db, ProcessingLedgerEntry
+from model import DocumentProcessingResult, result_to_dict, result_from_dict
+
+# Stages an object version moves through; 'failed' entries are retried
+LEDGER_STAGES = ['pending', 'analyzed', 'archived', 'saved', 'failed']
+ANALYZED_STAGES = ('analyzed', 'archived', 'saved')
+# A claim not updated for this long is taken to belong to a crashed worker
+LEDGER_LEASE_SECONDS = int(os.getenv('LEDGER_LEASE_SECONDS', 1800))
+
+class DocumentInProgress(Exception):
+    """Another worker holds an unexpired claim on this object version"""
+
+class ProcessingLedger:
+    """DB-backed ledger keyed by (bucket key, ETag).
+
+    Every state change is committed right away so a crashed run resumes
+    from the last completed stage. The ETag identifies the content, so an
+    object version is analyzed once even if it is re-uploaded under another
+    key.
+    """
+
+    def get(self, s3_key: str, etag: str) -> Optional[ProcessingLedgerEntry]:
+        return ProcessingLedgerEntry.query.filter_by(s3_key=s3_key, etag=etag).first()
+
+    def _entry(self, s3_key: str, etag: str) -> ProcessingLedgerEntry:
+        entry = self.get(s3_key, etag)
+        if not entry:
+            entry = ProcessingLedgerEntry(s3_key=s3_key, etag=etag, stage='pending', attempts=0)
+            db.session.add(entry)
+        return entry
+
+    def is_saved(self, s3_key: str, etag: str) -> bool:
+        entry = self.get(s3_key, etag)
+        return bool(entry and entry.stage == 'saved')
+
+    def _independent_session(self) -> Session:
+        """Session on its own connection: claims and failures commit without the caller's changes"""
+        return Session(db.engine)
+
+    def _lease_expired(self, now: datetime):
+        return ProcessingLedgerEntry.updated_at < now - timedelta(seconds=LEDGER_LEASE_SECONDS)
+
+    def start(self, s3_key: str, etag: str) -> bool:
+        """Claim an object version; False if another worker holds it.
+
+        Callers claim before analyzing, reusing or recovering a result. An
+        existing entry is claimed with one conditional UPDATE (failed, or
+        unsaved with an expired lease), a new one by inserting it, so only
+        one of several concurrent workers wins. The lease is the entry's
+        updated_at, refreshed by every stage change, and lasts
+        LEDGER_LEASE_SECONDS. A claimed analyzed or archived entry keeps
+        its stage so its stored result is resumed.
+        """
+        now = datetime.utcnow()
+        with self._independent_session() as session:
+            claimed = session.query(ProcessingLedgerEntry).filter(
+                ProcessingLedgerEntry.s3_key == s3_key,
+                ProcessingLedgerEntry.etag == etag,
+                or_(ProcessingLedgerEntry.stage == 'failed',
+                    and_(ProcessingLedgerEntry.stage.in_(('pending', 'analyzed', 'archived')),
+                         self._lease_expired(now)))
+            ).update({
+                'stage': case((ProcessingLedgerEntry.stage == 'failed', 'pending'),
+                              else_=ProcessingLedgerEntry.stage),
+                'attempts': ProcessingLedgerEntry.attempts + 1,
+                'updated_at': now
+            }, synchronize_session=False)
+            if claimed:
+                session.commit()
+                return True
+            if session.query(ProcessingLedgerEntry.id).filter_by(s3_key=s3_key, etag=etag).first():
+                return False
+            session.add(ProcessingLedgerEntry(s3_key=s3_key, etag=etag, stage='pending', attempts=1,
+                                              created_at=now, updated_at=now))
+            try:
+                session.commit()
+            except IntegrityError:
+                # Another worker inserted it first
+                session.rollback()
+                return False
+        return True
+
+    def stored_result(self, s3_key: str, etag: str) -> Optional[DocumentProcessingResult]:
+        """Analysis already stored for this object version"""
+        entry = self.get(s3_key, etag)
+        if not (entry and entry.result and entry.stage in ANALYZED_STAGES):
+            return None
+        return result_from_dict(json.loads(entry.result))
+
+    def reusable_result(self, s3_key: str, etag: str) -> Optional[DocumentProcessingResult]:
+        """Analysis of the same content (ETag) stored under another key, renamed for s3_key.
+
+        Nothing is recorded; the caller records it for s3_key once claimed.
+        """
+        entry = ProcessingLedgerEntry.query.filter(
+            ProcessingLedgerEntry.etag == etag,
+            ProcessingLedgerEntry.s3_key != s3_key,
+            ProcessingLedgerEntry.stage.in_(ANALYZED_STAGES),
+            ProcessingLedgerEntry.result.isnot(None)
+        ).order_by(ProcessingLedgerEntry.id).first()
+        if not entry:
+            return None
+
+        # Same bytes under a new key: reuse the analysis, keep the new name
+        result = result_from_dict(json.loads(entry.result))
+        result.original_filename = os.path.basename(s3_key)
+        result.metadata = dict(result.metadata, s3_key=s3_key, reused_from=entry.s3_key)
+        result.duplicate_of = result.duplicate_of or entry.processed_document_id
+        return result
+
+    def record_result(self, s3_key: str, etag: str, result: DocumentProcessingResult):
+        entry = self._entry(s3_key, etag)
+        entry.result = json.dumps(result_to_dict(result))
+        entry.stage = 'analyzed'
+        entry.last_error = None
+        db.session.commit()
+
+    def record_stage(self, s3_key: str, etag: str, stage: str):
+        entry = self._entry(s3_key, etag)
+        if entry.stage != 'saved':
+            entry.stage = stage
+        db.session.commit()
+
+    def record_failure(self, s3_key: str, etag: str, error: str):
+        """Mark a version failed; the caller's session and its pending changes are left alone"""
+        with self._independent_session() as session:
+            updated = session.query(ProcessingLedgerEntry).filter_by(s3_key=s3_key, etag=etag).update({
+                'stage': 'failed',
+                'last_error': error[:2000],
+                'updated_at': datetime.utcnow()
+            }, synchronize_session=False)
+            if not updated:
+                session.add(ProcessingLedgerEntry(s3_key=s3_key, etag=etag, stage='failed', attempts=1,
+                                                  last_error=error[:2000]))
+            session.commit()
+
+    def mark_saved(self, s3_key: str, etag: str, document_id: int):
+        """Link the saved ProcessedDocument (caller commits with the document)"""
+        entry = self._entry(s3_key, etag)
+        entry.stage = 'saved'
+        entry.processed_document_id = document_id
+
+    def saved_document_id(self, s3_key: str, etag: str) -> Optional[int]:
+        entry = self.get(s3_key, etag)
+        return entry.processed_document_id if entry and entry.stage == 'saved' else None
+
+    def unsaved_results(self, limit: int = 500) -> List[DocumentProcessingResult]:
+        """Analyzed results whose document row was never written (e.g. crash after archiving).
+
+        Only entries whose lease expired are returned; claim each with start() before saving it.
+        """
+        entries = ProcessingLedgerEntry.query.filter(
+            ProcessingLedgerEntry.stage.in_(('analyzed', 'archived')),
+            ProcessingLedgerEntry.result.isnot(None),
+            self._lease_expired(datetime.utcnow())
+        ).order_by(ProcessingLedgerEntry.id).limit(limit).all()
+        results = []
+        for entry in entries:
+            result = result_from_dict(json.loads(entry.result))
+            result.metadata = dict(result.metadata, s3_key=entry.s3_key, etag=entry.etag)
+            results.append(result)
+        return results
+
+processing_ledger = ProcessingLedger()
@@ -0,0 +1,292 @@
+# profiling.py - On-demand CPU and allocation profiling of a live worker
+import io
+import time
+import pstats
+import cProfile
+import tempfile
+import threading
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+PROFILE_MAX_REQUESTS = 1000
+PROFILE_MAX_SECONDS = 300
+PROFILE_TOP_FUNCTIONS = 40
+PROFILE_TOP_ALLOCATIONS = 25
+PROFILE_EXCLUDED_PREFIX = '/api/processing/profile'
+PROFILE_SORT_KEYS = sorted(key.value for key in pstats.SortKey)
+
+def _enable(profile: cProfile.Profile) -> bool:
+    """Enable a profiler; False when another one is active (Python 3.12+ allows one at a time)"""
+    try:
+        profile.enable()
+        return True
+    except ValueError:
+        return False
+
+class _ProfiledIterable:
+    """Keeps profiling while a streamed response body is produced"""
+
+    def __init__(self, iterable, profile: cProfile.Profile, on_close):
+        self._iterator = iter(iterable)
+        self._iterable = iterable
+        self._profile = profile
+        self._on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not _enable(self._profile):
+            return next(self._iterator)
+        try:
+            return next(self._iterator)
+        finally:
+            self._profile.disable()
+
+    def close(self):
+        try:
+            if hasattr(self._iterable, 'close'):
+                self._iterable.close()
+        finally:
+            self._on_close(self._profile)
+
+class ProfilingSession:
+    """WSGI middleware installed only while a profiling window is open.
+
+    Each request gets its own cProfile.Profile (profilers are per thread);
+    they are merged into one pstats.Stats when the window closes.
+    """
+
+    def __init__(self, app, wsgi_app, requests: Optional[int], seconds: Optional[float],
+                 cpu: bool, memory: bool, path_prefix: Optional[str], on_finish):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.max_requests = requests
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.seconds = seconds
+        self.cpu = cpu
+        self.memory = memory
+        self.path_prefix = path_prefix
+        self.on_finish = on_finish
+        self.started_at = time.time()
+        self.requests_started = 0
+        self.requests_finished = 0
+        self.stats: Optional[pstats.Stats] = None
+        self.finished = False
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._owns_tracemalloc = False
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            self._owns_tracemalloc = True
+        self.app.wsgi_app = self
+        if self.seconds:
+            self._timer = threading.Timer(self.seconds, self.finish)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _should_profile(self, environ) -> bool:
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(PROFILE_EXCLUDED_PREFIX):
+            return False
+        if self.path_prefix and not path.startswith(self.path_prefix):
+            return False
+        with self._lock:
+            if self.finished:
+                return False
+            if self.max_requests and self.requests_started >= self.max_requests:
+                return False
+            self.requests_started += 1
+            return True
+
+    def __call__(self, environ, start_response):
+        if not self._should_profile(environ):
+            return self.wsgi_app(environ, start_response)
+        if not self.cpu:
+            try:
+                return self.wsgi_app(environ, start_response)
+            finally:
+                self._request_done(None)
+
+        profile = cProfile.Profile()
+        if not _enable(profile):
+            self._request_done(None)
+            return self.wsgi_app(environ, start_response)
+        try:
+            body = self.wsgi_app(environ, start_response)
+        except BaseException:
+            profile.disable()
+            self._request_done(profile)
+            raise
+        profile.disable()
+        return _ProfiledIterable(body, profile, self._request_done)
+
+    def _request_done(self, profile: Optional[cProfile.Profile]):
+        with self._lock:
+            if profile is not None:
+                try:
+                    if self.stats is None:
+                        self.stats = pstats.Stats(profile)
+                    else:
+                        self.stats.add(profile)
+                except TypeError:
+                    pass  # nothing was recorded
+            self.requests_finished += 1
+            done = (self.max_requests and self.requests_finished >= self.max_requests) or \
+                (self.deadline and time.monotonic() >= self.deadline)
+        if done:
+            self.finish()
+
+    def finish(self):
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+        # Restore the original WSGI app first so no further request pays for profiling
+        if self.app.wsgi_app is self:
+            self.app.wsgi_app = self.wsgi_app
+        if self._timer:
+            self._timer.cancel()
+
+        allocations = None
+        if self.memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            # Tracing started elsewhere (e.g. PYTHONTRACEMALLOC) keeps running
+            if self._owns_tracemalloc:
+                tracemalloc.stop()
+            allocations = top_allocations(snapshot, PROFILE_TOP_ALLOCATIONS)
+        self.on_finish(self, allocations)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'active': not self.finished,
+            'started_at': self.started_at,
+            'requests_profiled': self.requests_finished,
+            'max_requests': self.max_requests,
+            'seconds': self.seconds,
+            'cpu': self.cpu,
+            'memory': self.memory,
+            'path_prefix': self.path_prefix
+        }
+
+def top_allocations(snapshot: tracemalloc.Snapshot, limit: int) -> List[Dict[str, Any]]:
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, pstats.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ])
+    return [
+        {
+            'location': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            'size_kb': round(stat.size / 1024, 1),
+            'count': stat.count
+        }
+        for stat in snapshot.statistics('lineno')[:limit]
+    ]
+
+def _number(value, kind, name: str):
+    """Cast a request parameter to int or float, None when absent"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f'{name} must be a number')
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a number')
+
+def check_sort(sort: str) -> str:
+    if sort not in PROFILE_SORT_KEYS:
+        raise ValueError(f"sort must be one of {', '.join(PROFILE_SORT_KEYS)}")
+    return sort
+
+def stats_text(stats: pstats.Stats, sort: str = 'cumulative', limit: int = PROFILE_TOP_FUNCTIONS) -> str:
+    buffer = io.StringIO()
+    pstats.Stats(stream=buffer).add(stats).sort_stats(check_sort(sort)).print_stats(limit)
+    return buffer.getvalue()
+
+def collapsed_stacks(stats: pstats.Stats) -> str:
+    """caller;callee self-time lines (one call level), loadable by flame graph tools"""
+    def label(func):
+        filename, lineno, name = func
+        return f"{name} ({filename.rsplit('/', 1)[-1]}:{lineno})"
+
+    lines = []
+    for func, (_, _, total_time, _, callers) in stats.stats.items():
+        if not callers:
+            lines.append(f"{label(func)} {int(total_time * 1e6)}")
+        for caller, (_, _, caller_total, _) in callers.items():
+            lines.append(f"{label(caller)};{label(func)} {int(caller_total * 1e6)}")
+    return '\n'.join(line for line in lines if not line.endswith(' 0'))
+
+class Profiler:
+    """Owns at most one profiling window per worker and the last result"""
+
+    def __init__(self):
+        self.session: Optional[ProfilingSession] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+
+    def start(self, app, requests: Optional[int] = None, seconds: Optional[float] = None,
+              cpu: bool = True, memory: bool = True, path_prefix: Optional[str] = None) -> ProfilingSession:
+        requests = _number(requests, int, 'requests')
+        seconds = _number(seconds, float, 'seconds')
+        if not requests and not seconds:
+            raise ValueError('requests or seconds is required')
+        if requests and not 0 < requests <= PROFILE_MAX_REQUESTS:
+            raise ValueError(f'requests must be between 1 and {PROFILE_MAX_REQUESTS}')
+        if seconds and not 1 <= seconds <= PROFILE_MAX_SECONDS:
+            raise ValueError(f'seconds must be between 1 and {PROFILE_MAX_SECONDS}')
+
+        with self._lock:
+            if self.session and not self.session.finished:
+                raise RuntimeError('A profiling session is already running')
+            self.session = ProfilingSession(app, app.wsgi_app, requests, seconds, cpu, memory,
+                                            path_prefix, self._store_result)
+            self.session.start()
+            return self.session
+
+    def stop(self):
+        session = self.session
+        if session and not session.finished:
+            session.finish()
+
+    def _store_result(self, session: ProfilingSession, allocations):
+        self.result = {
+            'status': session.status(),
+            'finished_at': time.time(),
+            'stats': session.stats,
+            'allocations': allocations
+        }
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'session': self.session.status() if self.session else None,
+            'result_available': self.result is not None
+        }
+
+    def report(self, fmt: str = 'text', sort: str = 'cumulative'):
+        """Last result as a JSON-ready dict (text), collapsed stacks or a pstats file path"""
+        check_sort(sort)
+        if not self.result:
+            return None
+        stats = self.result['stats']
+        if fmt == 'pstats':
+            if stats is None:
+                return None
+            path = tempfile.NamedTemporaryFile(delete=False, suffix='.prof').name
+            stats.dump_stats(path)
+            return path
+        if fmt == 'collapsed':
+            return collapsed_stacks(stats) if stats else ''
+        return {
+            'status': self.result['status'],
+            'finished_at': self.result['finished_at'],
+            'cpu': stats_text(stats, sort) if stats else None,
+            'allocations': self.result['allocations']
+        }
+
+profiler = Profiler()
@@ -0,0 +1,106 @@
+# progress_events.py - In-process fan-out of document processing progress events
+import json
+import time
+import queue
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, Optional
+
+# Stages emitted while a document moves through the pipeline
+PROGRESS_STAGES = ['queued', 'downloaded', 'extracted', 'classified', 'summarized', 'saved', 'failed']
+
+SUBSCRIBER_QUEUE_SIZE = 256
+REPLAY_BUFFER_SIZE = 500
+KEEPALIVE_SECONDS = 15
+
+def department_from_key(s3_key: Optional[str]) -> Optional[str]:
+    """Department folder of an uploads/<department>/... key"""
+    parts = (s3_key or '').split('/')
+    if len(parts) >= 3 and parts[0] == 'uploads':
+        return parts[1]
+    return None
+
+class Subscription:
+    def __init__(self, department: Optional[str], job_id: Optional[str]):
+        self.department = department
+        self.job_id = job_id
+        self.queue: queue.Queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        if self.job_id and event.get('job_id') != self.job_id:
+            return False
+        if self.department and self.department not in (event.get('department'), event.get('upload_department')):
+            return False
+        return True
+
+class ProgressBroker:
+    """Publishes stage events to subscribers filtered by department or job"""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._recent: deque = deque(maxlen=REPLAY_BUFFER_SIZE)
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+    def publish(self, job_id: str, stage: str, s3_key: Optional[str] = None, **details) -> Dict[str, Any]:
+        with self._lock:
+            event = {
+                'id': self._next_id,
+                'job_id': job_id,
+                'stage': stage,
+                's3_key': s3_key,
+                'upload_department': department_from_key(s3_key),
+                'timestamp': time.time(),
+                **details
+            }
+            self._next_id += 1
+            self._recent.append(event)
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            if subscription.matches(event):
+                try:
+                    subscription.queue.put_nowait(event)
+                except queue.Full:
+                    pass  # slow client; it can recover with Last-Event-ID
+        return event
+
+    def reporter(self, job_id: str) -> Callable[..., None]:
+        """Progress callback bound to a job, as expected by the pipeline functions"""
+        def report(stage: str, s3_key: Optional[str] = None, **details):
+            self.publish(job_id, stage, s3_key, **details)
+        return report
+
+    def subscribe(self, department: Optional[str] = None, job_id: Optional[str] = None,
+                  last_event_id: Optional[int] = None) -> Subscription:
+        subscription = Subscription(department, job_id)
+        with self._lock:
+            if last_event_id is not None:
+                # Only the newest events fit the subscriber queue
+                missed = deque((event for event in self._recent
+                                if event['id'] > last_event_id and subscription.matches(event)),
+                               maxlen=SUBSCRIBER_QUEUE_SIZE)
+                for event in missed:
+                    subscription.queue.put_nowait(event)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def stream(self, subscription: Subscription) -> Iterator[str]:
+        """Server-Sent Events text for a subscription, with keepalives"""
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = subscription.queue.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"id: {event['id']}\nevent: progress\ndata: {json.dumps(event)}\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+progress_broker = ProgressBroker()
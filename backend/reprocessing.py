@@ -0,0 +1,174 @@
+# reprocessing.py - Recompute only the pipeline stages whose version changed
+#
+# Usage (from backend/):
+#   python reprocessing.py [--department safety] [--ids 4,8,15] [--stages extract_action_items]
+#                          [--workers 8] [--limit 1000] [--after-id 0] [--dry-run]
+#
+# Documents are scanned in id order and compared against the current stage
+# versions (model.stage_versions). Stale stages are rerun on the text kept in
+# the text store, in parallel across documents, and each batch is committed
+# on its own. A rerun skips documents that are already current, so an
+# interrupted run is resumed by starting it again (or from --after-id).
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from models import db, ProcessedDocument
+from model import STAGE_CODE_VERSIONS, stage_versions, stale_stages, rerun_stages, text_store, report_progress
+from document_items import sync_items_for_documents
+from calendar_index import sync_calendar_events
+from tracing import span
+
+REPROCESS_BATCH_SIZE = 50
+REPROCESS_WORKERS = 8
+
+def _document_fields(document: ProcessedDocument) -> Dict[str, Any]:
+    return {
+        'document_type': document.document_type,
+        'department': document.department,
+        'summary': document.summary,
+        'key_points': json.loads(document.key_points) if document.key_points else [],
+        'action_items': json.loads(document.action_items) if document.action_items else [],
+        'deadline': document.deadline,
+        'priority': document.priority
+    }
+
+def _rerun(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Worker: load the stored text and rerun the stale stages (no database access)"""
+    with span('reprocess_document', document_id=job['id'], stages=','.join(job['stages'])):
+        try:
+            raw_text = text_store.get(job['etag'])
+            if raw_text is None:
+                return dict(job, error='extracted text is not in the text store')
+            return dict(job, **rerun_stages(raw_text, job['fields'], job['stages']))
+        except Exception as e:
+            return dict(job, error=str(e))
+
+def _apply(document: ProcessedDocument, outcome: Dict[str, Any]):
+    changed = outcome['changed']
+    for field in ('document_type', 'department', 'summary', 'deadline', 'priority'):
+        if field in changed:
+            setattr(document, field, changed[field])
+    if 'key_points' in changed:
+        document.key_points = json.dumps(changed['key_points'])
+    if 'action_items' in changed:
+        document.action_items = json.dumps(changed['action_items'])
+
+    metadata = json.loads(document.doc_metadata) if document.doc_metadata else {}
+    recorded = dict(metadata.get('stage_versions') or {})
+    # Stages no model answered keep their old (stale) version and get retried
+    recorded.update(outcome['versions'])
+    metadata['stage_versions'] = recorded
+    metadata.setdefault('stage_models', {}).update(
+        {stage: name for stage, name in outcome['stage_models'].items() if name})
+    metadata['reprocessed_date'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    document.doc_metadata = json.dumps(metadata)
+
+    fields = _document_fields(document)
+    # Items and events still produced keep their ids and action item status
+    if {'key_points', 'action_items', 'department', 'deadline'} & set(changed):
+        sync_items_for_documents([(document, fields['key_points'], fields['action_items'])])
+    if {'action_items', 'department', 'deadline', 'priority', 'summary'} & set(changed):
+        sync_calendar_events([(document, fields['action_items'])])
+
+def reprocess_documents(department: Optional[str] = None,
+                        document_ids: Optional[List[int]] = None,
+                        stages: Optional[List[str]] = None,
+                        after_id: int = 0,
+                        limit: Optional[int] = None,
+                        workers: int = REPROCESS_WORKERS,
+                        batch_size: int = REPROCESS_BATCH_SIZE,
+                        dry_run: bool = False,
+                        progress=None) -> Dict[str, Any]:
+    """Rerun stale stages (or the given stages) for the selected processed documents.
+
+    Returns counts, the stale stages found per stage name, failures and
+    last_id, the id to pass as after_id to continue a limited run.
+    """
+    unknown = set(stages or []) - set(STAGE_CODE_VERSIONS)
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    versions = stage_versions()
+    started = time.monotonic()
+    report = {'scanned': 0, 'up_to_date': 0, 'reprocessed': 0, 'changed': 0,
+              'stale_by_stage': {stage: 0 for stage in STAGE_CODE_VERSIONS}, 'failed': []}
+    last_id = after_id
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='reprocess') as executor:
+        while limit is None or report['scanned'] < limit:
+            query = ProcessedDocument.query.filter(
+                ProcessedDocument.id > last_id,
+                ProcessedDocument.status == 'processed'
+            )
+            if department:
+                query = query.filter(ProcessedDocument.department == department)
+            if document_ids:
+                query = query.filter(ProcessedDocument.id.in_(document_ids))
+            size = batch_size if limit is None else min(batch_size, limit - report['scanned'])
+            documents = query.order_by(ProcessedDocument.id).limit(size).all()
+            if not documents:
+                break
+
+            jobs = []
+            for document in documents:
+                metadata = json.loads(document.doc_metadata) if document.doc_metadata else {}
+                todo = list(stages) if stages else stale_stages(metadata.get('stage_versions'), versions)
+                for stage in todo:
+                    report['stale_by_stage'][stage] += 1
+                if not todo:
+                    report['up_to_date'] += 1
+                    continue
+                jobs.append({'id': document.id, 'etag': metadata.get('etag'),
+                             'stages': todo, 'fields': _document_fields(document)})
+
+            report['scanned'] += len(documents)
+            last_id = documents[-1].id
+            if dry_run or not jobs:
+                continue
+
+            by_id = {document.id: document for document in documents}
+            for outcome in executor.map(_rerun, jobs):
+                if outcome.get('error'):
+                    report['failed'].append({'id': outcome['id'], 'error': outcome['error']})
+                    continue
+                _apply(by_id[outcome['id']], outcome)
+                report['reprocessed'] += 1
+                report['changed'] += bool(outcome['changed'])
+                report_progress(progress, 'reprocessed', str(outcome['id']),
+                                stages=outcome['stages'], changed=sorted(outcome['changed']),
+                                failed_stages=outcome['failed_stages'])
+            db.session.commit()
+
+    report['last_id'] = last_id
+    report['dry_run'] = dry_run
+    report['elapsed_seconds'] = round(time.monotonic() - started, 3)
+    return report
+
+if __name__ == '__main__':
+    import argparse
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Rerun pipeline stages whose version changed')
+    parser.add_argument('--department')
+    parser.add_argument('--ids', help='comma-separated processed document ids')
+    parser.add_argument('--stages', help='comma-separated stages to force, e.g. extract_action_items')
+    parser.add_argument('--after-id', type=int, default=0, help='resume after this document id')
+    parser.add_argument('--limit', type=int)
+    parser.add_argument('--workers', type=int, default=REPROCESS_WORKERS)
+    parser.add_argument('--batch-size', type=int, default=REPROCESS_BATCH_SIZE)
+    parser.add_argument('--dry-run', action='store_true', help='only count stale stages')
+    args = parser.parse_args()
+
+    with app.app_context():
+        result = reprocess_documents(
+            department=args.department,
+            document_ids=[int(i) for i in args.ids.split(',')] if args.ids else None,
+            stages=args.stages.split(',') if args.stages else None,
+            after_id=args.after_id,
+            limit=args.limit,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            dry_run=args.dry_run
+        )
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,113 @@
+# result_writer.py - Batched persistence of pipeline results
+import os
+import json
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+from models import db, ProcessedDocument, ProcessingLedgerEntry
+from model import DocumentProcessingResult
+from document_items import save_items_for_documents, sync_items_for_documents
+from calendar_index import save_calendar_events, sync_calendar_events
+
+RESULT_WRITE_BATCH_SIZE = int(os.getenv('RESULT_WRITE_BATCH_SIZE', 500))
+
+def document_row(result: DocumentProcessingResult, user_id: Optional[int]) -> Dict[str, Any]:
+    """processed_documents column values of a pipeline result"""
+    return {
+        'original_filename': result.original_filename,
+        'processed_filename': result.processed_filename,
+        'file_path': result.s3_url,
+        'document_type': result.document_type.value,
+        'department': result.department.value,
+        'summary': result.summary,
+        'key_points': json.dumps(result.key_points),
+        'action_items': json.dumps(result.action_items),
+        'deadline': result.deadline,
+        'priority': result.priority,
+        'doc_metadata': json.dumps(result.metadata),
+        'processed_by': user_id,
+        'status': 'processed',
+        'simhash': result.simhash,
+        'minhash': result.minhash,
+        'duplicate_of': result.duplicate_of
+    }
+
+def _object_version(result: DocumentProcessingResult) -> Tuple[Optional[str], Optional[str]]:
+    return result.metadata.get('s3_key'), result.metadata.get('etag')
+
+def _save_batch(results: List[DocumentProcessingResult], user_id: Optional[int]):
+    # Last result wins when a batch holds the same object version twice
+    by_version: Dict[Any, DocumentProcessingResult] = {}
+    for index, result in enumerate(results):
+        version = _object_version(result)
+        by_version[version if version[1] else index] = result
+
+    # The one existence query: ledger entries of every object version in the batch
+    keys = {key for key in by_version if isinstance(key, tuple)}
+    entries = {}
+    if keys:
+        for entry in ProcessingLedgerEntry.query.filter(
+            ProcessingLedgerEntry.s3_key.in_({s3_key for s3_key, _ in keys})
+        ).all():
+            entries[(entry.s3_key, entry.etag)] = entry
+
+    new_rows, update_rows, written = [], [], []
+    for version, result in by_version.items():
+        row = document_row(result, user_id)
+        entry = entries.get(version)
+        if entry and entry.stage == 'saved' and entry.processed_document_id:
+            row['id'] = entry.processed_document_id
+            update_rows.append(row)
+        else:
+            new_rows.append(row)
+        written.append((version, row, result))
+
+    updated_ids = {row['id'] for row in update_rows}
+    if update_rows:
+        db.session.bulk_update_mappings(ProcessedDocument, update_rows)
+    if new_rows:
+        # return_defaults fills in the new ids, needed for items and the ledger; SQLAlchemy 2.0
+        # (see requirements.txt) does this with batched INSERT ... RETURNING, 1.x row by row
+        db.session.bulk_insert_mappings(ProcessedDocument, new_rows, return_defaults=True)
+
+    documents = [(SimpleNamespace(**row), result) for _, row, result in written]
+    added = [(document, result) for document, result in documents if document.id not in updated_ids]
+    save_items_for_documents([(document, result.key_points, result.action_items) for document, result in added])
+    save_calendar_events([(document, result.action_items) for document, result in added])
+    # Re-analyzed documents keep the items (and their status) and events that are still produced
+    reanalyzed = [(document, result) for document, result in documents if document.id in updated_ids]
+    sync_items_for_documents([(document, result.key_points, result.action_items) for document, result in reanalyzed])
+    sync_calendar_events([(document, result.action_items) for document, result in reanalyzed])
+
+    for version, row, _ in written:
+        if not isinstance(version, tuple):
+            continue
+        entry = entries.get(version)
+        if entry is None:
+            entry = ProcessingLedgerEntry(s3_key=version[0], etag=version[1], attempts=0)
+            db.session.add(entry)
+        entry.stage = 'saved'
+        entry.processed_document_id = row['id']
+
+    return len(new_rows), len(update_rows), [(row['id'], result) for _, row, result in written]
+
+def bulk_save_results(results: List[DocumentProcessingResult], user_id: Optional[int],
+                      batch_size: int = RESULT_WRITE_BATCH_SIZE, commit: bool = True) -> Dict[str, Any]:
+    """Upsert full pipeline results as processed documents, batch_size rows per transaction.
+
+    A result with an ETag updates the document already saved for that
+    object version (found through the processing ledger) and is inserted
+    otherwise. Each batch costs one ledger query, one executemany per
+    table written and one commit (skipped when commit is False).
+    Returns the counts and the (document id, result) pairs written.
+    """
+    batch_size = max(int(batch_size), 1)
+    inserted = updated = 0
+    documents = []
+    for start in range(0, len(results), batch_size):
+        batch_inserted, batch_updated, saved = _save_batch(results[start:start + batch_size], user_id)
+        inserted += batch_inserted
+        updated += batch_updated
+        documents.extend(saved)
+        if commit:
+            db.session.commit()
+    return {'inserted': inserted, 'updated': updated, 'documents': documents}
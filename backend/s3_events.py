@@ -0,0 +1,352 @@
+# s3_events.py - Push ingestion from S3 ObjectCreated event notifications
+import os
+import re
+import json
+import time
+import threading
+import urllib.request
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from urllib.parse import unquote_plus, urlparse
+
+# Wait this long after the last event before dispatching, so bursts coalesce
+S3_EVENT_COALESCE_SECONDS = float(os.getenv('S3_EVENT_COALESCE_SECONDS', 2))
+S3_EVENT_BATCH_SIZE = 25
+S3_EVENT_SEEN_SIZE = 10000
+UPLOADS_PREFIX = 'uploads/'
+# SQS messages stay invisible while their batch is handled; extended every half period
+S3_EVENT_VISIBILITY_SECONDS = int(os.getenv('S3_EVENT_VISIBILITY_SECONDS', 300))
+# SNS topics whose subscription confirmations are accepted (comma-separated ARNs)
+S3_EVENTS_SNS_TOPIC_ARNS = tuple(
+    arn.strip() for arn in os.getenv('S3_EVENTS_SNS_TOPIC_ARNS', '').split(',') if arn.strip()
+)
+SNS_HOST_PATTERN = re.compile(r'^sns\.[a-z0-9-]+\.amazonaws\.com(\.cn)?$')
+
+@dataclass
+class S3ObjectEvent:
+    s3_key: str
+    etag: str
+    size: int = 0
+    sequencer: str = ''
+    bucket: Optional[str] = None
+
+def sequencer_is_newer(candidate: str, current: str) -> bool:
+    """S3 sequencers compare lexicographically after right-padding the shorter with zeros"""
+    width = max(len(candidate or ''), len(current or ''))
+    return (candidate or '').upper().ljust(width, '0') >= (current or '').upper().ljust(width, '0')
+
+def _decode(body: Any) -> Any:
+    if isinstance(body, (bytes, bytearray)):
+        body = body.decode('utf-8')
+    if isinstance(body, str):
+        try:
+            return json.loads(body)
+        except ValueError:
+            return None
+    return body
+
+def iter_s3_records(payload: Any) -> Iterable[Dict[str, Any]]:
+    """Yield raw S3 event records from an S3, SNS or SQS shaped payload.
+
+    Accepts a plain S3 notification ({"Records": [...]}), an SNS envelope
+    ({"Type": "Notification", "Message": "..."}), a single SQS message
+    ({"Body": "..."}), an SQS receive_message response ({"Messages": [...]})
+    and a Lambda-style SQS batch ({"Records": [{"body": "..."}]}).
+    """
+    payload = _decode(payload)
+    if isinstance(payload, list):
+        for item in payload:
+            yield from iter_s3_records(item)
+        return
+    if not isinstance(payload, dict):
+        return
+
+    if 'Messages' in payload:
+        for message in payload['Messages']:
+            yield from iter_s3_records(message.get('Body'))
+        return
+    if 'Body' in payload or 'body' in payload:
+        yield from iter_s3_records(payload.get('Body', payload.get('body')))
+        return
+    if payload.get('Type') == 'Notification' and 'Message' in payload:
+        yield from iter_s3_records(payload['Message'])
+        return
+
+    for record in payload.get('Records', []):
+        if 's3' in record:
+            yield record
+        else:
+            yield from iter_s3_records(record)
+
+def parse_s3_events(payload: Any, prefix: str = UPLOADS_PREFIX,
+                    bucket: Optional[str] = None) -> List[S3ObjectEvent]:
+    """ObjectCreated events for objects under prefix (keys URL-decoded), of bucket when given"""
+    events = []
+    for record in iter_s3_records(payload):
+        if not str(record.get('eventName', '')).startswith('ObjectCreated'):
+            continue
+        if bucket and record['s3'].get('bucket', {}).get('name') != bucket:
+            continue
+        obj = record['s3'].get('object', {})
+        s3_key = unquote_plus(obj.get('key', ''))
+        if not s3_key.startswith(prefix) or s3_key.endswith('/') or 'processed/' in s3_key:
+            continue
+        events.append(S3ObjectEvent(
+            s3_key=s3_key,
+            etag=(obj.get('eTag') or obj.get('etag') or '').strip('"'),
+            size=obj.get('size') or 0,
+            sequencer=obj.get('sequencer') or '',
+            bucket=record['s3'].get('bucket', {}).get('name')
+        ))
+    return events
+
+class S3EventQueue:
+    """Coalescing, de-duplicating queue of new upload events.
+
+    Several events for the same key before dispatch collapse into the one
+    with the highest sequencer. (key, ETag) pairs already dispatched are
+    remembered so redelivered notifications are dropped, as are late events
+    older than the last version dispatched for their key.
+    """
+
+    def __init__(self, coalesce_seconds: float = S3_EVENT_COALESCE_SECONDS,
+                 seen_size: int = S3_EVENT_SEEN_SIZE):
+        self.coalesce_seconds = coalesce_seconds
+        self._pending: Dict[str, S3ObjectEvent] = OrderedDict()
+        self._seen: OrderedDict = OrderedDict()
+        self._dispatched_sequencers: OrderedDict = OrderedDict()
+        self._seen_size = seen_size
+        self._last_event_at = 0.0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+
+    def put(self, events: Iterable[S3ObjectEvent]) -> Dict[str, int]:
+        counts = {'accepted': 0, 'coalesced': 0, 'duplicates': 0}
+        with self._lock:
+            for event in events:
+                dispatched = self._dispatched_sequencers.get(event.s3_key)
+                if (event.s3_key, event.etag) in self._seen or (
+                        dispatched and event.sequencer and not sequencer_is_newer(event.sequencer, dispatched)):
+                    counts['duplicates'] += 1
+                    continue
+                current = self._pending.get(event.s3_key)
+                if current is None:
+                    self._pending[event.s3_key] = event
+                    counts['accepted'] += 1
+                else:
+                    counts['coalesced'] += 1
+                    if sequencer_is_newer(event.sequencer, current.sequencer):
+                        self._pending[event.s3_key] = event
+                        superseded = current
+                    else:
+                        superseded = event
+                    if superseded.etag != self._pending[event.s3_key].etag:
+                        self._mark_seen([superseded])
+            self._last_event_at = time.monotonic()
+            self._wakeup.notify_all()
+        return counts
+
+    def _mark_seen(self, events: List[S3ObjectEvent]):
+        for event in events:
+            self._seen[(event.s3_key, event.etag)] = True
+        while len(self._seen) > self._seen_size:
+            self._seen.popitem(last=False)
+
+    def forget(self, events: Iterable[S3ObjectEvent]):
+        """Drop events from the dispatched set so a redelivery is handled again"""
+        with self._lock:
+            for event in events:
+                self._seen.pop((event.s3_key, event.etag), None)
+
+    def drain(self, limit: int = S3_EVENT_BATCH_SIZE) -> List[S3ObjectEvent]:
+        """Take up to limit pending events immediately (no coalescing wait)"""
+        with self._lock:
+            batch = []
+            while self._pending and len(batch) < limit:
+                _, event = self._pending.popitem(last=False)
+                batch.append(event)
+                if event.sequencer:
+                    self._dispatched_sequencers.pop(event.s3_key, None)
+                    self._dispatched_sequencers[event.s3_key] = event.sequencer
+            while len(self._dispatched_sequencers) > self._seen_size:
+                self._dispatched_sequencers.popitem(last=False)
+            self._mark_seen(batch)
+            return batch
+
+    def get_batch(self, limit: int = S3_EVENT_BATCH_SIZE, timeout: Optional[float] = None) -> List[S3ObjectEvent]:
+        """Block until events are pending and the burst has been quiet for coalesce_seconds"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                quiet_for = now - self._last_event_at
+                if self._pending and quiet_for >= self.coalesce_seconds:
+                    break
+                wait = self.coalesce_seconds - quiet_for if self._pending else None
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        return []
+                    wait = min(wait, remaining) if wait is not None else remaining
+                self._wakeup.wait(wait)
+        return self.drain(limit)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+class S3EventConsumer:
+    """Background worker that hands coalesced batches to a handler"""
+
+    def __init__(self, handler: Callable[[List[S3ObjectEvent]], None],
+                 event_queue: Optional[S3EventQueue] = None, autostart: bool = True,
+                 bucket: Optional[str] = None):
+        self.handler = handler
+        self.bucket = bucket
+        self.queue = event_queue if event_queue is not None else S3EventQueue()
+        self.autostart = autostart
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, payload: Any) -> Dict[str, int]:
+        """Parse a notification payload and enqueue its new upload keys"""
+        events = parse_s3_events(payload, bucket=self.bucket)
+        counts = self.queue.put(events)
+        counts['events'] = len(events)
+        if events and self.autostart:
+            self.start()
+        return counts
+
+    def start(self):
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def process_pending(self) -> int:
+        """Handle everything queued right now in the calling thread (tests, CLI, SQS polling).
+
+        A failing batch is forgotten and its exception re-raised.
+        """
+        handled = 0
+        while True:
+            batch = self.queue.drain()
+            if not batch:
+                return handled
+            try:
+                self.handler(batch)
+            except Exception:
+                self.queue.forget(batch)
+                raise
+            handled += len(batch)
+
+    def _run(self):
+        while True:
+            batch = self.queue.get_batch()
+            try:
+                self.handler(batch)
+            except Exception as e:
+                self.queue.forget(batch)
+                print(f"❌ S3 event batch failed: {e}")
+
+def confirm_sns_subscription(payload: Dict[str, Any],
+                             allowed_topics: Iterable[str] = S3_EVENTS_SNS_TOPIC_ARNS) -> bool:
+    """Confirm an SNS SubscriptionConfirmation by fetching its SubscribeURL.
+
+    Only topics listed in allowed_topics are confirmed, and only through an
+    https URL on an SNS endpoint. Returns False without any request when the
+    topic is not allowed; raises when the confirmation request fails.
+    """
+    if payload.get('TopicArn') not in set(allowed_topics):
+        return False
+    url = urlparse(payload.get('SubscribeURL') or '')
+    if url.scheme != 'https' or not SNS_HOST_PATTERN.match(url.hostname or ''):
+        raise ValueError(f"Unexpected SubscribeURL for {payload.get('TopicArn')}")
+    with urllib.request.urlopen(url.geturl(), timeout=10) as response:
+        response.read()
+    return True
+
+def _keep_invisible(sqs_client, queue_url: str, messages: List[Dict[str, Any]],
+                    visibility_timeout: int, stop: threading.Event):
+    while not stop.wait(visibility_timeout / 2):
+        try:
+            sqs_client.change_message_visibility_batch(QueueUrl=queue_url, Entries=[
+                {'Id': str(i), 'ReceiptHandle': message['ReceiptHandle'], 'VisibilityTimeout': visibility_timeout}
+                for i, message in enumerate(messages)
+            ])
+        except Exception as e:
+            print(f"⚠️  Could not extend SQS visibility: {e}")
+
+def poll_sqs(sqs_client, queue_url: str, consumer: S3EventConsumer,
+             wait_seconds: int = 20, max_messages: int = 10,
+             visibility_timeout: int = S3_EVENT_VISIBILITY_SECONDS) -> Dict[str, int]:
+    """Receive one batch of notifications from SQS, handle it and then delete it.
+
+    The events are handled in the calling thread, so consumer must be
+    created with autostart=False. Messages are deleted only after the
+    handler succeeded; their visibility is extended while it runs. When the
+    handler raises, the messages are left to reappear after the timeout.
+    The client is injected so a moto-backed or custom SQS client can be used.
+    """
+    if consumer.autostart:
+        raise ValueError('poll_sqs needs a consumer created with autostart=False')
+    response = sqs_client.receive_message(
+        QueueUrl=queue_url,
+        MaxNumberOfMessages=max_messages,
+        WaitTimeSeconds=wait_seconds,
+        VisibilityTimeout=visibility_timeout
+    )
+    messages = response.get('Messages', [])
+    totals = {'messages': len(messages), 'events': 0, 'accepted': 0, 'coalesced': 0, 'duplicates': 0,
+              'handled': 0, 'deleted': 0}
+    if not messages:
+        return totals
+    for message in messages:
+        counts = consumer.submit(message.get('Body'))
+        for name, value in counts.items():
+            totals[name] = totals.get(name, 0) + value
+
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_keep_invisible, daemon=True,
+                                 args=(sqs_client, queue_url, messages, visibility_timeout, stop))
+    heartbeat.start()
+    try:
+        totals['handled'] = consumer.process_pending()
+    finally:
+        stop.set()
+        heartbeat.join()
+
+    for start in range(0, len(messages), 10):
+        chunk = messages[start:start + 10]
+        response = sqs_client.delete_message_batch(QueueUrl=queue_url, Entries=[
+            {'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']} for i, message in enumerate(chunk)
+        ])
+        for failure in response.get('Failed', []):
+            print(f"⚠️  Could not delete SQS message: {failure.get('Message') or failure.get('Code')}")
+        totals['deleted'] += len(response.get('Successful', []))
+    return totals
+
+if __name__ == '__main__':
+    import boto3
+    from app import app
+    from processing_api import handle_s3_events
+
+    queue_url = os.environ['S3_EVENTS_QUEUE_URL']
+    sqs = boto3.client('sqs', region_name=os.getenv('AWS_REGION', 'us-east-1'))
+
+    def handler(batch):
+        with app.app_context():
+            handle_s3_events(batch)
+
+    consumer = S3EventConsumer(handler, autostart=False, bucket=os.getenv('AWS_S3_BUCKET'))
+    print(f"📨 Polling {queue_url} for S3 upload events")
+    while True:
+        try:
+            totals = poll_sqs(sqs, queue_url, consumer)
+        except Exception as e:
+            print(f"❌ S3 event batch failed, messages will be redelivered: {e}")
+            continue
+        if totals['messages']:
+            print(f"📨 {totals}")
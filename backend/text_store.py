@@ -0,0 +1,284 @@
+# text_store.py - Compressed store of extracted document text keyed by ETag
+#
+# Each text is saved as one blob: a small JSON index followed by
+# independently compressed chunks of TEXT_STORE_CHUNK_CHARS characters, so
+# a character range is served by fetching and decompressing only the chunks
+# it overlaps (an HTTP range GET on S3, a seek on local disk).
+import os
+import json
+import zlib
+import struct
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TEXT_STORE_BACKEND = os.getenv('TEXT_STORE_BACKEND', 'local')  # local, s3 or off
+TEXT_STORE_PATH = os.getenv('TEXT_STORE_PATH', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'instance', 'extracted_text'))
+TEXT_STORE_S3_PREFIX = os.getenv('TEXT_STORE_S3_PREFIX', 'extracted-text/')
+TEXT_STORE_CACHE_MB = float(os.getenv('TEXT_STORE_CACHE_MB', 64))
+TEXT_STORE_CHUNK_CHARS = 64 * 1024
+
+DEFAULT_CODEC = 'zstd' if zstandard else 'zlib'
+MAGIC = b'TXS1'
+PREAMBLE = struct.Struct('>4sI')  # magic, index length
+INDEX_PROBE_BYTES = 16 * 1024
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 6)
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstandard is required to read zstd-compressed text')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+def encode_text(text: str, codec: str = DEFAULT_CODEC, chunk_chars: int = TEXT_STORE_CHUNK_CHARS) -> bytes:
+    """Serialize text as preamble + JSON index + compressed chunks"""
+    payloads, chunks, position = [], [], 0
+    for start in range(0, len(text), chunk_chars):
+        payload = _compress(text[start:start + chunk_chars].encode('utf-8'), codec)
+        chunks.append([position, len(payload)])
+        payloads.append(payload)
+        position += len(payload)
+    index = json.dumps({
+        'codec': codec,
+        'chars': len(text),
+        'chunk_chars': chunk_chars,
+        'chunks': chunks
+    }).encode('utf-8')
+    return PREAMBLE.pack(MAGIC, len(index)) + index + b''.join(payloads)
+
+def _error_code(error: Exception) -> str:
+    return str(getattr(error, 'response', {}).get('Error', {}).get('Code', ''))
+
+class LocalTextBackend:
+    """Blobs under a local directory, sharded by the first two ETag characters"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name[:2], name)
+
+    def put(self, name: str, blob: bytes):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(blob)
+        os.replace(temp_path, path)
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self._path(name))
+
+    def read(self, name: str, start: int, length: int) -> Optional[bytes]:
+        try:
+            with open(self._path(name), 'rb') as f:
+                f.seek(start)
+                return f.read(length)
+        except FileNotFoundError:
+            return None
+
+class S3TextBackend:
+    """Blobs under an S3 prefix, read with range GETs"""
+
+    def __init__(self, client_factory: Callable[[], Any], bucket: str, prefix: str):
+        self.client_factory = client_factory
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def put(self, name: str, blob: bytes):
+        self.client_factory().put_object(Bucket=self.bucket, Key=self.prefix + name, Body=blob,
+                                         ContentType='application/octet-stream')
+
+    def exists(self, name: str) -> bool:
+        try:
+            self.client_factory().head_object(Bucket=self.bucket, Key=self.prefix + name)
+            return True
+        except Exception as e:
+            if _error_code(e) in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def read(self, name: str, start: int, length: int) -> Optional[bytes]:
+        try:
+            response = self.client_factory().get_object(
+                Bucket=self.bucket, Key=self.prefix + name, Range=f"bytes={start}-{start + length - 1}")
+            return response['Body'].read()
+        except Exception as e:
+            if _error_code(e) in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+class StoredText:
+    """Lazy handle on one stored text; chunks are fetched on first use"""
+
+    def __init__(self, store: 'TextStore', etag: str, index: Dict[str, Any], data_offset: int):
+        self.store = store
+        self.etag = etag
+        self.index = index
+        self.data_offset = data_offset
+
+    def __len__(self) -> int:
+        return self.index['chars']
+
+    def read(self, start: int = 0, end: Optional[int] = None) -> str:
+        """Characters [start, end) of the text"""
+        length = len(self)
+        end = length if end is None else min(end, length)
+        start = max(start, 0)
+        if start >= end:
+            return ''
+        chunk_chars = self.index['chunk_chars']
+        first, last = start // chunk_chars, (end - 1) // chunk_chars
+        chunks = self.store._chunks(self, first, last)
+        text = ''.join(chunks)
+        offset = first * chunk_chars
+        return text[start - offset:end - offset]
+
+    def __str__(self) -> str:
+        return self.read()
+
+class TextStore:
+    """Extracted text keyed by object ETag with a size-bounded LRU of decompressed chunks"""
+
+    def __init__(self, backend=None, cache_bytes: int = int(TEXT_STORE_CACHE_MB * 1024 * 1024),
+                 codec: str = DEFAULT_CODEC, chunk_chars: int = TEXT_STORE_CHUNK_CHARS):
+        self.backend = backend
+        self.codec = codec
+        self.chunk_chars = chunk_chars
+        self.cache_bytes = cache_bytes
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    @staticmethod
+    def _name(etag: str) -> str:
+        return etag.strip('"') + '.txs'
+
+    def _cache_get(self, key):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return value
+
+    def _cache_put(self, key, value, size: int):
+        if size > self.cache_bytes:
+            return
+        with self._lock:
+            previous = self._cache.pop(key, None)
+            if previous is not None:
+                self._cache_size -= previous[1]
+            self._cache[key] = (value, size)
+            self._cache_size += size
+            while self._cache_size > self.cache_bytes:
+                _, (_, evicted) = self._cache.popitem(last=False)
+                self._cache_size -= evicted
+
+    def put(self, etag: Optional[str], text: str):
+        if not (self.enabled and etag):
+            return
+        self.backend.put(self._name(etag), encode_text(text, self.codec, self.chunk_chars))
+
+    def has(self, etag: Optional[str]) -> bool:
+        return bool(self.enabled and etag and self.backend.exists(self._name(etag)))
+
+    def open(self, etag: Optional[str]) -> Optional[StoredText]:
+        """Lazy handle on the text of etag, or None if it was never stored"""
+        if not (self.enabled and etag):
+            return None
+        cached = self._cache_get(('index', etag))
+        if cached is not None:
+            index, data_offset = cached[0]
+            return StoredText(self, etag, index, data_offset)
+
+        name = self._name(etag)
+        probe = self.backend.read(name, 0, INDEX_PROBE_BYTES)
+        if not probe:
+            return None
+        magic, index_length = PREAMBLE.unpack_from(probe)
+        if magic != MAGIC:
+            raise ValueError(f'Not a stored text blob: {name}')
+        data_offset = PREAMBLE.size + index_length
+        if len(probe) < data_offset:
+            probe = self.backend.read(name, 0, data_offset)
+        index = json.loads(probe[PREAMBLE.size:data_offset])
+        self._cache_put(('index', etag), (index, data_offset), index_length)
+        return StoredText(self, etag, index, data_offset)
+
+    def get(self, etag: Optional[str]) -> Optional[str]:
+        text = self.open(etag)
+        return text.read() if text is not None else None
+
+    def read_range(self, etag: Optional[str], start: int, end: Optional[int] = None) -> Optional[str]:
+        text = self.open(etag)
+        return text.read(start, end) if text is not None else None
+
+    def _chunks(self, text: StoredText, first: int, last: int) -> List[str]:
+        """Decompressed chunks first..last; missing ones are fetched with a single read"""
+        chunks = {}
+        missing = []
+        for number in range(first, last + 1):
+            cached = self._cache_get(('chunk', text.etag, number))
+            if cached is not None:
+                chunks[number] = cached[0]
+            else:
+                missing.append(number)
+
+        if missing:
+            spans = text.index['chunks']
+            begin = spans[missing[0]][0]
+            end = spans[missing[-1]][0] + spans[missing[-1]][1]
+            data = self.backend.read(self._name(text.etag), text.data_offset + begin, end - begin)
+            if data is None:
+                raise FileNotFoundError(f'Stored text disappeared: {text.etag}')
+            codec = text.index['codec']
+            for number in range(missing[0], missing[-1] + 1):
+                offset, length = spans[number]
+                if number in chunks:
+                    continue
+                chunk = _decompress(data[offset - begin:offset - begin + length], codec).decode('utf-8')
+                chunks[number] = chunk
+                self._cache_put(('chunk', text.etag, number), chunk, len(chunk))
+        return [chunks[number] for number in range(first, last + 1)]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'backend': type(self.backend).__name__ if self.backend else None,
+                'codec': self.codec,
+                'cache_entries': len(self._cache),
+                'cache_bytes': self._cache_size,
+                'cache_limit_bytes': self.cache_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+def create_text_store(s3_client_factory: Callable[[], Any], bucket: Optional[str]) -> TextStore:
+    """Text store configured from TEXT_STORE_* settings"""
+    if TEXT_STORE_BACKEND == 'off':
+        return TextStore(None)
+    if TEXT_STORE_BACKEND == 's3':
+        return TextStore(S3TextBackend(s3_client_factory, bucket, TEXT_STORE_S3_PREFIX))
+    if TEXT_STORE_BACKEND == 'local':
+        return TextStore(LocalTextBackend(TEXT_STORE_PATH))
+    raise ValueError(f'Unknown TEXT_STORE_BACKEND: {TEXT_STORE_BACKEND}')
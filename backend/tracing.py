@@ -0,0 +1,304 @@
+# tracing.py - Lightweight tracing with OpenTelemetry-compatible spans
+import os
+import json
+import time
+import heapq
+import secrets
+import threading
+import contextvars
+from urllib.parse import urlencode
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', '1').lower() not in ('0', 'false', 'no')
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', 500))
+TRACE_EXPORT_PATH = os.getenv('TRACE_EXPORT_PATH')  # optional JSON-lines file
+MAX_SPANS_PER_TRACE = 2000
+# Traces whose root has not ended yet; the oldest are dropped past either limit
+MAX_OPEN_TRACES = int(os.getenv('TRACE_MAX_OPEN', 1000))
+OPEN_TRACE_TTL_SECONDS = float(os.getenv('TRACE_OPEN_TTL_SECONDS', 900))
+# Query parameters that carry credentials are never stored or exported
+REDACTED_QUERY_PARAMS = {'token', 'access_token', 'password', 'username'}
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar('current_span', default=None)
+
+class Span:
+    """One timed operation; to_dict() follows the OTLP JSON span layout"""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_span_id', 'name', 'kind', 'attributes',
+                 'start_ns', 'end_ns', 'status', 'status_message')
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str],
+                 kind: str = 'INTERNAL', attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = 'UNSET'
+        self.status_message = ''
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_exception(self, error: BaseException):
+        self.status = 'ERROR'
+        self.status_message = str(error)[:500]
+        self.attributes['exception.type'] = type(error).__name__
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns or time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_span_id or '',
+            'name': self.name,
+            'kind': f"SPAN_KIND_{self.kind}",
+            'startTimeUnixNano': self.start_ns,
+            'endTimeUnixNano': self.end_ns,
+            'durationMs': round(self.duration_ms, 3),
+            'attributes': self.attributes,
+            'status': {'code': f"STATUS_CODE_{self.status}", 'message': self.status_message}
+        }
+
+class _NoopSpan:
+    trace_id = None
+    span_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def record_exception(self, error):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+class TraceStore:
+    """In-memory exporter keeping the most recent finished traces.
+
+    Spans of traces whose root is still running wait in _open, bounded by
+    MAX_OPEN_TRACES and OPEN_TRACE_TTL_SECONDS. A child span that ends after
+    its root (a detached background call) joins the finished trace instead.
+    """
+
+    def __init__(self, max_traces: int = TRACE_BUFFER_SIZE, export_path: Optional[str] = TRACE_EXPORT_PATH,
+                 max_open: int = MAX_OPEN_TRACES, open_ttl: float = OPEN_TRACE_TTL_SECONDS):
+        self._open: OrderedDict = OrderedDict()  # trace_id -> (first seen, spans)
+        self._finished: deque = deque()
+        self._finished_by_id: Dict[str, Dict[str, Any]] = {}
+        self._max_traces = max_traces
+        self._max_open = max_open
+        self._open_ttl = open_ttl
+        self._lock = threading.Lock()
+        self._export_path = export_path
+        self._export_file = None
+        self._export_lock = threading.Lock()
+
+    def _prune_open(self, now: float):
+        while self._open:
+            trace_id, (first_seen, _) = next(iter(self._open.items()))
+            if len(self._open) <= self._max_open and now - first_seen < self._open_ttl:
+                break
+            del self._open[trace_id]
+
+    def export(self, span: Span):
+        with self._lock:
+            finished = self._finished_by_id.get(span.trace_id)
+            if finished is not None:
+                if len(finished['spans']) < MAX_SPANS_PER_TRACE:
+                    finished['spans'].append(span)
+            else:
+                now = time.monotonic()
+                spans = self._open.setdefault(span.trace_id, (now, []))[1]
+                if len(spans) < MAX_SPANS_PER_TRACE:
+                    spans.append(span)
+                if span.parent_span_id is None:
+                    self._finish(span, self._open.pop(span.trace_id)[1])
+                else:
+                    self._prune_open(now)
+        if self._export_path:
+            self._write(span)
+
+    def _finish(self, root: Span, spans: List[Span]):
+        if len(self._finished) >= self._max_traces:
+            evicted = self._finished.popleft()
+            self._finished_by_id.pop(evicted['trace_id'], None)
+        trace = {
+            'trace_id': root.trace_id,
+            'root': root.name,
+            'duration_ms': round(root.duration_ms, 3),
+            'start_time': root.start_ns / 1e9,
+            'status': root.status,
+            'attributes': root.attributes,
+            'spans': spans
+        }
+        self._finished.append(trace)
+        self._finished_by_id[root.trace_id] = trace
+
+    def _write(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str) + '\n'
+        with self._export_lock:
+            if self._export_file is None:
+                self._export_file = open(self._export_path, 'a', buffering=1)
+            self._export_file.write(line)
+
+    def close(self):
+        with self._export_lock:
+            if self._export_file is not None:
+                self._export_file.close()
+                self._export_file = None
+
+    def slowest(self, limit: int = 20, name: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            traces = [t for t in self._finished if not name or name in t['root']]
+        return [
+            dict({k: v for k, v in trace.items() if k != 'spans'}, span_count=len(trace['spans']))
+            for trace in heapq.nlargest(limit, traces, key=lambda t: t['duration_ms'])
+        ]
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            trace = self._finished_by_id.get(trace_id)
+            if trace is not None:
+                return dict(trace, spans=[span.to_dict() for span in trace['spans']])
+            entry = self._open.get(trace_id)
+            if entry:
+                return {'trace_id': trace_id, 'in_progress': True, 'spans': [s.to_dict() for s in entry[1]]}
+        return None
+
+trace_store = TraceStore()
+
+def start_span(name: str, kind: str = 'INTERNAL', **attributes) -> Span:
+    """Start a span under the current one (or a new trace) without activating it"""
+    parent = _current_span.get()
+    if parent is None:
+        return Span(name, secrets.token_hex(16), None, kind, attributes)
+    return Span(name, parent.trace_id, parent.span_id, kind, attributes)
+
+def end_span(span: Span, error: Optional[BaseException] = None):
+    if error is not None:
+        span.record_exception(error)
+    elif span.status == 'UNSET':
+        span.status = 'OK'
+    span.end_ns = time.time_ns()
+    trace_store.export(span)
+
+@contextmanager
+def span(name: str, kind: str = 'INTERNAL', **attributes):
+    """Time a block as a child span of the current span"""
+    if not TRACING_ENABLED:
+        yield NOOP_SPAN
+        return
+    current = start_span(name, kind, **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        _current_span.reset(token)
+        end_span(current, e)
+        raise
+    _current_span.reset(token)
+    end_span(current)
+
+def traced(name: str):
+    """Decorator form of span()"""
+    def decorator(f):
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return f(*args, **kwargs)
+        wrapper.__name__ = f.__name__
+        wrapper.__doc__ = f.__doc__
+        return wrapper
+    return decorator
+
+def current_trace_id() -> Optional[str]:
+    current = _current_span.get()
+    return current.trace_id if current else None
+
+# boto3 / botocore instrumentation
+
+def _before_boto_call(model, context, **kwargs):
+    context['trace_span'] = start_span(
+        f"aws.{model.service_model.service_name}.{model.name}", 'CLIENT',
+        **{'rpc.system': 'aws-api', 'rpc.method': model.name,
+           'rpc.service': model.service_model.service_name}
+    )
+
+def _after_boto_call(http_response, context, **kwargs):
+    current = context.pop('trace_span', None)
+    if current:
+        status = getattr(http_response, 'status_code', None)
+        current.set_attribute('http.status_code', status)
+        if status and status >= 400:
+            current.status = 'ERROR'
+        end_span(current)
+
+def _after_boto_call_error(context, exception, **kwargs):
+    current = context.pop('trace_span', None)
+    if current:
+        end_span(current, exception)
+
+def instrument_boto3_client(client):
+    """Record a CLIENT span for every API call of a boto3 client"""
+    if TRACING_ENABLED and not getattr(client, '_traced', False):
+        client.meta.events.register('before-call.*.*', _before_boto_call)
+        client.meta.events.register('after-call.*.*', _after_boto_call)
+        client.meta.events.register('after-call-error.*.*', _after_boto_call_error)
+        client._traced = True
+    return client
+
+# Flask instrumentation
+
+def init_app(app):
+    """Wrap each Flask request in a SERVER span and return its trace id"""
+    if not TRACING_ENABLED:
+        return
+    from flask import g, request
+
+    def _target():
+        if not request.args:
+            return request.path
+        query = [(name, '[REDACTED]' if name.lower() in REDACTED_QUERY_PARAMS else value)
+                 for name, value in request.args.items(multi=True)]
+        return f"{request.path}?{urlencode(query)}"
+
+    @app.before_request
+    def _start_request_span():
+        rule = request.url_rule.rule if request.url_rule else request.path
+        current = start_span(f"HTTP {request.method} {rule}", 'SERVER', **{
+            'http.method': request.method,
+            'http.route': rule,
+            'http.target': _target()
+        })
+        g.trace_span = current
+        g.trace_token = _current_span.set(current)
+
+    @app.after_request
+    def _annotate_response(response):
+        current = g.get('trace_span')
+        if current:
+            current.set_attribute('http.status_code', response.status_code)
+            if response.status_code >= 500:
+                current.status = 'ERROR'
+            response.headers['X-Trace-Id'] = current.trace_id
+        return response
+
+    @app.teardown_request
+    def _end_request_span(error=None):
+        current = g.pop('trace_span', None)
+        token = g.pop('trace_token', None)
+        if token is not None:
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                pass  # teardown ran in another context (streamed response)
+        if current:
+            end_span(current, error)
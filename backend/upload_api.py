@@ -0,0 +1,476 @@
+# upload_api.py - Resumable upload sessions and presigned direct-to-S3 uploads
+from flask import Blueprint, request, jsonify
+from models import db, Document, UploadSession
+from werkzeug.utils import secure_filename
+import os
+import uuid
+import base64
+from botocore.exceptions import NoCredentialsError, ClientError
+from auth_api import (
+    auth_required,
+    allowed_file,
+    get_s3_client,
+    checksum_to_sha256,
+    reuse_identical_object,
+    DEPARTMENTS,
+    AWS_S3_BUCKET,
+    AWS_REGION,
+    UPLOAD_CHUNK_SIZE
+)
+
+upload_bp = Blueprint('uploads', __name__)
+
+# S3 multipart limits
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PART_NUMBER = 10000
+
+# Direct-to-S3 upload policy settings
+DIRECT_UPLOAD_MAX_SIZE = int(os.getenv('DIRECT_UPLOAD_MAX_SIZE', 500 * 1024 * 1024))
+DIRECT_UPLOAD_EXPIRES = 900  # seconds
+
+def resolve_upload_department(user, department):
+    """Users upload into their own department; admins may pick any"""
+    department = department or user.department
+    if department not in DEPARTMENTS:
+        return None
+    if user.role != 'admin' and department != user.department:
+        return None
+    return department
+
+def get_session_for_user(session_id):
+    """Load an upload session owned by the current user"""
+    session = UploadSession.query.get(session_id)
+    if not session or session.user_id != request.user.id:
+        return None
+    return session
+
+def list_uploaded_parts(s3_client, session):
+    """List the parts S3 has received for a session, following pagination"""
+    parts = []
+    marker = 0
+    while True:
+        response = s3_client.list_parts(
+            Bucket=AWS_S3_BUCKET,
+            Key=session.s3_key,
+            UploadId=session.upload_id,
+            PartNumberMarker=marker
+        )
+        for part in response.get('Parts', []):
+            parts.append({
+                'part_number': part['PartNumber'],
+                'etag': part['ETag'],
+                'checksum_sha256': part.get('ChecksumSHA256'),
+                'size': part['Size']
+            })
+        if not response.get('IsTruncated'):
+            break
+        marker = response['NextPartNumberMarker']
+    return parts
+
+@upload_bp.route('/upload-sessions', methods=['POST'])
+@auth_required()
+def initiate_upload_session():
+    try:
+        user = request.user
+        data = request.get_json() or {}
+
+        filename = secure_filename(data.get('filename', ''))
+        if not filename:
+            return jsonify({'error': 'Filename required'}), 400
+
+        if not allowed_file(filename):
+            return jsonify({'error': 'File type not allowed'}), 400
+
+        department = resolve_upload_department(user, data.get('department'))
+        if not department:
+            return jsonify({'error': 'Invalid department'}), 400
+
+        part_size = max(int(data.get('part_size') or UPLOAD_CHUNK_SIZE), MIN_PART_SIZE)
+        content_type = data.get('content_type') or 'application/octet-stream'
+        s3_key = f"uploads/{department}/{uuid.uuid4().hex}_{filename}"
+
+        s3_client = get_s3_client()
+        upload = s3_client.create_multipart_upload(
+            Bucket=AWS_S3_BUCKET,
+            Key=s3_key,
+            ContentType=content_type,
+            ChecksumAlgorithm='SHA256',
+            Metadata={
+                'uploaded-by': user.username,
+                'department': department,
+                'category': data.get('category', ''),
+                'original-filename': filename,
+                'processed': 'false'
+            }
+        )
+
+        session = UploadSession(
+            id=uuid.uuid4().hex,
+            user_id=user.id,
+            filename=filename,
+            title=data.get('title', ''),
+            description=data.get('description', ''),
+            department=department,
+            category=data.get('category', ''),
+            tags=data.get('tags', ''),
+            content_type=content_type,
+            s3_key=s3_key,
+            upload_id=upload['UploadId'],
+            expected_size=data.get('size'),
+            part_size=part_size,
+            status='open'
+        )
+        db.session.add(session)
+        db.session.commit()
+
+        print(f"📤 Upload session {session.id} started for {s3_key}")
+
+        return jsonify({
+            'message': 'Upload session created',
+            'session': session.to_dict(),
+            'max_part_number': MAX_PART_NUMBER
+        }), 201
+
+    except NoCredentialsError:
+        return jsonify({'error': 'AWS credentials not available'}), 500
+    except ClientError as e:
+        return jsonify({'error': f'S3 upload error: {str(e)}'}), 500
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@upload_bp.route('/upload-sessions/<session_id>/parts/<int:part_number>', methods=['PUT'])
+@auth_required()
+def upload_session_part(session_id, part_number):
+    try:
+        session = get_session_for_user(session_id)
+        if not session:
+            return jsonify({'error': 'Upload session not found'}), 404
+
+        if session.status != 'open':
+            return jsonify({'error': f'Upload session is {session.status}'}), 409
+
+        if part_number < 1 or part_number > MAX_PART_NUMBER:
+            return jsonify({'error': f'Part number must be between 1 and {MAX_PART_NUMBER}'}), 400
+
+        content_length = request.content_length
+        if not content_length:
+            return jsonify({'error': 'Part body required'}), 400
+
+        # Parts are independent S3 uploads, so clients may send them in parallel
+        s3_client = get_s3_client()
+        response = s3_client.upload_part(
+            Bucket=AWS_S3_BUCKET,
+            Key=session.s3_key,
+            UploadId=session.upload_id,
+            PartNumber=part_number,
+            Body=request.stream,
+            ContentLength=content_length,
+            ChecksumAlgorithm='SHA256'
+        )
+
+        return jsonify({
+            'part_number': part_number,
+            'etag': response['ETag'],
+            'size': content_length
+        })
+
+    except ClientError as e:
+        return jsonify({'error': f'S3 upload error: {str(e)}'}), 500
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@upload_bp.route('/upload-sessions/<session_id>', methods=['GET'])
+@auth_required()
+def get_upload_session(session_id):
+    try:
+        session = get_session_for_user(session_id)
+        if not session:
+            return jsonify({'error': 'Upload session not found'}), 404
+
+        parts = []
+        if session.status == 'open':
+            parts = list_uploaded_parts(get_s3_client(), session)
+
+        return jsonify({
+            'session': session.to_dict(),
+            'parts': parts,
+            'received_bytes': sum(part['size'] for part in parts)
+        })
+
+    except ClientError as e:
+        return jsonify({'error': f'S3 error: {str(e)}'}), 500
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@upload_bp.route('/upload-sessions/<session_id>/complete', methods=['POST'])
+@auth_required()
+def complete_upload_session(session_id):
+    try:
+        user = request.user
+        session = get_session_for_user(session_id)
+        if not session:
+            return jsonify({'error': 'Upload session not found'}), 404
+
+        if session.status == 'completed':
+            document = Document.query.get(session.document_id)
+            return jsonify({
+                'message': 'Upload already completed',
+                'document': document.to_dict() if document else None
+            })
+
+        if session.status != 'open':
+            return jsonify({'error': f'Upload session is {session.status}'}), 409
+
+        s3_client = get_s3_client()
+        parts = list_uploaded_parts(s3_client, session)
+        if not parts:
+            return jsonify({'error': 'No parts uploaded'}), 400
+
+        # Clients may pass the part count they sent to guard against gaps
+        data = request.get_json(silent=True) or {}
+        expected_parts = data.get('parts')
+        part_numbers = [part['part_number'] for part in parts]
+        if expected_parts and part_numbers != list(range(1, int(expected_parts) + 1)):
+            missing = sorted(set(range(1, int(expected_parts) + 1)) - set(part_numbers))
+            return jsonify({'error': 'Missing parts', 'missing_parts': missing}), 409
+
+        completed_parts = []
+        for part in parts:
+            completed = {'PartNumber': part['part_number'], 'ETag': part['etag']}
+            if part['checksum_sha256']:
+                completed['ChecksumSHA256'] = part['checksum_sha256']
+            completed_parts.append(completed)
+        result = s3_client.complete_multipart_upload(
+            Bucket=AWS_S3_BUCKET,
+            Key=session.s3_key,
+            UploadId=session.upload_id,
+            MultipartUpload={'Parts': completed_parts}
+        )
+
+        # S3 checksums the parts as they arrive, so duplicate detection never reads the object back
+        content_sha256 = checksum_to_sha256(result.get('ChecksumSHA256'))
+        s3_url, s3_key, existing = reuse_identical_object(
+            s3_client, session.department, content_sha256, session.s3_key)
+
+        # The Document row only exists once the object is complete
+        document = Document(
+            title=session.title or session.filename,
+            description=session.description,
+            filename=session.filename,
+            file_path=s3_url,
+            file_size=sum(part['size'] for part in parts),
+            file_type=session.filename.rsplit('.', 1)[1].lower(),
+            department=session.department,
+            category=session.category,
+            tags=session.tags,
+            uploaded_by=user.id,
+            status='active',
+            content_sha256=content_sha256
+        )
+        db.session.add(document)
+        db.session.flush()
+
+        session.status = 'completed'
+        session.document_id = document.id
+        db.session.commit()
+
+        print(f"✅ Upload session {session.id} completed as document {document.id}")
+
+        return jsonify({
+            'message': 'File uploaded to S3 successfully',
+            'document': document.to_dict(),
+            's3_url': s3_url,
+            's3_key': s3_key,
+            'duplicate': bool(existing)
+        }), 201
+
+    except ClientError as e:
+        db.session.rollback()
+        return jsonify({'error': f'S3 upload error: {str(e)}'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@upload_bp.route('/upload-sessions/<session_id>', methods=['DELETE'])
+@auth_required()
+def abort_upload_session(session_id):
+    try:
+        session = get_session_for_user(session_id)
+        if not session:
+            return jsonify({'error': 'Upload session not found'}), 404
+
+        if session.status != 'open':
+            return jsonify({'error': f'Upload session is {session.status}'}), 409
+
+        get_s3_client().abort_multipart_upload(
+            Bucket=AWS_S3_BUCKET,
+            Key=session.s3_key,
+            UploadId=session.upload_id
+        )
+        session.status = 'aborted'
+        db.session.commit()
+
+        return jsonify({'message': 'Upload session aborted', 'session': session.to_dict()})
+
+    except ClientError as e:
+        db.session.rollback()
+        return jsonify({'error': f'S3 error: {str(e)}'}), 500
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@upload_bp.route('/upload-s3/presign', methods=['POST'])
+@auth_required()
+def presign_direct_upload():
+    try:
+        user = request.user
+        data = request.get_json() or {}
+
+        filename = secure_filename(data.get('filename', ''))
+        if not filename:
+            return jsonify({'error': 'Filename required'}), 400
+
+        if not allowed_file(filename):
+            return jsonify({'error': 'File type not allowed'}), 400
+
+        department = resolve_upload_department(user, data.get('department'))
+        if not department:
+            return jsonify({'error': 'Invalid department'}), 400
+
+        size = data.get('size')
+        if size is not None and (int(size) <= 0 or int(size) > DIRECT_UPLOAD_MAX_SIZE):
+            return jsonify({'error': f'File size must be between 1 and {DIRECT_UPLOAD_MAX_SIZE} bytes'}), 400
+
+        # With the file's SHA-256, S3 rejects a body that does not match it and keeps it
+        # as the object's checksum for duplicate detection at completion
+        checksum = None
+        if data.get('sha256'):
+            try:
+                digest = bytes.fromhex(data['sha256'])
+            except (TypeError, ValueError):
+                digest = b''
+            if len(digest) != 32:
+                return jsonify({'error': 'sha256 must be a hex SHA-256 digest'}), 400
+            checksum = base64.b64encode(digest).decode()
+
+        content_type = data.get('content_type') or 'application/octet-stream'
+        key_prefix = f"uploads/{department}/"
+        s3_key = f"{key_prefix}{uuid.uuid4().hex}_{filename}"
+
+        # Every field is pinned by the policy, so the browser cannot change them
+        fields = {
+            'Content-Type': content_type,
+            'x-amz-meta-uploaded-by': user.username,
+            'x-amz-meta-department': department,
+            'x-amz-meta-category': data.get('category', ''),
+            'x-amz-meta-original-filename': filename,
+            'x-amz-meta-processed': 'false'
+        }
+        if checksum:
+            fields['x-amz-checksum-algorithm'] = 'SHA256'
+            fields['x-amz-checksum-sha256'] = checksum
+        conditions = [
+            ['content-length-range', 1, DIRECT_UPLOAD_MAX_SIZE],
+            ['starts-with', '$key', key_prefix]
+        ] + [{name: value} for name, value in fields.items()]
+
+        presigned = get_s3_client().generate_presigned_post(
+            Bucket=AWS_S3_BUCKET,
+            Key=s3_key,
+            Fields=fields,
+            Conditions=conditions,
+            ExpiresIn=DIRECT_UPLOAD_EXPIRES
+        )
+
+        return jsonify({
+            'url': presigned['url'],
+            'fields': presigned['fields'],
+            's3_key': s3_key,
+            'max_size': DIRECT_UPLOAD_MAX_SIZE,
+            'expires_in': DIRECT_UPLOAD_EXPIRES
+        })
+
+    except NoCredentialsError:
+        return jsonify({'error': 'AWS credentials not available'}), 500
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@upload_bp.route('/upload-s3/complete', methods=['POST'])
+@auth_required()
+def complete_direct_upload():
+    try:
+        user = request.user
+        data = request.get_json() or {}
+
+        s3_key = data.get('s3_key', '')
+        parts = s3_key.split('/')
+        if len(parts) != 3 or parts[0] != 'uploads':
+            return jsonify({'error': 'Invalid S3 key'}), 400
+
+        department = resolve_upload_department(user, parts[1])
+        if not department:
+            return jsonify({'error': 'Access denied'}), 403
+
+        s3_url = f"https://{AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
+
+        # Completing twice returns the same document
+        existing = Document.query.filter_by(file_path=s3_url).first()
+        if existing:
+            return jsonify({
+                'message': 'Upload already registered',
+                'document': existing.to_dict(),
+                's3_url': s3_url,
+                's3_key': s3_key
+            })
+
+        try:
+            head = get_s3_client().head_object(Bucket=AWS_S3_BUCKET, Key=s3_key, ChecksumMode='ENABLED')
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return jsonify({'error': 'Uploaded object not found'}), 404
+            raise
+
+        metadata = head.get('Metadata', {})
+        if metadata.get('uploaded-by') != user.username:
+            return jsonify({'error': 'Access denied'}), 403
+
+        filename = metadata.get('original-filename') or parts[2].split('_', 1)[-1]
+
+        # Recorded so later uploads of the same content are detected; the object is kept
+        # because retried completions look the document up by its URL. Present only when
+        # the presign request included the file's sha256, which S3 verified on upload.
+        content_sha256 = checksum_to_sha256(head.get('ChecksumSHA256'))
+
+        document = Document(
+            title=data.get('title') or filename,
+            description=data.get('description', ''),
+            filename=filename,
+            file_path=s3_url,
+            file_size=head['ContentLength'],
+            file_type=filename.rsplit('.', 1)[1].lower() if '.' in filename else '',
+            department=department,
+            category=data.get('category', metadata.get('category', '')),
+            tags=data.get('tags', ''),
+            uploaded_by=user.id,
+            status='active',
+            content_sha256=content_sha256
+        )
+        db.session.add(document)
+        db.session.commit()
+
+        print(f"✅ Direct upload registered: {s3_key} -> document {document.id}")
+
+        return jsonify({
+            'message': 'File uploaded to S3 successfully',
+            'document': document.to_dict(),
+            's3_url': s3_url,
+            's3_key': s3_key
+        }), 201
+
+    except ClientError as e:
+        db.session.rollback()
+        return jsonify({'error': f'S3 error: {str(e)}'}), 500
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,91 @@
+# url_cache.py - Expiry-aware LRU cache for presigned S3 URLs
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional
+
+PRESIGNED_URL_EXPIRES = 3600  # seconds
+PRESIGNED_URL_MIN_REMAINING = int(os.getenv('PRESIGNED_URL_MIN_REMAINING', 600))
+PRESIGNED_URL_CACHE_SIZE = int(os.getenv('PRESIGNED_URL_CACHE_SIZE', 4096))
+
+class PresignedUrlCache:
+    """LRU cache of presigned URLs keyed by (s3 key, operation, user scope, lifetime).
+
+    A cached URL is only handed out while it still has at least
+    min_remaining seconds (at most half its lifetime) of validity, so
+    clients never receive a URL that expires moments later. sign is called
+    as sign(s3_key, expires_in).
+    """
+
+    def __init__(self, max_size: int = PRESIGNED_URL_CACHE_SIZE,
+                 min_remaining: int = PRESIGNED_URL_MIN_REMAINING):
+        self.max_size = max_size
+        self.min_remaining = min_remaining
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, cache_key, now: float, min_remaining: float) -> Optional[str]:
+        entry = self._entries.get(cache_key)
+        if entry is None:
+            return None
+        url, expires_at = entry
+        if expires_at - now < min_remaining:
+            del self._entries[cache_key]
+            return None
+        self._entries.move_to_end(cache_key)
+        return url
+
+    def _store(self, cache_key, url: str, expires_at: float):
+        self._entries[cache_key] = (url, expires_at)
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get_or_sign(self, s3_key: str, operation: str, scope: str,
+                    sign: Callable[[str, int], str], expires_in: int = PRESIGNED_URL_EXPIRES) -> str:
+        """Return a cached URL for s3_key or sign and cache a new one"""
+        return self.get_or_sign_many([s3_key], operation, scope, sign, expires_in)[s3_key]
+
+    def get_or_sign_many(self, s3_keys: Iterable[str], operation: str, scope: str,
+                         sign: Callable[[str, int], str], expires_in: int = PRESIGNED_URL_EXPIRES) -> Dict[str, str]:
+        """Resolve URLs for a page of keys, signing only the misses"""
+        now = time.time()
+        min_remaining = min(self.min_remaining, expires_in / 2)
+        urls: Dict[str, str] = {}
+        missing = []
+        with self._lock:
+            for s3_key in s3_keys:
+                if s3_key in urls:
+                    continue
+                url = self._lookup((s3_key, operation, scope, expires_in), now, min_remaining)
+                if url:
+                    urls[s3_key] = url
+                    self.hits += 1
+                else:
+                    missing.append(s3_key)
+                    self.misses += 1
+
+        # Signing is local HMAC work, done outside the lock
+        signed = {s3_key: sign(s3_key, expires_in) for s3_key in dict.fromkeys(missing)}
+        expires_at = now + expires_in
+
+        with self._lock:
+            for s3_key, url in signed.items():
+                self._store((s3_key, operation, scope, expires_in), url, expires_at)
+        urls.update(signed)
+        return urls
+
+    def invalidate(self, s3_key: str):
+        """Drop every cached URL for a key (called when the object is deleted or moved)"""
+        with self._lock:
+            for cache_key in [k for k in self._entries if k[0] == s3_key]:
+                del self._entries[cache_key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+presigned_url_cache = PresignedUrlCache()
@@ -0,0 +1,63 @@
+# versioning.py - Cheap version tokens and ETag / conditional GET support
+import time
+import hashlib
+from typing import Callable, Iterable, Optional
+from flask import request, make_response
+from sqlalchemy import func
+from models import db, Document, ProcessedDocument
+
+# Responses that embed live S3 listings are re-validated at least this often
+S3_LISTING_VERSION_SECONDS = 60
+
+def table_version(model, department: Optional[str] = None) -> str:
+    """Row count plus newest updated_at of a table, optionally per department"""
+    query = db.session.query(func.count(model.id), func.max(model.updated_at))
+    if department:
+        query = query.filter(model.department == department)
+    count, last_updated = query.one()
+    return f"{count}:{last_updated.isoformat() if last_updated else '-'}"
+
+def processed_documents_version(department: Optional[str] = None) -> str:
+    return table_version(ProcessedDocument, department)
+
+def documents_version(department: Optional[str] = None) -> str:
+    return table_version(Document, department)
+
+def time_bucket(seconds: int) -> str:
+    """Token that changes every `seconds`, for data the DB cannot version"""
+    return str(int(time.time() // seconds))
+
+def make_etag(parts: Iterable[str]) -> str:
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+def conditional_get(version_parts: Callable[..., Iterable[str]]):
+    """Decorator answering If-None-Match with 304 before the view runs.
+
+    version_parts receives the view arguments and returns the cheap version
+    components of the response. The ETag also covers the request path,
+    query string and the caller's role and department. Apply it below the
+    auth decorator so request.user is set.
+    """
+    def decorator(f):
+        def wrapper(*args, **kwargs):
+            user = request.user
+            etag = make_etag([
+                request.full_path,
+                user.role,
+                user.department,
+                *version_parts(*args, **kwargs)
+            ])
+
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+                response.set_etag(etag, weak=True)
+                return response
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag, weak=True)
+                response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        wrapper.__name__ = f.__name__
+        return wrapper
+    return decorator
@@ -62,6 +62,10 @@ export const processingAPI = {
   processDocuments: (formData) => apiFormRequest('/processing/process-documents', formData),
   getDepartmentDocuments: (department) => apiRequest(`/processing/department-documents/${department}`),
   getDocumentDetails: (docId) => apiRequest(`/processing/document/${docId}`),
+  askQuestion: (question, department) => apiRequest('/processing/ask', {
+    method: 'POST',
+    body: JSON.stringify({ question, department }),
+  }),
 };
 
 export const authAPI = {
@@ -220,6 +220,30 @@ const DepartmentDashboard = ({ userProfile }) => {
     }
   }, [userProfile?.department]);
 
+  // Live processing progress for this department (Server-Sent Events)
+  useEffect(() => {
+    const token = localStorage.getItem('userToken');
+    if (!userProfile?.department || !token || token === 'null') return;
+
+    const params = new URLSearchParams({ department: userProfile.department, access_token: token });
+    const source = new EventSource(`http://localhost:5000/api/processing/events?${params}`);
+
+    source.addEventListener('progress', (message) => {
+      const event = JSON.parse(message.data);
+      if (event.stage === 'saved') {
+        fetchDepartmentDocuments();
+        return;
+      }
+      setDocuments(prev => prev.map(doc =>
+        doc.s3_key && doc.s3_key === event.s3_key
+          ? { ...doc, status: event.stage === 'failed' ? 'failed' : `processing (${event.stage})` }
+          : doc
+      ));
+    });
+
+    return () => source.close();
+  }, [userProfile?.department]);
+
   const filteredDocuments = documents.filter(doc => {
     // Apply filter
     if (filter === 'high') return doc.priority === 'high';
@@ -383,12 +407,11 @@ const DepartmentDashboard = ({ userProfile }) => {
             'Content-Type': 'application/json',
             'Authorization': `Basic ${btoa(`${userData.username}:${userData.password}`)}`
           },
-          body: JSON.stringify({ s3_key: doc.s3_key })
+          body: JSON.stringify({ s3_key: doc.s3_key, background: true })
         });
         
         if (response.ok) {
-          alert('Document sent for processing! Refresh to see updated status.');
-          fetchDepartmentDocuments(); // Refresh the list
+          alert('Document sent for processing! Its status will update here as it progresses.');
         } else {
           alert('Failed to process document');
         }